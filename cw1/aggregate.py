@@ -0,0 +1,165 @@
+''' Rolling-window metrics per device, updated incrementally
+    each window keeps the per-reading increments (steps, calories, walking
+    time) in a deque with running sums, and the temperatures in monotonic
+    deques for min/max plus a running sum for the mean. A reading appends once
+    and drops what fell out of the window, so an update is O(1) amortised
+    whatever the window length. Step and calorie counters are turned into
+    increments, so a device that restarts from 0 does not produce a negative
+    rate
+
+        agg = Aggregator()              # 1 min, 15 min and 1 h windows
+        agg.update('LLLJ', t, {'steps': 120, 'temp': 33.1, 'cal': 4.5})
+        agg.metrics('LLLJ')['60']['steps_per_min']
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from collections import deque
+import threading
+import time
+
+import payload
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+WINDOWS = (60, 900, 3600)   # unit: s
+MAX_STEP_GAP = 30           # unit: s. Longer gaps between step counts are not
+                            #   counted as walking time for the cadence
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Window:
+    def __init__(self, span):
+        self.span = span            # unit: s
+        self._incs = deque()        # (t, steps, cal, walking s)
+        self.steps = 0              # sums over the window
+        self.cal = 0.0
+        self.walking = 0.0
+        self._temps = deque()       # (t, temp)
+        self._temp_sum = 0.0
+        self._tmin = deque()        # (t, temp), temps increasing
+        self._tmax = deque()        # (t, temp), temps decreasing
+        self._first_t = None        # first reading, for windows not yet full
+
+    def add(self, t, steps, cal, walking):
+        if self._first_t is None:
+            self._first_t = t
+        if steps or cal or walking:
+            self._incs.append((t, steps, cal, walking))
+            self.steps += steps
+            self.cal += cal
+            self.walking += walking
+
+    def add_temp(self, t, temp):
+        if self._first_t is None:
+            self._first_t = t
+        self._temps.append((t, temp))
+        self._temp_sum += temp
+        while self._tmin and self._tmin[-1][1] >= temp:
+            self._tmin.pop()
+        self._tmin.append((t, temp))
+        while self._tmax and self._tmax[-1][1] <= temp:
+            self._tmax.pop()
+        self._tmax.append((t, temp))
+
+    def expire(self, now):          # drop what is older than now - span
+        start = now - self.span
+        incs = self._incs
+        while incs and incs[0][0] <= start:
+            _, steps, cal, walking = incs.popleft()
+            self.steps -= steps
+            self.cal -= cal
+            self.walking -= walking
+        temps = self._temps
+        while temps and temps[0][0] <= start:
+            self._temp_sum -= temps.popleft()[1]
+        while self._tmin and self._tmin[0][0] <= start:
+            self._tmin.popleft()
+        while self._tmax and self._tmax[0][0] <= start:
+            self._tmax.popleft()
+
+    def metrics(self, now):
+        covered = self.span if self._first_t is None else \
+            max(1, min(self.span, now - self._first_t))
+        m = {'steps': self.steps,
+             'steps_per_min': self.steps * 60 / covered,
+             'cadence': self.steps * 60 / self.walking if self.walking else 0.0,
+             'cal_per_hour': self.cal * 3600 / covered,
+             'temp_min': None, 'temp_max': None, 'temp_mean': None}
+        if self._temps:
+            m['temp_min'] = self._tmin[0][1]
+            m['temp_max'] = self._tmax[0][1]
+            m['temp_mean'] = self._temp_sum / len(self._temps)
+        return m
+
+
+class DeviceMetrics:
+    def __init__(self, spans = WINDOWS):
+        self.windows = [Window(span) for span in spans]
+        self.t = None               # latest reading time
+        self._steps = None          # last counter values and when seen
+        self._cal = None
+        self._steps_t = None
+        self._lock = threading.Lock()   # updates come from one ingest worker,
+                                        #   metrics() from any thread
+
+    def update(self, t, reading):
+        with self._lock:
+            self._update(t, reading)
+
+    def _update(self, t, reading):
+        steps = cal = walking = 0
+        if 'steps' in reading:
+            s = reading['steps']
+            if self._steps is not None:
+                steps = s - self._steps if s >= self._steps else s  # restarted
+                if steps and t - self._steps_t <= MAX_STEP_GAP:
+                    walking = t - self._steps_t
+            self._steps = s
+            self._steps_t = t
+        if 'cal' in reading:
+            c = reading['cal']
+            if self._cal is not None:
+                cal = c - self._cal if c >= self._cal else c
+            self._cal = c
+        if self.t is None or t > self.t:
+            self.t = t
+        for w in self.windows:
+            w.add(t, steps, cal, walking)
+            if 'temp' in reading:
+                w.add_temp(t, reading['temp'])
+            w.expire(self.t)
+
+    def metrics(self, now = None):  # {'60': {...}, '900': {...}, '3600': {...}}
+        with self._lock:
+            now = self.t if now is None else now
+            result = {}
+            for w in self.windows:
+                w.expire(now)
+                result[str(w.span)] = w.metrics(now)
+            return result
+
+
+class Aggregator:
+    def __init__(self, spans = WINDOWS):
+        self.spans = spans
+        self.devices = {}           # device id -> DeviceMetrics
+        self._lock = threading.Lock()
+
+    def update(self, device_id, t, reading):
+        d = self.devices.get(device_id)
+        if d is None:
+            with self._lock:
+                d = self.devices.setdefault(device_id, DeviceMetrics(self.spans))
+        d.update(t, reading)
+
+    def sink(self, device, reading):    # ingest.Ingest sink
+        t = payload.unix_time(reading['ts']) if 'ts' in reading \
+            else device.last_seen or time.time()
+        self.update(device.id, t, reading)
+
+    def metrics(self, device_id, now = None):
+        return self.devices[device_id].metrics(now)
@@ -0,0 +1,147 @@
+''' On-device diagnostics: hot-path timers, counters and heap telemetry
+    instrument() replaces a module function with a wrapper that times every
+    call with ticks_us() and counts the calls that raised OSError. The wrapper
+    takes the function's number of arguments (nargs, 0 to 2), so calling it
+    allocates no argument tuple. Calls, errors,
+    total and longest time of each timer, and the counters, live in
+    preallocated arrays, so recording allocates nothing. report() returns a
+    compact JSON summary of the interval since the last report (loop rate, mean
+    and longest time per timer, counters, free heap) and starts a new interval
+
+    nothing is wrapped unless instrument() is called, so diagnostics cost
+    nothing when they are disabled
+
+        diag.instrument(lis3dh, 'get_steps', diag.T_STEPS, diag.C_I2C_ERRORS)
+        ...
+        mp.send(mp.DIAG_TOPIC, diag.report())
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from array import array
+import gc
+import ujson
+import utime
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+# timers
+T_STEPS = 0         # lis3dh.get_steps(): one per sampling loop
+T_TEMP = 1          # tmp007.read_obj_temp_c()
+T_PUBLISH = 2       # mqttpublisher.publish(), includes the poll() it makes
+T_POLL = 3          # mqttpublisher.poll()
+TIMER_NAMES = ('steps', 'temp', 'publish', 'poll')
+
+# counters
+C_I2C_ERRORS = 0    # OSError from the sensor functions
+C_NET_ERRORS = 1    # OSError from the publisher functions
+C_REPORTS = 2       # reports made
+C_REPORTS_LOST = 3  # reports that could not be sent
+COUNTER_NAMES = ('i2c_err', 'net_err', 'reports', 'reports_lost')
+
+_CALLS = 0          # fields per timer in _timers
+_ERRORS = 1
+_TOTAL_US = 2
+_MAX_US = 3
+_FIELDS = 4
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+_timers = array('L', [0] * (_FIELDS * len(TIMER_NAMES)))
+counters = array('L', [0] * len(COUNTER_NAMES))
+heap_min = None     # least free heap seen by report(), unit: bytes
+_start_tick = utime.ticks_ms()  # start of the interval being recorded
+_boot_tick = _start_tick
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def instrument(module, name, timer, error_counter = None, nargs = 0):
+    func = getattr(module, name)
+    base = _FIELDS * timer
+
+    # a wrapper per arity (nargs: positional arguments of func), as a
+    #   *args wrapper would allocate a tuple on every call
+    if nargs == 0:
+        def timed():
+            t0 = utime.ticks_us()
+            try:
+                return func()
+            except OSError:
+                _failed(base, error_counter)
+                raise
+            finally:
+                _timed(base, t0)
+    elif nargs == 1:
+        def timed(a):
+            t0 = utime.ticks_us()
+            try:
+                return func(a)
+            except OSError:
+                _failed(base, error_counter)
+                raise
+            finally:
+                _timed(base, t0)
+    elif nargs == 2:
+        def timed(a, b):
+            t0 = utime.ticks_us()
+            try:
+                return func(a, b)
+            except OSError:
+                _failed(base, error_counter)
+                raise
+            finally:
+                _timed(base, t0)
+    else:
+        raise ValueError('nargs must be 0, 1 or 2')
+
+    setattr(module, name, timed)    # callers look it up in the module
+    return timed
+
+def count(counter, n = 1):
+    counters[counter] += n
+
+def report(extra = None):   # JSON summary of the interval, then a new interval
+    global heap_min, _start_tick
+    now = utime.ticks_ms()
+    interval_ms = max(1, utime.ticks_diff(now, _start_tick))
+    _start_tick = now
+    counters[C_REPORTS] += 1
+
+    free = gc.mem_free()
+    if heap_min is None or free < heap_min:
+        heap_min = free
+    steps_calls = _timers[_FIELDS * T_STEPS + _CALLS]
+    d = {'up': utime.ticks_diff(now, _boot_tick) // 1000,  # unit: s
+         'ms': interval_ms,
+         'loop_hz': round(steps_calls * 1000 / interval_ms, 1),
+         'heap': [free, heap_min, gc.mem_alloc()]}
+    for i in range(len(TIMER_NAMES)):   # [calls, errors, mean us, max us]
+        base = _FIELDS * i
+        calls = _timers[base + _CALLS]
+        if calls:
+            d[TIMER_NAMES[i]] = [calls, _timers[base + _ERRORS],
+                _timers[base + _TOTAL_US] // calls, _timers[base + _MAX_US]]
+        for j in range(_FIELDS):
+            _timers[base + j] = 0
+    for i in range(len(COUNTER_NAMES)):
+        d[COUNTER_NAMES[i]] = counters[i]
+    if extra:
+        d.update(extra)
+    return ujson.dumps(d)
+
+# private
+def _failed(base, error_counter):
+    _timers[base + _ERRORS] += 1
+    if error_counter is not None:
+        counters[error_counter] += 1
+
+def _timed(base, t0):
+    dt = utime.ticks_diff(utime.ticks_us(), t0)
+    _timers[base + _CALLS] += 1
+    _timers[base + _TOTAL_US] += dt
+    if dt > _timers[base + _MAX_US]:
+        _timers[base + _MAX_US] = dt
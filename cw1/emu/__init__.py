@@ -0,0 +1,262 @@
+''' CPython hardware emulation for the cw1 firmware
+    install() puts stand-ins for the MicroPython modules (machine, utime,
+    network, micropython, ujson, usocket, umqtt.simple) on sys.path, backed by
+    a simulated board: a virtual clock, an I2C bus with an LIS3DH and a TMP007,
+    GPIO lines wired to the sensor interrupt outputs, a Wi-Fi station and an
+    in-process MQTT broker. The firmware modules then import and run unmodified.
+    The working directory is changed to a scratch directory that stands in for
+    the board's flash filesystem
+
+        import emu
+        sim = emu.install(speed = 0, stop_after_s = 60)
+        import lis3dh
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import gc
+import os
+import sys
+import tempfile
+
+from emu.broker import Broker
+from emu.clock import SimulationEnd, VirtualClock
+from emu.devices import SimI2CBus, SimLIS3DH, SimTMP007, Skin, Walk
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+CW1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAP_SIZE = 40960           # unit: bytes. Approximate ESP8266 user heap
+SCHEDULE_DEPTH = 8          # micropython.schedule() queue length
+
+IRQ_RISING = 1
+IRQ_FALLING = 2
+
+# default wiring: ESP8266 GPIO -> (device, output line)
+WIRING = {12: ('lis3dh', 'int1'),
+          13: ('lis3dh', 'int2'),
+          14: ('tmp007', 'alert')}
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+sim = None                  # the board the stand-in modules talk to
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Wlan:
+    def __init__(self, essid = 'EEERover', password = 'exhibition',
+            connect_s = 2.0):
+        self.essid = essid
+        self.password = password
+        self.connect_s = connect_s  # unit: s. Association time
+        self.up = True              # access point reachable
+        self.active = False
+        self.radio_us = 0           # time spent with the interface active
+        self._active_since_us = None
+        self._connected_at_us = None
+
+    def set_active(self, now_us, active):
+        if active and self._active_since_us is None:
+            self._active_since_us = now_us
+        elif not active and self._active_since_us is not None:
+            self.radio_us += now_us - self._active_since_us
+            self._active_since_us = None
+            self._connected_at_us = None    # the association is dropped
+        self.active = active
+
+    def radio_s(self, now_us):
+        us = self.radio_us
+        if self._active_since_us is not None:
+            us += now_us - self._active_since_us
+        return us / 1000000
+
+    def connect(self, now_us, essid, password):
+        if self._connected_at_us is None and self.up and \
+                essid == self.essid and password == self.password:
+            self._connected_at_us = now_us + int(self.connect_s * 1000000)
+
+    def disconnect(self):
+        self._connected_at_us = None
+
+    def set_up(self, up):
+        self.up = up
+        if not up:
+            self._connected_at_us = None
+
+    def isconnected(self, now_us):
+        return self.active and self.up and \
+            self._connected_at_us is not None and now_us >= self._connected_at_us
+
+
+class GpioLine:
+    def __init__(self, source = None):
+        self.source = source        # callable returning the input level
+        self.driven = 0             # level when used as an output
+        self.handler = None
+        self.trigger = 0
+        self.pin = None             # Pin object passed to the handler
+        self.level = 0
+
+    def value(self):
+        if self.source is not None:
+            return self.source()
+        return self.driven
+
+
+class Sim:
+    def __init__(self, speed = 0, stop_after_s = None, motion = None,
+            temperature = None, quantum_us = 20):
+        self.clock = VirtualClock(speed, quantum_us, stop_after_s)
+        self.bus = SimI2CBus()
+        self.lis3dh = SimLIS3DH(motion or Walk())
+        self.tmp007 = SimTMP007(temperature or Skin())
+        self.bus.attach(self.lis3dh)
+        self.bus.attach(self.tmp007)
+        self.broker = Broker()
+        self.wlan = Wlan()
+        self.rtc_offset_s = 0       # wall clock (s since 2000) at virtual 0
+        self.gpio = {}
+        for pin_id, (device, line) in WIRING.items():
+            self.gpio[pin_id] = GpioLine(getattr(getattr(self, device), line))
+        self.scheduled = []         # micropython.schedule() queue
+        self.irq_count = 0
+        self.idle_us = 0            # virtual time spent in idle/sleep
+        self.lightsleep_us = 0      # of which in machine.lightsleep()
+        self.actions = []           # (t_us, func) run at virtual times, sorted
+        self._in_scheduled = False
+
+    # time
+    def now_us(self):
+        return self.clock.now_us()
+
+    def poll(self):             # bring the board up to now, then run pending work
+        if self.clock.expired():
+            raise SimulationEnd()
+        now = self.clock.now_us()
+        while self.actions and self.actions[0][0] <= now:
+            self.actions.pop(0)[1]()
+        self.lis3dh.sync(now)
+        self.tmp007.sync(now)
+        self.check_irqs()
+        self.run_scheduled()
+
+    def read_clock(self):       # firmware read of ticks / time
+        self.clock.step()
+        self.poll()
+        return self.clock.now_us()
+
+    def sleep_us(self, us):
+        # skip ahead one device event at a time so that interrupts fire and
+        #   scheduled callbacks run at the right virtual time
+        end = self.clock.now_us() + us
+        while self.clock.now_us() < end:
+            nxt = self.next_event_us()
+            target = end if nxt is None else min(end, max(nxt,
+                self.clock.now_us()))
+            self.idle_us += target - self.clock.now_us()
+            self.clock.advance_to(target)
+            self.poll()
+
+    def idle(self, max_us = 1000):  # machine.idle(): wait for an interrupt
+        now = self.clock.now_us()
+        nxt = self.next_event_us()
+        target = now + max_us if nxt is None else min(now + max_us, nxt)
+        if target > now:
+            self.idle_us += target - now
+            self.clock.advance_to(target)
+        self.poll()
+
+    def next_event_us(self):
+        events = [t for t in (self.lis3dh.next_event_us(),
+            self.tmp007.next_event_us()) if t is not None]
+        if self.clock.stop_at_us is not None:
+            events.append(self.clock.stop_at_us)
+        if self.actions:
+            events.append(self.actions[0][0])
+        return int(min(events)) if events else None
+
+    def bus_time(self, nbytes):     # stepped mode: I2C transfers take time
+        if not self.clock.speed:
+            self.clock.advance(self.bus.transfer_us(nbytes))
+
+    def at(self, t_s, func):    # run func() at t_s virtual seconds
+        self.actions.append((int(t_s * 1000000), func))
+        self.actions.sort(key = lambda a: a[0])
+
+    # interrupts
+    def line(self, pin_id):
+        if pin_id not in self.gpio:
+            self.gpio[pin_id] = GpioLine()
+        return self.gpio[pin_id]
+
+    def check_irqs(self):
+        for line in self.gpio.values():
+            level = line.value()
+            edge = level != line.level
+            line.level = level
+            if edge and line.handler is not None and \
+                    line.trigger & (IRQ_RISING if level else IRQ_FALLING):
+                self.irq_count += 1
+                line.handler(line.pin)
+
+    def schedule(self, func, arg):
+        if len(self.scheduled) >= SCHEDULE_DEPTH:
+            raise RuntimeError('schedule queue full')
+        self.scheduled.append((func, arg))
+
+    def run_scheduled(self):
+        if self._in_scheduled:
+            return
+        self._in_scheduled = True
+        try:
+            while self.scheduled:
+                func, arg = self.scheduled.pop(0)
+                func(arg)
+        finally:
+            self._in_scheduled = False
+
+    # summary of a run
+    def report(self):
+        return {'virtual_s': self.clock.now_us() / 1000000,
+                'real_s': self.clock.real_elapsed_s(),
+                'idle_s': self.idle_us / 1000000,
+                'lightsleep_s': self.lightsleep_us / 1000000,
+                'radio_s': self.wlan.radio_s(self.clock.now_us()),
+                'lis3dh_samples': self.lis3dh.samples,
+                'true_steps': int(self.lis3dh.motion.steps),
+                'tmp007_conversions': self.tmp007.conversions,
+                'irqs': self.irq_count,
+                'lis3dh_wakeups': self.lis3dh.ia1_events,
+                'i2c': self.bus.counters(),
+                'mqtt_connects': self.broker.connects,
+                'mqtt_messages': self.broker.published,
+                'mqtt_bytes': self.broker.bytes}
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def install(flash_dir = None, **kwargs):    # create the board, expose modules
+    global sim
+    for path in (CW1_DIR, LIB_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.chdir(flash_dir or tempfile.mkdtemp(prefix = 'cw1-flash-'))
+    sim = Sim(**kwargs)
+    gc.mem_free = mem_free
+    gc.mem_alloc = mem_alloc
+    return sim
+
+def mem_alloc():            # bytes traced by tracemalloc, if it is running
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        return 0
+    return tracemalloc.get_traced_memory()[0]
+
+def mem_free():
+    return max(0, HEAP_SIZE - mem_alloc())
@@ -0,0 +1,79 @@
+''' In-process MQTT broker stand-in for the fake umqtt client
+    keeps a bounded log of published messages, delivers them to subscribers
+    registered with MQTT topic filters (+ and # wildcards) and can be taken
+    down to simulate an unreachable broker
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from collections import deque
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def topic_matches(topic_filter, topic):
+    f = topic_filter.split('/')
+    t = topic.split('/')
+    for i, level in enumerate(f):
+        if level == '#':
+            return True
+        if i >= len(t):
+            return False
+        if level != '+' and level != t[i]:
+            return False
+    return len(f) == len(t)
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Message:
+    __slots__ = ('t_us', 'topic', 'payload', 'client_id')
+
+    def __init__(self, t_us, topic, payload, client_id):
+        self.t_us = t_us
+        self.topic = topic
+        self.payload = payload
+        self.client_id = client_id
+
+
+class Broker:
+    def __init__(self, address = '192.168.0.10', keep = 10000):
+        self.address = address
+        self.up = True
+        self.messages = deque(maxlen = keep)    # most recent messages
+        self.published = 0                      # messages since start
+        self.bytes = 0                          # payload bytes since start
+        self.connects = 0
+        self._subscribers = []                  # (topic filter, callback)
+        self._sessions = set()                  # connected client objects
+
+    def subscribe(self, topic_filter, callback):    # callback(Message)
+        self._subscribers.append((topic_filter, callback))
+
+    def connect(self, client):
+        if not self.up:
+            raise OSError(113, 'EHOSTUNREACH')
+        self._sessions.add(client)
+        self.connects += 1
+
+    def disconnect(self, client):
+        self._sessions.discard(client)
+
+    def is_connected(self, client):
+        return client in self._sessions
+
+    def set_up(self, up):           # down drops every session
+        self.up = up
+        if not up:
+            self._sessions.clear()
+
+    def publish(self, t_us, topic, payload, client_id = None):
+        msg = Message(t_us, topic, payload, client_id)
+        self.messages.append(msg)
+        self.published += 1
+        self.bytes += len(payload)
+        for topic_filter, callback in self._subscribers:
+            if topic_matches(topic_filter, topic):
+                callback(msg)
+        return msg
@@ -0,0 +1,54 @@
+''' Virtual clock for the hardware emulation
+    virtual time (us since power-on) is real elapsed time multiplied by `speed`
+    plus every sleep/idle, which is skipped instead of waited for. With
+    speed = 0 time only moves when the firmware sleeps or idles, plus a small
+    quantum per clock read and the bus time of each I2C transfer, which makes
+    runs deterministic and as fast as the host allows
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import time
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class SimulationEnd(BaseException):
+    ''' raised from inside the firmware when the run reaches its stop time.
+        BaseException so that `except Exception` in firmware does not catch it
+    '''
+
+
+class VirtualClock:
+    def __init__(self, speed = 0, quantum_us = 20, stop_after_s = None):
+        self.speed = speed              # virtual s per real s, 0 = stepped
+        self.quantum_us = quantum_us    # stepped mode: cost of one clock read
+        self.stop_at_us = None
+        if stop_after_s is not None:
+            self.stop_at_us = int(stop_after_s * 1000000)
+        self._skipped_us = 0
+        self._real0 = time.perf_counter()
+
+    def now_us(self):
+        t = self._skipped_us
+        if self.speed:
+            t += int((time.perf_counter() - self._real0) * 1000000 * self.speed)
+        return t
+
+    def advance(self, us):              # skip ahead (sleep, idle, bus time)
+        if us > 0:
+            self._skipped_us += int(us)
+
+    def advance_to(self, t_us):
+        self.advance(t_us - self.now_us())
+
+    def step(self):                     # one clock read in stepped mode
+        if not self.speed:
+            self._skipped_us += self.quantum_us
+
+    def expired(self):
+        return self.stop_at_us is not None and self.now_us() >= self.stop_at_us
+
+    def real_elapsed_s(self):
+        return time.perf_counter() - self._real0
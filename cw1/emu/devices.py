@@ -0,0 +1,396 @@
+''' Simulated I2C bus and sensors for the hardware emulation
+    SimLIS3DH and SimTMP007 model the register maps the drivers use: device
+    IDs, control registers, output registers, the LIS3DH FIFO, inertial
+    interrupt 1 (high-pass filtered wake-up) and interrupt lines and the
+    TMP007 conversion timing. Sensor data comes from a motion model (Walk) and
+    a temperature model evaluated at virtual time
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import math
+import random
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+LIS3DH_ADDRESS  = 0x18
+TMP007_ADDRESS  = 0x40
+
+LIS3DH_WHOAMI   = 0x0F
+LIS3DH_CTRL1    = 0x20
+LIS3DH_CTRL2    = 0x21
+LIS3DH_CTRL3    = 0x22
+LIS3DH_CTRL4    = 0x23
+LIS3DH_CTRL5    = 0x24
+LIS3DH_CTRL6    = 0x25
+LIS3DH_REFERENCE = 0x26
+LIS3DH_STATUS2  = 0x27
+LIS3DH_OUT_X_L  = 0x28
+LIS3DH_OUT_Z_H  = 0x2D
+LIS3DH_FIFOCTRL = 0x2E
+LIS3DH_FIFOSRC  = 0x2F
+LIS3DH_INT1CFG  = 0x30
+LIS3DH_INT1SRC  = 0x31
+LIS3DH_INT1THS  = 0x32
+LIS3DH_INT1DUR  = 0x33
+
+LIS3DH_ODR_HZ = (0, 1, 10, 25, 50, 100, 200, 400, 1600, 1344)
+LIS3DH_COUNTS_PER_G = (16380, 8190, 4096, 1365)   # by CTRL4 FS bits
+LIS3DH_FIFO_SIZE = 32
+LIS3DH_THS_MG = (16, 32, 62, 186)   # INT1THS LSB by CTRL4 FS bits
+LIS3DH_HP_SHIFT = 3         # interrupt high-pass filter: 1/8 per sample
+
+TMP007_TDIE     = 0x01
+TMP007_CONFIG   = 0x02
+TMP007_TOBJ     = 0x03
+TMP007_STATUS   = 0x04
+TMP007_STATMASK = 0x05
+TMP007_DEVID    = 0x1F
+
+TMP007_STAT_CRTF = 0x4000       # conversion ready flag
+TMP007_CONV_US = 260000         # one conversion, x number of averaged samples
+
+
+
+#//////////////////// motion and temperature models //////////////////////////
+class Walk:
+    ''' acceleration of a body-worn sensor, in g
+        periods: repeating list of (duration s, cadence in steps/min). A
+        cadence of 0 means standing still. The vertical axis oscillates once
+        per step, the sideways axis once per stride
+    '''
+
+    def __init__(self, periods = ((60, 110),), amplitude_g = 0.35,
+            noise_g = 0.01, seed = 0):
+        self.periods = periods
+        self.amplitude_g = amplitude_g
+        self.noise_g = noise_g
+        self.steps = 0.0            # ground truth steps taken so far
+        self._cycle_s = sum(d for d, _ in periods)
+        self._phase = 0.0           # unit: steps
+        self._t_s = 0.0
+        self._rng = random.Random(seed)
+
+    def cadence(self, t_s):
+        t = t_s % self._cycle_s
+        for duration, cadence in self.periods:
+            if t < duration:
+                return cadence
+            t -= duration
+        return 0
+
+    def sample(self, t_s):          # returns x, y, z in g
+        cadence = self.cadence(t_s)
+        self._phase += cadence / 60.0 * (t_s - self._t_s)
+        self._t_s = t_s
+        self.steps = self._phase
+        a = self.amplitude_g if cadence else 0.0
+        n = self._rng.gauss
+        x = 0.3 * a * math.sin(math.pi * self._phase) + n(0, self.noise_g)
+        y = 0.05 + n(0, self.noise_g)
+        z = 1.0 + a * math.sin(2 * math.pi * self._phase) + n(0, self.noise_g)
+        return x, y, z
+
+
+class Skin:
+    ''' object (skin) and die temperature in C '''
+
+    def __init__(self, obj_c = 33.0, swing_c = 0.5, period_s = 600,
+            die_c = 25.0):
+        self.obj_c = obj_c
+        self.swing_c = swing_c
+        self.period_s = period_s
+        self.die_c = die_c
+
+    def obj(self, t_s):
+        return self.obj_c + self.swing_c * math.sin(2 * math.pi * t_s /
+            self.period_s)
+
+    def die(self, t_s):
+        return self.die_c
+
+
+
+#//////////////////// bus ///////////////////////////////////////////////////
+class SimI2CBus:
+    def __init__(self):
+        self.devices = {}           # address -> device
+        self.freq = 400000
+        self.transactions = 0       # one per readfrom_mem / writeto_mem
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def attach(self, device):
+        self.devices[device.address] = device
+
+    def transfer_us(self, nbytes):  # start + address + register + data
+        return (3 + nbytes) * 9 * 1000000 // self.freq
+
+    def _device(self, addr):
+        dev = self.devices.get(addr)
+        if dev is None:
+            self.errors += 1
+            raise OSError(19, 'ENODEV')    # MicroPython: NACK on address
+        return dev
+
+    def read(self, addr, reg, nbytes):
+        data = self._device(addr).read(reg, nbytes)
+        self.transactions += 1
+        self.bytes_read += nbytes
+        return data
+
+    def write(self, addr, reg, data):
+        self._device(addr).write(reg, bytes(data))
+        self.transactions += 1
+        self.bytes_written += len(data)
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def counters(self):
+        return {'transactions': self.transactions,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'errors': self.errors}
+
+
+
+#//////////////////// LIS3DH //////////////////////////////////////////////////
+class SimLIS3DH:
+    def __init__(self, motion = None, address = LIS3DH_ADDRESS):
+        self.address = address
+        self.motion = motion or Walk()
+        self.regs = bytearray(0x40)
+        self.regs[LIS3DH_WHOAMI] = 0x33
+        self.regs[LIS3DH_CTRL1] = 0x07
+        self.fifo = []              # unread (x, y, z) raw samples
+        self.out = (0, 0, 0)        # latest sample in OUT_* (bypass mode)
+        self.samples = 0            # samples produced since power-on
+        self._data_ready = False
+        self._next_us = None        # time of next sample, None = powered down
+        self._odr_hz = 0
+        self._hp_ref = None         # high-pass filter reference, in g
+        self._ia1_count = 0         # consecutive samples over the threshold
+        self.ia1_events = 0         # inertial interrupt 1 events raised
+
+    # configuration decoded from the register map
+    def odr_hz(self):
+        return LIS3DH_ODR_HZ[self.regs[LIS3DH_CTRL1] >> 4]
+
+    def counts_per_g(self):
+        return LIS3DH_COUNTS_PER_G[(self.regs[LIS3DH_CTRL4] >> 4) & 0x03]
+
+    def fifo_mode(self):            # 0 bypass, 1 FIFO, 2 stream, 3 stream-to-FIFO
+        if not self.regs[LIS3DH_CTRL5] & 0x40:
+            return 0
+        return self.regs[LIS3DH_FIFOCTRL] >> 6
+
+    def fifo_watermark(self):
+        return self.regs[LIS3DH_FIFOCTRL] & 0x1F
+
+    # interrupt lines
+    def int1(self):
+        ctrl3 = self.regs[LIS3DH_CTRL3]
+        if ctrl3 & 0x10 and self._data_ready:
+            return 1
+        if ctrl3 & 0x04 and self.fifo_mode() and \
+                len(self.fifo) > self.fifo_watermark():
+            return 1
+        if ctrl3 & 0x02 and len(self.fifo) >= LIS3DH_FIFO_SIZE:
+            return 1
+        if ctrl3 & 0x40 and self.regs[LIS3DH_INT1SRC] & 0x40:
+            return 1
+        return 0
+
+    def int2(self):
+        return 0
+
+    # data generation
+    def sync(self, now_us):         # produce every sample due by now_us
+        odr = self.odr_hz()
+        if odr != self._odr_hz:
+            self._odr_hz = odr
+            self._next_us = now_us + 1000000 // odr if odr else None
+        if self._next_us is None:
+            return
+        period = 1000000 / odr
+        while self._next_us <= now_us:
+            self._produce(self._next_us)
+            self._next_us += period
+
+    def next_event_us(self):
+        return self._next_us
+
+    def _produce(self, t_us):
+        g = self.counts_per_g()
+        lp = self.regs[LIS3DH_CTRL1] & 0x08         # low power: 8 bit data
+        mask = 0xFF00 if lp else 0xFFF0             # left justified, 16 bit
+        raw = []
+        for a in self.motion.sample(t_us / 1000000):
+            v = max(-32768, min(32767, int(a * g))) & mask
+            raw.append(v - 0x10000 if v & 0x8000 else v)
+        sample = tuple(raw)
+        self.samples += 1
+        mode = self.fifo_mode()
+        if mode:
+            if len(self.fifo) >= LIS3DH_FIFO_SIZE:
+                if mode == 1:               # FIFO mode: stop when full
+                    return
+                self.fifo.pop(0)            # stream: overwrite oldest
+            self.fifo.append(sample)
+        else:
+            self.out = sample
+        self._data_ready = True
+        self._inertial(sample)
+
+    def _inertial(self, sample):    # interrupt 1 generator, OR of high events
+        cfg = self.regs[LIS3DH_INT1CFG]
+        g = self.counts_per_g()
+        a = [v / g for v in sample]
+        if self.regs[LIS3DH_CTRL2] & 0x01:      # HP_IA1: high-pass filtered
+            if self._hp_ref is None:
+                self._hp_ref = a
+            ref = self._hp_ref
+            self._hp_ref = [r + (v - r) / (1 << LIS3DH_HP_SHIFT)
+                for r, v in zip(ref, a)]
+            a = [v - r for r, v in zip(ref, a)]
+        if self.regs[LIS3DH_CTRL5] & 0x08 and self.regs[LIS3DH_INT1SRC] & 0x40:
+            return                              # latched until INT1SRC read
+        ths = (self.regs[LIS3DH_INT1THS] & 0x7F) * \
+            LIS3DH_THS_MG[(self.regs[LIS3DH_CTRL4] >> 4) & 0x03] / 1000
+        src = 0
+        for axis in range(3):
+            if cfg & (0x02 << 2 * axis) and abs(a[axis]) > ths:
+                src |= 0x02 << 2 * axis
+        if cfg & 0xC0 or not src:       # AND / 6D combinations not modelled
+            self._ia1_count = 0
+            if not self.regs[LIS3DH_CTRL5] & 0x08:
+                self.regs[LIS3DH_INT1SRC] = 0
+            return
+        self._ia1_count += 1
+        if self._ia1_count > self.regs[LIS3DH_INT1DUR] & 0x7F:
+            self.regs[LIS3DH_INT1SRC] = 0x40 | src
+            self.ia1_events += 1
+
+    # register access
+    def _out_byte(self, reg):
+        if self.fifo_mode():
+            sample = self.fifo[0] if self.fifo else self.out
+        else:
+            sample = self.out
+        v = sample[(reg - LIS3DH_OUT_X_L) // 2] & 0xFFFF
+        return v & 0xFF if reg % 2 == 0 else v >> 8
+
+    def _fifosrc(self):
+        n = len(self.fifo)
+        src = min(n, 0x1F)
+        if self.fifo_mode() and n > self.fifo_watermark():
+            src |= 0x80
+        if n >= LIS3DH_FIFO_SIZE:
+            src |= 0x40
+        if n == 0:
+            src |= 0x20
+        return src
+
+    def read(self, reg, nbytes):
+        auto = reg & 0x80
+        reg &= 0x7F
+        out = bytearray()
+        for _ in range(nbytes):
+            if LIS3DH_OUT_X_L <= reg <= LIS3DH_OUT_Z_H:
+                out.append(self._out_byte(reg))
+                if reg == LIS3DH_OUT_Z_H:
+                    self._data_ready = False
+                    if self.fifo_mode() and self.fifo:
+                        self.fifo.pop(0)
+            elif reg == LIS3DH_FIFOSRC:
+                out.append(self._fifosrc())
+            elif reg == LIS3DH_STATUS2:
+                out.append(0x08 if self._data_ready else 0)
+            elif reg == LIS3DH_INT1SRC:
+                out.append(self.regs[reg])
+                self.regs[reg] = 0          # reading clears the latch
+            elif reg == LIS3DH_REFERENCE:
+                out.append(self.regs[reg])
+                self._hp_ref = None         # and resets the high-pass filter
+            else:
+                out.append(self.regs[reg])
+            if auto:
+                if reg == LIS3DH_OUT_Z_H and self.fifo_mode():
+                    reg = LIS3DH_OUT_X_L    # FIFO: wrap to the next sample
+                else:
+                    reg = (reg + 1) & 0x3F
+        return bytes(out)
+
+    def write(self, reg, data):
+        auto = reg & 0x80
+        reg &= 0x7F
+        for b in data:
+            self.regs[reg] = b
+            if reg == LIS3DH_FIFOCTRL and b >> 6 == 0:
+                self.fifo = []              # bypass mode resets the FIFO
+            if auto:
+                reg = (reg + 1) & 0x3F
+
+
+
+#//////////////////// TMP007 //////////////////////////////////////////////////
+class SimTMP007:
+    def __init__(self, temperature = None, address = TMP007_ADDRESS):
+        self.address = address
+        self.temperature = temperature or Skin()
+        self.regs = [0] * 0x20
+        self.regs[TMP007_DEVID] = 0x0078
+        self.regs[TMP007_CONFIG] = 0x1440
+        self.conversions = 0
+        self._next_us = None
+        self._config_seen = None
+
+    def conversion_us(self):
+        return TMP007_CONV_US * (1 << ((self.regs[TMP007_CONFIG] >> 9) & 0x07))
+
+    def alert(self):                # ALERT pin, open drain, active low
+        cfg = self.regs[TMP007_CONFIG]
+        if cfg & 0x0100 and self.regs[TMP007_STATUS] & \
+                self.regs[TMP007_STATMASK] & 0xFF00:
+            return 0
+        return 1
+
+    def sync(self, now_us):
+        cfg = self.regs[TMP007_CONFIG]
+        if cfg != self._config_seen:    # (re)start conversions
+            self._config_seen = cfg
+            self._next_us = now_us + self.conversion_us() \
+                if cfg & 0x1000 else None
+        while self._next_us is not None and self._next_us <= now_us:
+            self._convert(self._next_us)
+            self._next_us += self.conversion_us()
+
+    def next_event_us(self):
+        return self._next_us
+
+    def _convert(self, t_us):
+        t_s = t_us / 1000000
+        self.regs[TMP007_TOBJ] = self._encode(self.temperature.obj(t_s))
+        self.regs[TMP007_TDIE] = self._encode(self.temperature.die(t_s))
+        self.regs[TMP007_STATUS] |= TMP007_STAT_CRTF
+        self.conversions += 1
+
+    def _encode(self, c):           # 14 bit two's complement, 1/32 C, << 2
+        return (int(round(c / 0.03125)) << 2) & 0xFFFF
+
+    def read(self, reg, nbytes):
+        v = self.regs[reg & 0x1F]
+        if reg == TMP007_STATUS:
+            self.regs[TMP007_STATUS] = 0    # flags clear on read
+        return bytes([v >> 8, v & 0xFF])[:nbytes]
+
+    def write(self, reg, data):
+        v = (data[0] << 8) | (data[1] if len(data) > 1 else 0)
+        if reg == TMP007_CONFIG and v & 0x8000:    # software reset
+            self.regs[TMP007_CONFIG] = 0x1440
+            return
+        self.regs[reg & 0x1F] = v
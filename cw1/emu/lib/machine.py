@@ -0,0 +1,134 @@
+''' stand-in for the MicroPython `machine` module, backed by emu.sim '''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import calendar
+
+import emu
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+PWRON_RESET = 0
+HARD_RESET = 1
+WDT_RESET = 2
+DEEPSLEEP_RESET = 3
+SOFT_RESET = 4
+
+_UNIQUE_ID = b'K\x9b\xc6\x00'
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    IRQ_RISING = emu.IRQ_RISING
+    IRQ_FALLING = emu.IRQ_FALLING
+
+    def __init__(self, id, mode = -1, pull = -1, value = None):
+        self.id = id
+        self._line = emu.sim.line(id)
+        if value is not None:
+            self._line.driven = value
+
+    def init(self, mode = -1, pull = -1, value = None):
+        if value is not None:
+            self._line.driven = value
+
+    def value(self, v = None):
+        if v is None:
+            emu.sim.poll()
+            return self._line.value()
+        self._line.driven = 1 if v else 0
+
+    def __call__(self, v = None):
+        return self.value(v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler = None, trigger = IRQ_RISING | IRQ_FALLING,
+            hard = False):
+        self._line.handler = handler
+        self._line.trigger = trigger
+        self._line.pin = self
+        self._line.level = self._line.value()
+
+
+class I2C:
+    def __init__(self, id = -1, scl = None, sda = None, freq = 400000):
+        emu.sim.bus.freq = freq
+
+    def scan(self):
+        return emu.sim.bus.scan()
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        emu.sim.poll()
+        emu.sim.bus_time(nbytes)
+        return emu.sim.bus.read(addr, memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        view = memoryview(buf).cast('B')
+        emu.sim.poll()
+        emu.sim.bus_time(len(view))
+        view[:] = emu.sim.bus.read(addr, memaddr, len(view))
+
+    def writeto_mem(self, addr, memaddr, buf):
+        emu.sim.poll()
+        emu.sim.bus_time(len(buf))
+        emu.sim.bus.write(addr, memaddr, buf)
+
+
+class RTC:
+    def datetime(self, datetimetuple = None):
+        import utime
+        if datetimetuple is None:
+            y, mo, d, h, mi, s, wd, yd = utime.localtime()
+            return (y, mo, d, wd, h, mi, s, 0)
+        y, mo, d, wd, h, mi, s, sub = datetimetuple
+        wall = calendar.timegm((y, mo, d, h, mi, s)) - utime.EPOCH_OFFSET
+        emu.sim.rtc_offset_s = wall - emu.sim.now_us() // 1000000
+
+    def memory(self, data = None):
+        if data is None:
+            return getattr(emu.sim, 'rtc_memory', b'')
+        emu.sim.rtc_memory = bytes(data)
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def unique_id():
+    return _UNIQUE_ID
+
+def freq(hz = None):
+    return 80000000
+
+def idle():
+    emu.sim.idle()
+
+def lightsleep(time_ms = None):
+    us = 1000000 if time_ms is None else time_ms * 1000
+    emu.sim.lightsleep_us += us
+    emu.sim.sleep_us(us)
+
+def deepsleep(time_ms = None):
+    raise emu.SimulationEnd()
+
+def reset():
+    raise emu.SimulationEnd()
+
+def reset_cause():
+    return PWRON_RESET
+
+def disable_irq():
+    return 0
+
+def enable_irq(state = 0):
+    pass
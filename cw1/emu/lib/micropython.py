@@ -0,0 +1,34 @@
+''' stand-in for the MicroPython `micropython` module '''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import emu
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def const(expr):
+    return expr
+
+def schedule(func, arg):    # runs at the next emu.sim.poll()
+    emu.sim.schedule(func, arg)
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def opt_level(level = None):
+    return 0
+
+def mem_info(verbose = False):
+    import gc
+    print('mem: total={0}, free={1}'.format(emu.HEAP_SIZE, gc.mem_free()))
+
+def heap_lock():
+    pass
+
+def heap_unlock():
+    return 0
+
+def kbd_intr(chr):
+    pass
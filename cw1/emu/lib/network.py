@@ -0,0 +1,53 @@
+''' stand-in for the MicroPython `network` module, backed by emu.sim.wlan '''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import emu
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 5
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class WLAN:
+    def __init__(self, interface_id = STA_IF):
+        self.interface_id = interface_id
+
+    def active(self, is_active = None):
+        if is_active is None:
+            return emu.sim.wlan.active
+        emu.sim.wlan.set_active(emu.sim.now_us(), bool(is_active))
+
+    def connect(self, essid = None, password = None):
+        emu.sim.wlan.connect(emu.sim.now_us(), essid, password)
+
+    def disconnect(self):
+        emu.sim.wlan.disconnect()
+
+    def isconnected(self):
+        return emu.sim.wlan.isconnected(emu.sim.read_clock())
+
+    def status(self):
+        if self.isconnected():
+            return STAT_GOT_IP
+        if emu.sim.wlan._connected_at_us is not None:
+            return STAT_CONNECTING
+        return STAT_IDLE
+
+    def ifconfig(self):
+        return ('192.168.0.42', '255.255.255.0', '192.168.0.1', '192.168.0.1')
+
+    def scan(self):
+        if not emu.sim.wlan.up:
+            return []
+        return [(emu.sim.wlan.essid.encode(), b'\x00\x11\x22\x33\x44\x55', 6,
+            -60, 3, 0)]
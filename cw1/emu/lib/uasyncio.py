@@ -0,0 +1,174 @@
+''' stand-in for MicroPython `uasyncio`, scheduling tasks on the virtual clock
+    covers what the firmware uses: run, create_task, sleep, sleep_ms, gather,
+    ThreadSafeFlag and awaiting a task. While every task is waiting the board
+    is advanced one device event at a time, so pin interrupts and scheduled
+    callbacks keep running, as they do on the device, and a flag they set
+    wakes its task straight away
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import heapq
+
+import emu
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+_WAIT = object()            # yielded by a task waiting for another task
+_FLAG = object()            # yielded by a task waiting for a ThreadSafeFlag
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+_queue = []                 # (wake_us, order, task)
+_order = 0
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class CancelledError(BaseException):
+    pass
+
+
+class _Sleep:
+    def __init__(self, us):
+        self.us = us
+
+    def __await__(self):
+        yield self.us
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.exception = None
+        self.waiting = []       # tasks awaiting this one
+
+    def __await__(self):
+        while not self.done:
+            yield (_WAIT, self)
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    def cancel(self):
+        if not self.done:
+            _push(0, self, CancelledError())
+
+
+
+class ThreadSafeFlag:        # set() from an interrupt or scheduled callback
+    def __init__(self):
+        self._flag = False
+        self._waiter = None
+
+    def set(self):
+        self._flag = True
+        if self._waiter is not None:
+            _push(emu.sim.now_us(), self._waiter)
+            self._waiter = None
+
+    def clear(self):
+        self._flag = False
+
+    def wait(self):
+        return _FlagWait(self)
+
+
+class _FlagWait:
+    def __init__(self, flag):
+        self.flag = flag
+
+    def __await__(self):
+        while not self.flag._flag:
+            yield (_FLAG, self.flag)
+        self.flag._flag = False
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def _push(wake_us, task, throw = None):
+    global _order
+    _order += 1
+    heapq.heappush(_queue, (wake_us, _order, task, throw))
+
+def _finish(task, result = None, exception = None):
+    task.done = True
+    task.result = result
+    task.exception = exception
+    now = emu.sim.now_us()
+    for t in task.waiting:
+        _push(now, t)
+
+def sleep_ms(ms):
+    return _Sleep(int(ms) * 1000)
+
+def sleep(s):
+    return _Sleep(int(s * 1000000))
+
+def create_task(coro):
+    task = Task(coro)
+    _push(emu.sim.now_us(), task)
+    return task
+
+async def gather(*aws):
+    tasks = [a if isinstance(a, Task) else create_task(a) for a in aws]
+    return [await t for t in tasks]
+
+def run(coro):
+    main = create_task(coro)
+    while not main.done:
+        if not _queue:          # every task waits for a flag
+            emu.sim.idle()
+            continue
+        wake_us = _queue[0][0]
+        now = emu.sim.now_us()
+        if wake_us > now:       # idle to the next event: an interrupt may
+            emu.sim.idle(wake_us - now)     #   make a task ready sooner
+            continue
+        wake_us, _, task, throw = heapq.heappop(_queue)
+        if task.done:
+            continue
+        try:
+            if throw is not None:
+                request = task.coro.throw(throw)
+            else:
+                request = task.coro.send(None)
+        except StopIteration as e:
+            _finish(task, e.value)
+            continue
+        except CancelledError as e:
+            _finish(task, exception = e)
+            continue
+        except Exception as e:
+            _finish(task, exception = e)
+            if task is main or not task.waiting:
+                raise
+            continue
+        if isinstance(request, tuple) and request[0] is _WAIT:
+            request[1].waiting.append(task)
+        elif isinstance(request, tuple) and request[0] is _FLAG:
+            if request[1]._flag:
+                _push(emu.sim.read_clock(), task)
+            else:
+                request[1]._waiter = task
+        else:
+            _push(emu.sim.read_clock() + (request or 0), task)
+    if main.exception is not None:
+        raise main.exception
+    return main.result
+
+def get_event_loop():
+    return _Loop()
+
+
+class _Loop:
+    def create_task(self, coro):
+        return create_task(coro)
+
+    def run_until_complete(self, coro):
+        return run(coro)
@@ -0,0 +1,136 @@
+''' stand-in for `umqtt.simple`, publishing to the in-process emu.sim.broker
+    the client's TCP socket is modelled as far as the firmware can tell:
+    connecting to an unreachable broker blocks until the socket timeout (or the
+    TCP connect timeout without one), writes to a broker that went away
+    silently succeed, and PINGRESP only comes back over a live session
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import emu
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+TCP_CONNECT_TIMEOUT_S = 20  # lwIP SYN retries without a socket timeout
+PINGRESP = b'\xd0\x00'
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class MQTTException(Exception):
+    pass
+
+
+class Socket:               # bytes from the broker, as a usocket stream
+    def __init__(self, timeout = None):
+        self.rx = bytearray()
+        self.timeout = timeout  # unit: s. None: blocking, 0: non-blocking
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0
+
+    def read(self, n):
+        if not self.rx:
+            if self.timeout == 0:
+                return None
+            end = emu.sim.now_us() + int((self.timeout or
+                TCP_CONNECT_TIMEOUT_S) * 1000000)
+            while not self.rx:
+                if emu.sim.now_us() >= end:
+                    raise OSError(110, 'ETIMEDOUT')
+                emu.sim.idle()
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port = 0, user = None,
+            password = None, keepalive = 0, ssl = False, ssl_params = {}):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.cb = None
+        self.lw = None
+        self.sock = None
+        self._inbox = []
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain = False, qos = 0):
+        self.lw = (topic, msg, retain, qos)
+
+    def _live(self):
+        return emu.sim.broker.up and emu.sim.broker.is_connected(self) and \
+            emu.sim.wlan.isconnected(emu.sim.now_us())
+
+    def _check(self):       # the broker resets a session it does not know
+        if self.sock is None:
+            raise OSError(9, 'EBADF')
+        if not self._live():
+            emu.sim.broker.disconnect(self)
+            raise OSError(104, 'ECONNRESET')
+
+    def connect(self, clean_session = True, timeout = None):
+        if not emu.sim.wlan.isconnected(emu.sim.read_clock()) or \
+                self.server != emu.sim.broker.address:
+            raise OSError(113, 'EHOSTUNREACH')
+        if not emu.sim.broker.up:   # SYN unanswered: blocks until timeout
+            emu.sim.sleep_us(int((timeout or TCP_CONNECT_TIMEOUT_S) * 1000000))
+            raise OSError(110, 'ETIMEDOUT')
+        emu.sim.broker.connect(self)
+        self.sock = Socket(timeout)
+        return 0
+
+    def disconnect(self):
+        emu.sim.broker.disconnect(self)
+        self.sock = None
+
+    def ping(self):         # a write: succeeds unless the broker reset us
+        if self.sock is None:
+            raise OSError(9, 'EBADF')
+        if self._live():
+            self.sock.rx += PINGRESP
+        elif emu.sim.broker.up and emu.sim.wlan.isconnected(emu.sim.now_us()):
+            self._check()           # reachable broker without the session
+
+    def publish(self, topic, msg, retain = False, qos = 0):
+        self._check()
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        emu.sim.broker.publish(emu.sim.read_clock(), topic.decode(),
+            bytes(msg), self.client_id)
+
+    def subscribe(self, topic, qos = 0):
+        self._check()
+        if isinstance(topic, bytes):
+            topic = topic.decode()
+        emu.sim.broker.subscribe(topic,
+            lambda m: self._inbox.append((m.topic.encode(), m.payload)))
+
+    def wait_msg(self):     # one packet: PINGRESP or a subscribed message
+        res = self.sock.read(1) if not self._inbox else None
+        self.sock.setblocking(True)
+        if res is None:
+            if self._inbox:
+                topic, msg = self._inbox.pop(0)
+                if self.cb is not None:
+                    self.cb(topic, msg)
+            return None
+        if res == PINGRESP[:1]:
+            self.sock.read(1)
+            return None
+        return res[0]
+
+    def check_msg(self):
+        self.sock.setblocking(False)
+        return self.wait_msg()
@@ -0,0 +1,29 @@
+''' stand-in for the MicroPython `urandom` module, seeded so runs repeat '''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import random
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+_rng = random.Random(0)
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def seed(n):
+    _rng.seed(n)
+
+def getrandbits(n):
+    return _rng.getrandbits(n)
+
+def randint(a, b):
+    return _rng.randint(a, b)
+
+def random():
+    return _rng.random()
+
+def choice(seq):
+    return _rng.choice(seq)
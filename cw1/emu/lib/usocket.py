@@ -0,0 +1,3 @@
+''' stand-in for the MicroPython `usocket` module '''
+
+from socket import *
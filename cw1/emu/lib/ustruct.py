@@ -0,0 +1,3 @@
+''' stand-in for the MicroPython `ustruct` module '''
+
+from struct import calcsize, pack, pack_into, unpack, unpack_from
@@ -0,0 +1,57 @@
+''' stand-in for the MicroPython `utime` module, on the emu.sim virtual clock '''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import time as _time
+
+import emu
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+EPOCH_OFFSET = 946684800    # MicroPython epoch 2000-01-01 in Unix seconds
+TICKS_PERIOD = 1 << 30      # ticks wrap like on the ESP8266
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def ticks_ms():
+    return (emu.sim.read_clock() // 1000) & TICKS_MAX
+
+def ticks_us():
+    return emu.sim.read_clock() & TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+def time():                 # seconds since 2000-01-01, from the RTC
+    return emu.sim.rtc_offset_s + emu.sim.read_clock() // 1000000
+
+def sleep(seconds):
+    emu.sim.sleep_us(int(seconds * 1000000))
+
+def sleep_ms(ms):
+    emu.sim.sleep_us(ms * 1000)
+
+def sleep_us(us):
+    emu.sim.sleep_us(us)
+
+def localtime(secs = None):
+    if secs is None:
+        secs = time()
+    t = _time.gmtime(secs + EPOCH_OFFSET)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec,
+        t.tm_wday, t.tm_yday)
+
+def mktime(t):
+    import calendar
+    return calendar.timegm(tuple(t[:6])) - EPOCH_OFFSET
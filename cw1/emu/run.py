@@ -0,0 +1,86 @@
+''' Run a cw1 firmware script on the emulated board
+    usage: python3 emu/run.py [options] [script]    (default script: main.py)
+
+        python3 emu/run.py --duration 120               # 2 virtual minutes
+        python3 emu/run.py --speed 10 --duration 60     # 10x real time
+        python3 emu/run.py --walk 30:110,30:0 main.py   # walk 30 s, rest 30 s
+        python3 emu/run.py --broker-down 60:120         # broker down 60-180 s
+        python3 emu/run.py --wlan-down 30:20            # Wi-Fi down 30-50 s
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import json
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import emu
+from emu.devices import Walk
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def parse_walk(text):       # '30:110,30:0' -> ((30, 110), (30, 0))
+    periods = []
+    for part in text.split(','):
+        duration, cadence = part.split(':')
+        periods.append((float(duration), float(cadence)))
+    return tuple(periods)
+
+def parse_outage(text):     # '60:120' -> (60.0, 120.0): start, duration
+    start, duration = text.split(':')
+    return float(start), float(duration)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'run cw1 firmware on the '
+        'emulated ESP8266 + LIS3DH + TMP007 board')
+    parser.add_argument('script', nargs = '?',
+        default = os.path.join(emu.CW1_DIR, 'main.py'))
+    parser.add_argument('--duration', type = float, default = 60,
+        help = 'virtual seconds to run (default: 60)')
+    parser.add_argument('--speed', type = float, default = 0,
+        help = 'virtual seconds per real second, 0 = as fast as possible')
+    parser.add_argument('--walk', type = parse_walk, default = ((60, 110),),
+        help = 'repeating duration:cadence list (default: 60:110)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--quiet', action = 'store_true',
+        help = 'discard firmware output')
+    parser.add_argument('--broker-down', type = parse_outage, action = 'append',
+        default = [], metavar = 'START:SECONDS',
+        help = 'take the MQTT broker down for a while (repeatable)')
+    parser.add_argument('--wlan-down', type = parse_outage, action = 'append',
+        default = [], metavar = 'START:SECONDS',
+        help = 'take the Wi-Fi access point down for a while (repeatable)')
+    parser.add_argument('--flash', help = 'directory for the board filesystem '
+        '(default: a new temporary directory)')
+    args = parser.parse_args(argv)
+
+    script = os.path.abspath(args.script)
+    sim = emu.install(flash_dir = args.flash, speed = args.speed,
+        stop_after_s = args.duration, motion = Walk(args.walk, seed = args.seed))
+    for start, duration in args.broker_down:
+        sim.at(start, lambda: sim.broker.set_up(False))
+        sim.at(start + duration, lambda: sim.broker.set_up(True))
+    for start, duration in args.wlan_down:
+        sim.at(start, lambda: sim.wlan.set_up(False))
+        sim.at(start + duration, lambda: sim.wlan.set_up(True))
+    stdout = sys.stdout
+    if args.quiet:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        runpy.run_path(script, run_name = '__main__')
+    except emu.SimulationEnd:
+        pass
+    finally:
+        sys.stdout = stdout
+    print(json.dumps(sim.report(), indent = 2))
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+''' Shared I2C register access layer for MicroPython
+    one I2C port is shared by every sensor on the bus. Register accesses go
+    through preallocated transfer buffers (readfrom_mem_into / writeto_mem) so
+    that reading a register does not allocate on the heap. The port is created
+    by init() (scan() calls it), not at import
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from machine import Pin, I2C
+from micropython import const
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+I2C_SCL_PIN = const(5)
+I2C_SDA_PIN = const(4)
+I2C_FREQ    = const(400000) # unit: Hz. Fast mode
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+port = None             # machine.I2C, created by init()
+
+_buf1 = bytearray(1)    # transfer buffers for single register accesses
+_buf2 = bytearray(2)
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def init():             # create the port once; driver init() does, via scan()
+    global port
+    if port is None:
+        port = I2C(scl = Pin(I2C_SCL_PIN), sda = Pin(I2C_SDA_PIN),
+            freq = I2C_FREQ)
+    return port
+
+def scan():
+    return init().scan()
+
+def read_into(addr, reg_addr, buf):     # burst read len(buf) bytes into buf
+    port.readfrom_mem_into(addr, reg_addr, buf)
+
+def read_u8(addr, reg_addr):
+    port.readfrom_mem_into(addr, reg_addr, _buf1)
+    return _buf1[0]
+
+def read_u16_be(addr, reg_addr):        # 16 bit register, MSB first
+    port.readfrom_mem_into(addr, reg_addr, _buf2)
+    return (_buf2[0] << 8) | _buf2[1]
+
+def write_u8(addr, reg_addr, data):
+    _buf1[0] = data & 0xFF
+    port.writeto_mem(addr, reg_addr, _buf1)
+
+def write_u16_be(addr, reg_addr, data): # 16 bit register, MSB first
+    _buf2[0] = (data >> 8) & 0xFF
+    _buf2[1] = data & 0xFF
+    port.writeto_mem(addr, reg_addr, _buf2)
+
+def int16(uint16):                      # reinterpret 16 bits as signed
+    if uint16 > 32767:
+        return uint16 - 65536
+    return uint16
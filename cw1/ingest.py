@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+''' Ingest service for many pedometers
+    subscribes to every device with a wildcard topic (/esys/+/pedometer), keeps
+    the last known state of each device and decodes and processes messages on
+    a pool of worker threads. The MQTT network thread only puts the raw message
+    on a bounded queue, so it never waits for processing; if the queues are
+    full the message is counted as dropped. Messages of one device always go to
+    the same worker, so they are processed in order and device state needs no
+    lock. Sinks registered with add_sink() see every decoded reading
+
+    usage: python3 ingest.py [--broker 192.168.0.10] [--topic /esys/+/pedometer]
+                             [--workers 4] [--queue 1000] [--report 10] [--print]
+                             [--db pedometer.db] [--metrics] [--links]
+    works with paho-mqtt 1.x and 2.x
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+import payload
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+TOPIC_FILTER = '/esys/+/pedometer'
+BROKER_ADDRESS = '192.168.0.10'
+BROKER_PORT = 1883
+WORKERS = 4             # decoding/processing threads
+QUEUE_SIZE = 1000       # unit: messages. Per worker
+REPORT_INTERVAL = 10    # unit: second
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Device:
+    def __init__(self, device_id):
+        self.id = device_id
+        self.state = {}         # last known value of every field
+        self.messages = 0
+        self.readings = 0
+        self.last_seen = None   # unit: s. time.time() of the last message
+
+
+class Ingest:
+    def __init__(self, topic_filter = TOPIC_FILTER, workers = WORKERS,
+            queue_size = QUEUE_SIZE):
+        self.topic_filter = topic_filter
+        self.devices = {}       # device id -> Device
+        self.sinks = []         # callables (device, reading)
+        self.received = 0       # messages accepted from the network
+        self.processed = 0
+        self.dropped = 0        # messages refused because a queue was full
+        self.errors = 0         # messages that could not be decoded
+        self._queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self._devices_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._threads = []
+        self._running = False
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def start(self):
+        self._running = True
+        for q in self._queues:
+            t = threading.Thread(target = self._work, args = (q,), daemon = True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):             # process what is queued, then end the workers
+        self._running = False
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def feed(self, topic, msg):     # network thread: queue a message, never block
+        q = self._queues[hash(topic) % len(self._queues)]
+        try:
+            q.put_nowait((topic, msg, time.time()))
+            self.received += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def queued(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def device(self, topic):
+        device_id = device_id_of(self.topic_filter, topic)
+        d = self.devices.get(device_id)
+        if d is None:
+            with self._devices_lock:
+                d = self.devices.setdefault(device_id, Device(device_id))
+        return d
+
+    def process(self, topic, msg, t_recv):
+        try:
+            readings = payload.decode(msg)
+        except ValueError:
+            with self._count_lock:
+                self.errors += 1
+            return
+        d = self.device(topic)
+        d.messages += 1
+        d.readings += len(readings)
+        d.last_seen = t_recv
+        for reading in readings:
+            d.state.update(reading)
+            for sink in self.sinks:
+                sink(d, reading)
+        with self._count_lock:
+            self.processed += 1
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            try:
+                self.process(*item)
+            except Exception as e:      # keep the worker alive
+                print('ingest: {0!r}'.format(e), file = sys.stderr)
+                with self._count_lock:
+                    self.errors += 1
+
+
+class RateReport:               # messages/s over each interval and overall
+    def __init__(self, ingest):
+        self.ingest = ingest
+        self.start = time.time()
+        self._last_t = self.start
+        self._last_n = 0
+
+    def sample(self):
+        now = time.time()
+        n = self.ingest.processed
+        rate = (n - self._last_n) / max(now - self._last_t, 1e-9)
+        self._last_t, self._last_n = now, n
+        return {'t': round(now - self.start, 1),
+                'msgs_per_s': round(rate, 1),
+                'mean_msgs_per_s': round(n / max(now - self.start, 1e-9), 1),
+                'processed': n,
+                'dropped': self.ingest.dropped,
+                'errors': self.ingest.errors,
+                'queued': self.ingest.queued(),
+                'devices': len(self.ingest.devices)}
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def device_id_of(topic_filter, topic):  # the topic levels matched by + or #
+    f = topic_filter.split('/')
+    t = topic.split('/')
+    parts = [t[i] for i, level in enumerate(f) if level == '+' and i < len(t)]
+    if f and f[-1] == '#':
+        parts.extend(t[len(f) - 1:])
+    return '/'.join(parts) or topic
+
+def mqtt_client(ingest, address, port = BROKER_PORT):
+    import paho.mqtt.client as mqtt
+    if hasattr(mqtt, 'CallbackAPIVersion'):     # paho-mqtt 2.x
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    else:
+        client = mqtt.Client()
+
+    def on_connect(client, userdata, flags, rc):
+        print('Connected with result code ' + str(rc))
+        client.subscribe(ingest.topic_filter)   # renewed on reconnect
+
+    def on_message(client, userdata, msg):
+        ingest.feed(msg.topic, msg.payload)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(address, port, 60)
+    return client
+
+def print_reading(device, reading):
+    print('{0}: {1}'.format(device.id, json.dumps(device.state)))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'ingest pedometer '
+        'messages from many devices')
+    parser.add_argument('--broker', default = BROKER_ADDRESS)
+    parser.add_argument('--port', type = int, default = BROKER_PORT)
+    parser.add_argument('--topic', default = TOPIC_FILTER)
+    parser.add_argument('--workers', type = int, default = WORKERS)
+    parser.add_argument('--queue', type = int, default = QUEUE_SIZE,
+        help = 'messages queued per worker before dropping')
+    parser.add_argument('--report', type = float, default = REPORT_INTERVAL,
+        help = 'seconds between rate reports')
+    parser.add_argument('--print', action = 'store_true',
+        help = 'print the state of a device after every reading')
+    parser.add_argument('--db', help = 'store readings in this SQLite file')
+    parser.add_argument('--metrics', action = 'store_true',
+        help = 'report rolling 1 min/15 min/1 h metrics of every device')
+    parser.add_argument('--links', action = 'store_true',
+        help = 'report loss, reordering and latency of every device')
+    args = parser.parse_args(argv)
+
+    ingest = Ingest(args.topic, args.workers, args.queue)
+    if args.print:
+        ingest.add_sink(print_reading)
+    store = None
+    if args.db:
+        from tsstore import TimeSeriesStore
+        store = TimeSeriesStore(args.db)
+        ingest.add_sink(store.sink)
+    agg = None
+    if args.metrics:
+        from aggregate import Aggregator
+        agg = Aggregator()
+        ingest.add_sink(agg.sink)
+    links = None
+    if args.links:
+        from linkstats import LinkMonitor
+        links = LinkMonitor()
+        ingest.add_sink(links.sink)
+    ingest.start()
+    client = mqtt_client(ingest, args.broker, args.port)
+    client.loop_start()         # network loop on its own thread
+    report = RateReport(ingest)
+    try:
+        while True:
+            time.sleep(args.report)
+            print(json.dumps(report.sample()))
+            if agg is not None:
+                for device_id in sorted(agg.devices):
+                    print(json.dumps({'device': device_id,
+                        'metrics': agg.metrics(device_id)}))
+            if links is not None:
+                for device_id, summary in links.report().items():
+                    print(json.dumps({'device': device_id, 'link': summary}))
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    ingest.stop()
+    if store is not None:
+        store.close()
+    return 0
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+''' Link statistics per device: loss, duplicates, reordering and latency
+    every reading published by a pedometer carries a sequence number (16 bit,
+    wraps) and the device's ticks_ms() when it was taken. Sequence numbers are
+    tracked with a sliding window of the last WINDOW numbers below the highest
+    seen: a jump ahead counts the numbers skipped as lost, a number inside the
+    window that was not seen yet is a late (reordered) reading and is taken off
+    the lost count again, one already seen with the same tick is a duplicate.
+    A large jump back, or a number seen before with a different tick, is a
+    device restart (it counts from 0 again) and starts the counting again
+
+    device and host clocks are not synchronised, so latency is measured against
+    the fastest reading seen: offset = receive time - tick, and the latency of a
+    reading is its offset minus the smallest offset so far. It includes the time
+    spent in the device's batch and outbox, and is kept in a histogram with
+    power-of-two millisecond buckets
+
+        links = LinkMonitor()
+        links.update('LLLJ', t_recv, {'seq': 7, 'tick': 120533, ...})
+        links.report()['LLLJ']['latency_ms']['p95']
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import threading
+import time
+
+import payload
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+WINDOW = 64             # unit: readings. How late a reading may be and still
+                        #   count as reordered instead of as a restart
+BUCKETS = 22            # latency histogram: < 1 ms, < 2 ms, ... < 2^20 ms, more
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Histogram:                # counts by power-of-two buckets
+    def __init__(self, buckets = BUCKETS):
+        self.counts = [0] * buckets
+        self.n = 0
+        self.max = 0
+
+    def add(self, value):
+        i = min(int(value).bit_length(), len(self.counts) - 1)
+        self.counts[i] += 1
+        self.n += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.n += other.n
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):    # upper bound of the bucket holding p %
+        if not self.n:
+            return None
+        rank = p * self.n / 100
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return min(1 << i, self.max) if i < len(self.counts) - 1 \
+                    else self.max
+        return self.max
+
+    def summary(self):
+        result = {'n': self.n}
+        for p in (50, 95, 99):
+            v = self.percentile(p)
+            result['p' + str(p)] = None if v is None else round(v, 1)
+        result['max'] = round(self.max, 1) if self.n else None
+        return result
+
+
+class LinkStats:
+    def __init__(self):
+        self.received = 0       # readings with a sequence number
+        self.lost = 0           # skipped numbers not received (yet)
+        self.duplicates = 0
+        self.reordered = 0      # received after a later number
+        self.restarts = 0
+        self.latency = Histogram()
+        self._top = None        # highest sequence number, not wrapped
+        self._seen = 0          # bit i: _top - i received
+        self._ticks = [None] * WINDOW   # tick of number n at n % WINDOW
+        self._tick = None       # last tick and wraps, for unwrapping
+        self._tick_wraps = 0
+        self._min_offset = None # unit: ms
+
+    def update(self, t_recv, reading):  # t_recv: host time.time()
+        if 'seq' in reading:
+            self._sequence(reading['seq'], reading.get('tick'))
+        if 'tick' in reading:
+            self._latency(t_recv * 1000, reading['tick'])
+
+    def _sequence(self, seq, tick = None):
+        if self._top is None:
+            self.received += 1
+            self._top, self._seen = seq, 1
+            self._ticks[seq % WINDOW] = tick
+            return
+        ahead = (seq - self._top) % payload.SEQ_MOD
+        if ahead and ahead < payload.SEQ_MOD // 2:
+            self.received += 1
+            self.lost += ahead - 1
+            self._top += ahead
+            self._seen = ((self._seen << ahead) | 1) & ((1 << WINDOW) - 1)
+            self._ticks[self._top % WINDOW] = tick
+            return
+        behind = (self._top - seq) % payload.SEQ_MOD
+        bit = 1 << behind
+        # a device restarted within WINDOW readings of starting sends numbers
+        #   that are still in the window again, but with other ticks
+        if behind >= WINDOW or (self._seen & bit and tick is not None and
+                self._ticks[(self._top - behind) % WINDOW] not in (None, tick)):
+            self.restarts += 1
+            self.received += 1
+            self._top, self._seen = seq, 1
+            self._ticks[seq % WINDOW] = tick
+            self._tick = self._min_offset = None
+            return
+        if self._seen & bit:
+            self.duplicates += 1
+        else:
+            self._ticks[(self._top - behind) % WINDOW] = tick
+            self.received += 1
+            self._seen |= bit
+            self.lost -= 1
+            self.reordered += 1
+
+    def _latency(self, t_ms, tick):
+        if self._tick is not None and tick < self._tick and \
+                self._tick - tick > payload.TICKS_MOD // 2:
+            self._tick_wraps += 1
+        self._tick = tick
+        offset = t_ms - (tick + self._tick_wraps * payload.TICKS_MOD)
+        if self._min_offset is None or offset < self._min_offset:
+            self._min_offset = offset
+        self.latency.add(offset - self._min_offset)
+
+    def summary(self):
+        expected = self.received + self.lost
+        return {'received': self.received, 'lost': self.lost,
+            'loss': round(self.lost / expected, 4) if expected else 0.0,
+            'duplicates': self.duplicates, 'reordered': self.reordered,
+            'restarts': self.restarts, 'latency_ms': self.latency.summary()}
+
+
+class LinkMonitor:
+    def __init__(self):
+        self.devices = {}       # device id -> LinkStats
+        self._lock = threading.Lock()
+
+    def update(self, device_id, t_recv, reading):
+        s = self.devices.get(device_id)
+        if s is None:
+            with self._lock:
+                s = self.devices.setdefault(device_id, LinkStats())
+        s.update(t_recv, reading)
+
+    def sink(self, device, reading):    # ingest.Ingest sink
+        self.update(device.id, device.last_seen or time.time(), reading)
+
+    def report(self):           # {device id: summary}
+        with self._lock:
+            ids = sorted(self.devices)
+        return {device_id: self.devices[device_id].summary()
+            for device_id in ids}
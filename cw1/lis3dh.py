@@ -6,91 +6,169 @@
 
 
 #//////////////////// imports /////////////////////////////////////////////////
-from machine import Pin, I2C
+from array import array
+from machine import Pin
+import micropython
+from micropython import const
+import ustruct
 import utime
-import ujson
-import math
+import i2cbus
+from samplebuf import SampleBuffer
+from stepdetect import StepDetector
 
 
 
 #//////////////////// constants ///////////////////////////////////////////////
+# const() values are folded into the code at compile time; names starting with
+#   _ are private and are not kept as module attributes, so they cost no RAM.
+#   Data rate, range and FIFO mode codes stay public as function arguments
 # register addresses etc.
-LIS3DH_DEFAULT_ADDRESS  = 0x18 # default I2C address. If SDO/SA0 is 3V -> 0x19
-LIS3DH_DEVICE_ID        = 0x33 # expected device ID value in LIS3DH_REG_WHOAMI
-
-LIS3DH_REG_STATUS1      = 0x07 # registers
-LIS3DH_REG_OUTADC1_L    = 0x08
-LIS3DH_REG_OUTADC1_H    = 0x09
-LIS3DH_REG_OUTADC2_L    = 0x0A
-LIS3DH_REG_OUTADC2_H    = 0x0B
-LIS3DH_REG_OUTADC3_L    = 0x0C
-LIS3DH_REG_OUTADC3_H    = 0x0D
-LIS3DH_REG_INTCOUNT     = 0x0E
-LIS3DH_REG_WHOAMI       = 0x0F # stores device ID (for checking sensor connected)
-LIS3DH_REG_TEMPCFG      = 0x1F
-LIS3DH_REG_CTRL1        = 0x20
-LIS3DH_REG_CTRL2        = 0x21
-LIS3DH_REG_CTRL3        = 0x22
-LIS3DH_REG_CTRL4        = 0x23
-LIS3DH_REG_CTRL5        = 0x24
-LIS3DH_REG_CTRL6        = 0x25
-LIS3DH_REG_REFERENCE    = 0x26
-LIS3DH_REG_STATUS2      = 0x27
-LIS3DH_REG_OUT_X_L      = 0x28 # X-axis low byte
-LIS3DH_REG_OUT_X_H      = 0x29 # X-axis high byte
-LIS3DH_REG_OUT_Y_L      = 0x2A
-LIS3DH_REG_OUT_Y_H      = 0x2B
-LIS3DH_REG_OUT_Z_L      = 0x2C
-LIS3DH_REG_OUT_Z_H      = 0x2D
-LIS3DH_REG_FIFOCTRL     = 0x2E
-LIS3DH_REG_FIFOSRC      = 0x2F
-LIS3DH_REG_INT1CFG      = 0x30
-LIS3DH_REG_INT1SRC      = 0x31
-LIS3DH_REG_INT1THS      = 0x32
-LIS3DH_REG_INT1DUR      = 0x33
-LIS3DH_REG_CLICKCFG     = 0x38
-LIS3DH_REG_CLICKSRC     = 0x39
-LIS3DH_REG_CLICKTHS     = 0x3A
-LIS3DH_REG_TIMELIMIT    = 0x3B
-LIS3DH_REG_TIMELATENCY  = 0x3C
-LIS3DH_REG_TIMEWINDOW   = 0x3D
-LIS3DH_REG_ACTTHS       = 0x3E
-LIS3DH_REG_ACTDUR       = 0x3F
-
-LIS3DH_RANGE_16_G       = 0b11 # range. +/- 16g
-LIS3DH_RANGE_8_G        = 0b10 # +/- 8g
-LIS3DH_RANGE_4_G        = 0b01 # +/- 4g
-LIS3DH_RANGE_2_G        = 0b00 # +/- 2g (default)
-
-LIS3DH_AXIS_X           = 0x0  # axis
-LIS3DH_AXIS_Y           = 0x1
-LIS3DH_AXIS_Z           = 0x2
+_LIS3DH_DEFAULT_ADDRESS = const(0x18) # I2C address. 0x19 if SDO/SA0 is at 3V
+_LIS3DH_DEVICE_ID       = const(0x33) # expected value of _LIS3DH_REG_WHOAMI
+
+_LIS3DH_REG_STATUS1     = const(0x07) # registers
+_LIS3DH_REG_OUTADC1_L   = const(0x08)
+_LIS3DH_REG_OUTADC1_H   = const(0x09)
+_LIS3DH_REG_OUTADC2_L   = const(0x0A)
+_LIS3DH_REG_OUTADC2_H   = const(0x0B)
+_LIS3DH_REG_OUTADC3_L   = const(0x0C)
+_LIS3DH_REG_OUTADC3_H   = const(0x0D)
+_LIS3DH_REG_INTCOUNT    = const(0x0E)
+_LIS3DH_REG_WHOAMI      = const(0x0F) # device ID, checks the sensor is there
+_LIS3DH_REG_TEMPCFG     = const(0x1F)
+_LIS3DH_REG_CTRL1       = const(0x20)
+_LIS3DH_REG_CTRL2       = const(0x21)
+_LIS3DH_REG_CTRL3       = const(0x22)
+_LIS3DH_REG_CTRL4       = const(0x23)
+_LIS3DH_REG_CTRL5       = const(0x24)
+_LIS3DH_REG_CTRL6       = const(0x25)
+_LIS3DH_REG_REFERENCE   = const(0x26)
+_LIS3DH_REG_STATUS2     = const(0x27)
+_LIS3DH_REG_OUT_X_L     = const(0x28) # X-axis low byte
+_LIS3DH_REG_OUT_X_H     = const(0x29) # X-axis high byte
+_LIS3DH_REG_OUT_Y_L     = const(0x2A)
+_LIS3DH_REG_OUT_Y_H     = const(0x2B)
+_LIS3DH_REG_OUT_Z_L     = const(0x2C)
+_LIS3DH_REG_OUT_Z_H     = const(0x2D)
+_LIS3DH_REG_FIFOCTRL    = const(0x2E)
+_LIS3DH_REG_FIFOSRC     = const(0x2F)
+_LIS3DH_REG_INT1CFG     = const(0x30)
+_LIS3DH_REG_INT1SRC     = const(0x31)
+_LIS3DH_REG_INT1THS     = const(0x32)
+_LIS3DH_REG_INT1DUR     = const(0x33)
+_LIS3DH_REG_CLICKCFG    = const(0x38)
+_LIS3DH_REG_CLICKSRC    = const(0x39)
+_LIS3DH_REG_CLICKTHS    = const(0x3A)
+_LIS3DH_REG_TIMELIMIT   = const(0x3B)
+_LIS3DH_REG_TIMELATENCY = const(0x3C)
+_LIS3DH_REG_TIMEWINDOW  = const(0x3D)
+_LIS3DH_REG_ACTTHS      = const(0x3E)
+_LIS3DH_REG_ACTDUR      = const(0x3F)
+
+_LIS3DH_AUTO_INCREMENT  = const(0x80) # OR with a register address: burst access
+
+LIS3DH_RANGE_16_G       = const(0b11) # range. +/- 16g
+LIS3DH_RANGE_8_G        = const(0b10) # +/- 8g
+LIS3DH_RANGE_4_G        = const(0b01) # +/- 4g
+LIS3DH_RANGE_2_G        = const(0b00) # +/- 2g (default)
+
+LIS3DH_FIFO_SIZE        = const(32) # FIFO depth, unit: samples (x,y,z triplets)
+LIS3DH_FIFO_BYPASS      = const(0b00) # FIFO mode (FIFOCTRL bits 7:6)
+LIS3DH_FIFO_FIFO        = const(0b01) # stop collecting when full
+LIS3DH_FIFO_STREAM      = const(0b10) # keep collecting, overwrite the oldest
+LIS3DH_FIFO_STREAM2FIFO = const(0b11)
+_LIS3DH_CTRL5_FIFO_EN   = const(0x40)
+_LIS3DH_FIFOSRC_WTM     = const(0x80) # FIFOSRC flags. Level >= watermark
+_LIS3DH_FIFOSRC_OVRN    = const(0x40) # FIFO full, oldest sample overwritten
+_LIS3DH_FIFOSRC_EMPTY   = const(0x20)
+_LIS3DH_FIFOSRC_FSS     = const(0x1F) # number of unread samples
+
+_LIS3DH_CTRL3_I1_CLICK  = const(0x80) # interrupts routed to INT1 (CTRL3)
+_LIS3DH_CTRL3_I1_IA1    = const(0x40) # inertial interrupt 1 (wake-up)
+_LIS3DH_CTRL3_I1_ZYXDA  = const(0x10) # new x,y,z data ready
+_LIS3DH_CTRL3_I1_WTM    = const(0x04) # FIFO watermark reached
+_LIS3DH_CTRL6_I2_CLICK  = const(0x80) # click interrupt on INT2 (CTRL6)
+_LIS3DH_CTRL5_LIR_INT1  = const(0x08) # INT1 latched until INT1SRC is read
+_LIS3DH_CTRL2_HP_IA1    = const(0x01) # high-pass filter on interrupt 1 only
+_LIS3DH_INT1CFG_HIGH    = const(0x2A) # OR of X, Y and Z high events
+_LIS3DH_INT1SRC_IA      = const(0x40) # interrupt 1 active
+_LIS3DH_THS_MG          = (16, 32, 62, 186) # INT1THS LSB by range code, mg
+
+# raw sample trace file: header, then fixed size records of
+#   tick (ticks_ms, u32), x, y, z (raw int16), all little endian
+TRACE_MAGIC         = b'LTRC'
+TRACE_VERSION       = const(1)
+TRACE_HEADER        = '<4sBBHHHI'   # magic, version, record size, data rate
+                                    #   (Hz), counts per g, range (g), start tick
+TRACE_RECORD        = '<Ihhh'
+TRACE_RECORD_SIZE   = const(10)
+
+LIS3DH_AXIS_X           = const(0x0) # axis
+LIS3DH_AXIS_Y           = const(0x1)
+LIS3DH_AXIS_Z           = const(0x2)
 
 # data rate: for setting bandwidth
-LIS3DH_DATARATE_400_HZ          = 0b0111 # 400Hz
-LIS3DH_DATARATE_200_HZ          = 0b0110 # 200Hz
-LIS3DH_DATARATE_100_HZ          = 0b0101 # 100Hz
-LIS3DH_DATARATE_50_HZ           = 0b0100 # 50Hz
-LIS3DH_DATARATE_25_HZ           = 0b0011 # 25Hz
-LIS3DH_DATARATE_10_HZ           = 0b0010 # 10Hz
-LIS3DH_DATARATE_1_HZ            = 0b0001 # 1Hz
-LIS3DH_DATARATE_POWERDOWN       = 0
-LIS3DH_DATARATE_LOWPOWER_1K6HZ  = 0b1000
-LIS3DH_DATARATE_LOWPOWER_5KHZ   = 0b1001
+LIS3DH_DATARATE_400_HZ          = const(0b0111) # 400Hz
+LIS3DH_DATARATE_200_HZ          = const(0b0110) # 200Hz
+LIS3DH_DATARATE_100_HZ          = const(0b0101) # 100Hz
+LIS3DH_DATARATE_50_HZ           = const(0b0100) # 50Hz
+LIS3DH_DATARATE_25_HZ           = const(0b0011) # 25Hz
+LIS3DH_DATARATE_10_HZ           = const(0b0010) # 10Hz
+LIS3DH_DATARATE_1_HZ            = const(0b0001) # 1Hz
+LIS3DH_DATARATE_POWERDOWN       = const(0)
+LIS3DH_DATARATE_LOWPOWER_1K6HZ  = const(0b1000)
+LIS3DH_DATARATE_LOWPOWER_5KHZ   = const(0b1001)
+
+# sample rate in Hz for each data rate code above (normal mode)
+LIS3DH_DATARATE_HZ = (0, 1, 10, 25, 50, 100, 200, 400, 1600, 1344)
 
 
 
 
 #//////////////////// variables ///////////////////////////////////////////////
-_i2c_addr = LIS3DH_DEFAULT_ADDRESS
-_i2c_port = I2C(scl = Pin(5), sda = Pin(4), freq = 400000)
+_i2c_addr = _LIS3DH_DEFAULT_ADDRESS
+# raw x, y, z triplets drained from the FIFO. _fifo_views[n] covers the first n
+#   samples so a partial drain can read straight into it without allocating.
+#   Allocated by enable_fifo()
+_fifo_buf = None
+_fifo_views = None
+
+fifo_enabled = False
+fifo_overruns = 0   # number of drains that found samples had been overwritten
+_fifo_ctrl = 0      # FIFOCTRL value set by enable_fifo(), to restart the FIFO
+
+_int1 = None        # machine.Pin wired to LIS3DH INT1
+_irq_pending = False
+irq_enabled = False
+data_flag = None    # uasyncio.ThreadSafeFlag set after each INT1 read, created
+                    #   by enable_irq(): await data_flag.wait() wakes on data
 
 range_g = 0 # sensor range as +/- *g
 divider = 1 # depends on range. Acceleration in g = sensor data / divider
+data_rate = LIS3DH_DATARATE_POWERDOWN  # data rate code set by set_data_rate()
+data_rate_hz = 0
+_period_us = 0      # sample period at data_rate_hz
+
+adaptive = False    # data rate follows detector.activity (init(adaptive))
+_still_tick = None  # ticks_ms() since activity has been below ODR_IDLE_ACTIVITY,
+                    #   None while moving (see still_ms())
+_switching = False  # a rate change is draining the sensor, see _switch_rate()
+rate_switches = 0
+
+waiting = False     # wake-up armed: INT1 signals motion, not data
+_wake_rate = 0      # data rate to restore when motion is detected
 
 global_distance = 0
 global_steps = 0
-step_timer_start = utime.time()
+detector = None     # StepDetector, created once range and data rate are known
+_step_cursor = 0    # sequence number of the next sample for step detection
+
+_rec_stream = None  # trace destination while recording
+_rec_close = False  # True if the stream is a file opened by start_recording()
+_rec_buf = None     # block of records written with one stream.write()
+_rec_fill = 0       # bytes used in _rec_buf
+_rec_cursor = 0     # sequence number of the next sample to record
+recorded = 0        # samples written to the trace
 
 
 
@@ -106,12 +184,39 @@ ACCEL_NUM_SAMPLES = 10
 ACCEL_READ_INTERVAL = 0.1
 ACCEL_STATIONARY_MARGIN = 0.1
 
-STEP_THRESHOLD = 1.4                    # unit: mm s^-2. For step detection
-STEP_MAX_RPM = 180                      # max assumed cadence
-# STEP_MIN_INTERVAL: the minimum cooldown time between consecutive steps to
-#   avoid detecting 1 steps as many step (due to vibration etc.)
-#   unit: second
-STEP_MIN_INTERVAL = 60 / STEP_MAX_RPM
+# step detection parameters (filter windows, threshold, max cadence) are in
+#   stepdetect.py
+
+# FIFO_WATERMARK: FIFO level (samples) at which get_steps() drains the FIFO.
+#   Leaves headroom in the 32 sample FIFO for a slow main loop iteration
+FIFO_WATERMARK = 24
+
+# output data rate. Step detection needs ~25 Hz; with init(adaptive = True)
+#   the rate drops to ODR_IDLE once detector.activity has stayed below
+#   ODR_IDLE_ACTIVITY for ODR_IDLE_MS, and goes back to ODR_ACTIVE as soon as it
+#   reaches ODR_WAKE_ACTIVITY. Still: ~10-25 (1/1024 g^2), walking: 300+
+ODR_ACTIVE = LIS3DH_DATARATE_50_HZ
+ODR_IDLE = LIS3DH_DATARATE_10_HZ
+ODR_IDLE_ACTIVITY = 40
+ODR_WAKE_ACTIVITY = 56
+ODR_IDLE_MS = 5000
+
+# motion wake-up (arm_wake()): INT1 rises once the high-pass filtered
+#   acceleration on any axis exceeds WAKE_THRESHOLD_MG for more than
+#   WAKE_DURATION samples at ODR_IDLE. Walking: 300+ mg, still: < 20 mg
+WAKE_THRESHOLD_MG = 80
+WAKE_DURATION = 1
+
+INT1_PIN = 12       # ESP8266 GPIO wired to LIS3DH INT1
+SAMPLE_BUFFER_SIZE = 64     # unit: samples. Holds two full FIFO drains
+TRACE_BLOCK = 32            # unit: records. Trace is written in blocks of this
+
+
+
+#//////////////////// sample store ////////////////////////////////////////////
+# every acquisition path (polled, FIFO, INT1) writes raw samples here. Created
+#   by init(), so importing the driver allocates nothing
+samples = None
 
 
 
@@ -122,76 +227,154 @@ STEP_MIN_INTERVAL = 60 / STEP_MAX_RPM
 def begin_i2c():                                # begin I2C communication
     print("Begin I2C communication...")
 
-    device_id = read_mem_8(LIS3DH_REG_WHOAMI)
+    device_id = read_mem_8(_LIS3DH_REG_WHOAMI)
     #print('LIS3DH device_id: {0}'.format(hex(device_id)))
 
-    if device_id != LIS3DH_DEVICE_ID:
+    if device_id != _LIS3DH_DEVICE_ID:
         print("FAILURE: LIS3DH not detected at address {0}".format(hex(_i2c_addr)))
         return False                            # sensor not found
     else:
         print("SUCCESS: LIS3DH detected at {0}".format(hex(_i2c_addr)))
-        write_mem_8(LIS3DH_REG_CTRL1, 0x07)     # enable all axes, normal mode
-        set_data_rate(LIS3DH_DATARATE_400_HZ)   # 400Hz rate
-        write_mem_8(LIS3DH_REG_CTRL4, 0x88)     # high res & BDU enabled
-        write_mem_8(LIS3DH_REG_CTRL3, 0x10)     # DRDY on INT1
-        write_mem_8(LIS3DH_REG_TEMPCFG, 0x80)   # enable adcs
+        write_mem_8(_LIS3DH_REG_CTRL1, 0x07)     # enable all axes, normal mode
+        set_data_rate(ODR_ACTIVE)
+        write_mem_8(_LIS3DH_REG_CTRL4, 0x88)     # high res & BDU enabled
+        write_mem_8(_LIS3DH_REG_CTRL3, 0x10)     # DRDY on INT1
+        write_mem_8(_LIS3DH_REG_TEMPCFG, 0x80)   # enable adcs
         return True                             # sensor found and initialised
 
-def set_data_rate(data_rate):
-    ctl1 = read_mem_8(LIS3DH_REG_CTRL1)
+def set_data_rate(rate):
+    global data_rate, data_rate_hz, _period_us
+    ctl1 = read_mem_8(_LIS3DH_REG_CTRL1)
     ctl1 &= ~(0xF0) # mask off bits
-    ctl1 |= (data_rate << 4)
-    write_mem_8(LIS3DH_REG_CTRL1, ctl1)
-
-def get_accel():                            # read x y z at once
-    # read data
-    x_MSB = read_mem_8(LIS3DH_REG_OUT_X_H)  # read x high byte register
-    x_LSB = read_mem_8(LIS3DH_REG_OUT_X_L)  # read x low byte register
-    y_MSB = read_mem_8(LIS3DH_REG_OUT_Y_H)
-    y_LSB = read_mem_8(LIS3DH_REG_OUT_Y_L)
-    z_MSB = read_mem_8(LIS3DH_REG_OUT_Z_H)
-    z_LSB = read_mem_8(LIS3DH_REG_OUT_Z_L)
-
-    # calculation
-    global global_vel_x
-    global global_vel_y
-    global global_vel_z
-    global global_dist_x
-    global global_dist_y
-    global global_dist_z
-
-    accel_x = (uint16_to_int16((x_MSB << 8) | (x_LSB))/divider)
-    accel_y = (uint16_to_int16((y_MSB << 8) | (y_LSB))/divider)
-    accel_z = (uint16_to_int16((z_MSB << 8) | (z_LSB))/divider)
-    accel_mag = get_xyz_mag(accel_x, accel_y, accel_z)
-
-    # compile data
-    data = {}
-    data['mag'] = accel_mag
+    ctl1 |= (rate << 4)
+    write_mem_8(_LIS3DH_REG_CTRL1, ctl1)
+    data_rate = rate
+    data_rate_hz = LIS3DH_DATARATE_HZ[rate]
+    if data_rate_hz:
+        _period_us = 1000000 // data_rate_hz
+
+def get_accel():        # read x y z at once into the sample store
+    # one auto-increment burst over OUT_X_L..OUT_Z_H. Both the sensor and the
+    #   ESP8266 are little endian, so the bytes land directly as int16 values
+    i2cbus.read_into(_i2c_addr, _LIS3DH_REG_OUT_X_L | _LIS3DH_AUTO_INCREMENT,
+        samples.next_slot())
+    samples.commit(utime.ticks_ms())
+    return samples.latest()         # sequence number of the new sample
+
+def enable_fifo(watermark = FIFO_WATERMARK, mode = LIS3DH_FIFO_STREAM):
+    global fifo_enabled, _fifo_buf, _fifo_views, _fifo_ctrl
+    if _fifo_buf is None:
+        _fifo_buf = array('h', [0] * (3 * LIS3DH_FIFO_SIZE))
+        _fifo_views = [memoryview(_fifo_buf)[:3 * n]
+            for n in range(LIS3DH_FIFO_SIZE + 1)]
+    write_mem_8(_LIS3DH_REG_FIFOCTRL, LIS3DH_FIFO_BYPASS << 6) # clear FIFO
+    r = read_mem_8(_LIS3DH_REG_CTRL5)
+    write_mem_8(_LIS3DH_REG_CTRL5, r | _LIS3DH_CTRL5_FIFO_EN)
+    _fifo_ctrl = (mode << 6) | (watermark & 0x1F)
+    write_mem_8(_LIS3DH_REG_FIFOCTRL, _fifo_ctrl)
+    fifo_enabled = True
+
+def disable_fifo():
+    global fifo_enabled
+    write_mem_8(_LIS3DH_REG_FIFOCTRL, LIS3DH_FIFO_BYPASS << 6)
+    r = read_mem_8(_LIS3DH_REG_CTRL5)
+    write_mem_8(_LIS3DH_REG_CTRL5, r & ~_LIS3DH_CTRL5_FIFO_EN)
+    fifo_enabled = False
+
+def fifo_level():                           # number of unread FIFO samples
+    global fifo_overruns
+    src = read_mem_8(_LIS3DH_REG_FIFOSRC)
+    if src & _LIS3DH_FIFOSRC_OVRN:
+        fifo_overruns += 1
+        return LIS3DH_FIFO_SIZE
+    return src & _LIS3DH_FIFOSRC_FSS
+
+def read_fifo(n):                           # drain n samples in one burst
+    # with the FIFO enabled, auto-increment wraps from OUT_Z_H back to OUT_X_L
+    #   so a single 6*n byte read pops n samples
+    if n > 0:
+        i2cbus.read_into(_i2c_addr, _LIS3DH_REG_OUT_X_L | _LIS3DH_AUTO_INCREMENT,
+            _fifo_views[n])
+    return _fifo_buf
+
+def enable_irq(pin_id = INT1_PIN):     # sample from the INT1 interrupt
+    global _int1, irq_enabled, data_flag
+    micropython.alloc_emergency_exception_buf(100)
+    if data_flag is None:
+        import uasyncio             # only needed when interrupt driven
+        data_flag = uasyncio.ThreadSafeFlag()
+
+    # INT1 signals the FIFO watermark in FIFO mode, every new sample otherwise
+    r = read_mem_8(_LIS3DH_REG_CTRL3)
+    r &= ~(_LIS3DH_CTRL3_I1_ZYXDA | _LIS3DH_CTRL3_I1_WTM)
+    if fifo_enabled:
+        r |= _LIS3DH_CTRL3_I1_WTM
+    else:
+        r |= _LIS3DH_CTRL3_I1_ZYXDA
+    write_mem_8(_LIS3DH_REG_CTRL3, r)
+
+    _int1 = Pin(pin_id, Pin.IN)
+    _int1.irq(trigger = Pin.IRQ_RISING, handler = _isr)
+    irq_enabled = True
+
+def disable_irq():
+    global irq_enabled
+    if _int1 is not None:
+        _int1.irq(handler = None)
+    r = read_mem_8(_LIS3DH_REG_CTRL3)
+    write_mem_8(_LIS3DH_REG_CTRL3,
+        r & ~(_LIS3DH_CTRL3_I1_ZYXDA | _LIS3DH_CTRL3_I1_WTM))
+    irq_enabled = False
+
+def _isr(pin):      # hard IRQ context: no allocation, no I2C. Defer the read
+    global _irq_pending
+    if not _irq_pending:
+        _irq_pending = True
+        micropython.schedule(_service_irq, 0)
+
+def _service_irq(_):                # scheduled: read into the sample store
+    global _irq_pending
+    _irq_pending = False
+    if _switching or waiting:
+        return                      # _switch_rate() is reading the sensor, or
+                                    #   INT1 signals motion
+    if fifo_enabled:
+        n = fifo_level()
+        samples.put_batch(read_fifo(n), n, utime.ticks_ms(), _period_us)
+    else:
+        get_accel()
+    data_flag.set()                 # wake the step detection task
 
-    return data
+def check_irq():    # re-arm a missed INT1 edge
+    # INT1 is level while data is unread: if its edge was missed (e.g. the
+    #   schedule queue was full) nothing would ever read it again
+    if irq_enabled and not waiting and _int1.value() and not _irq_pending:
+        _isr(_int1)
 
 def set_click(c, click_thresh, time_limit = 10, time_latency = 20, time_window = 255):
     if c == 0:          # disable int
-        r = read_mem_8(LIS3DH_REG_CTRL3)
-        r &= ~(0x80)    # turn off I1_CLICK
-        write_mem_8(LIS3DH_REG_CTRL3, r)
-        write_mem_8(LIS3DH_REG_CLICKCFG, 0)
+        r = read_mem_8(_LIS3DH_REG_CTRL6)
+        r &= ~(_LIS3DH_CTRL6_I2_CLICK)  # turn off I2_CLICK
+        write_mem_8(_LIS3DH_REG_CTRL6, r)
+        write_mem_8(_LIS3DH_REG_CLICKCFG, 0)
     else:
-        write_mem_8(LIS3DH_REG_CTRL3, 0x80) # turn on int1 click
-        write_mem_8(LIS3DH_REG_CTRL5, 0x08) # latch interrupt on int1
+        # click interrupt goes to INT2 so that INT1 only signals new data.
+        #   CTRL5 is left alone: LIR_INT1 latches the INT1 inertial interrupt
+        #   (arm_wake() sets it), not the click; get_click() reads CLICKSRC
+        r = read_mem_8(_LIS3DH_REG_CTRL6)
+        write_mem_8(_LIS3DH_REG_CTRL6, r | _LIS3DH_CTRL6_I2_CLICK)
         if c == 1:
-            write_mem_8(LIS3DH_REG_CLICKCFG, 0x15) # turn on all axes & single-click
+            write_mem_8(_LIS3DH_REG_CLICKCFG, 0x15) # turn on all axes & single-click
         elif c == 2:
-            write_mem_8(LIS3DH_REG_CLICKCFG, 0x2A) # turn on all axes & double-click
+            write_mem_8(_LIS3DH_REG_CLICKCFG, 0x2A) # turn on all axes & double-click
 
-        write_mem_8(LIS3DH_REG_CLICKTHS, click_thresh)      # arbitrary
-        write_mem_8(LIS3DH_REG_TIMELIMIT, time_limit)       # arbitrary
-        write_mem_8(LIS3DH_REG_TIMELATENCY, time_latency)   # arbitrary
-        write_mem_8(LIS3DH_REG_TIMEWINDOW, time_window)     # arbitrary
+        write_mem_8(_LIS3DH_REG_CLICKTHS, click_thresh)      # arbitrary
+        write_mem_8(_LIS3DH_REG_TIMELIMIT, time_limit)       # arbitrary
+        write_mem_8(_LIS3DH_REG_TIMELATENCY, time_latency)   # arbitrary
+        write_mem_8(_LIS3DH_REG_TIMEWINDOW, time_window)     # arbitrary
 
 def get_click_raw():
-    return read_mem_8(LIS3DH_REG_CLICKSRC)
+    return read_mem_8(_LIS3DH_REG_CLICKSRC)
 
 def get_click():
     # read data
@@ -223,12 +406,6 @@ def get_click():
 
     return data
 
-def uint16_to_int16(uint16):
-    result = uint16
-    if result > 32767:
-        result -= 65536
-    return result
-
 def set_range(range = 2):   # range = 2,4,8 or 16
     r = LIS3DH_RANGE_2_G    # default
     if range == 4:
@@ -237,22 +414,20 @@ def set_range(range = 2):   # range = 2,4,8 or 16
         r = LIS3DH_RANGE_8_G
     elif range == 16:
         r = LIS3DH_RANGE_16_G
-    reg_data = read_mem_8(LIS3DH_REG_CTRL4)
+    reg_data = read_mem_8(_LIS3DH_REG_CTRL4)
     reg_data &= ~(0x30)
     reg_data |= r << 4
-    write_mem_8(LIS3DH_REG_CTRL4, reg_data)
+    write_mem_8(_LIS3DH_REG_CTRL4, reg_data)
 
 def get_range():        # read the data format register to preserve bits
-    r = read_mem_8(LIS3DH_REG_CTRL4)
+    r = read_mem_8(_LIS3DH_REG_CTRL4)
     r = (r >> 4) & 0x03
     return r
 
-def get_xyz_mag(x, y, z): # return magnitude of a 3D vector
-    return math.pow(x, 2) + math.pow(y, 2) + math.pow(z, 2)
-
 def init_all_param():   # initialise all global parameters
     global divider
     global range_g
+    global detector
     range = get_range()
     if (range == LIS3DH_RANGE_16_G):
         range_g = 16
@@ -266,54 +441,241 @@ def init_all_param():   # initialise all global parameters
     if (range == LIS3DH_RANGE_2_G):
         range_g = 2
         divider = 16380
+    detector = StepDetector(data_rate_hz, divider)
 
 def write_mem_8(reg_addr, data):
-    _i2c_port.writeto_mem(_i2c_addr, reg_addr, bytearray([data]))
-
-def read_mem(reg_addr, nbytes):
-    str = _i2c_port.readfrom_mem(_i2c_addr, reg_addr, nbytes)
-    result = 0
-    counter = 0
-    for char in str:
-        result = result << counter | char
-        counter += 8
-    return result
+    i2cbus.write_u8(_i2c_addr, reg_addr, data)
 
 def read_mem_8(reg_addr):
-    return read_mem(reg_addr, 1)
+    return i2cbus.read_u8(_i2c_addr, reg_addr)
 
 def addr_detected():
-    if _i2c_addr in _i2c_port.scan():
+    if _i2c_addr in i2cbus.scan():
         return True
     else:
         return False
 
 # "public" functions
 
-def init(range, ct):
+def init(range, ct, fifo = False, irq = False, adaptive = False):
+    global samples
     if not addr_detected():
         return False
     else:
+        if samples is None:
+            samples = SampleBuffer(SAMPLE_BUFFER_SIZE)
         begin_i2c()
         set_range(range)
         set_click(2, click_thresh = ct)
         init_all_param()
+        if fifo:
+            enable_fifo()
+        if irq:
+            enable_irq()
+        set_adaptive(adaptive)
         return True
 
 def get_steps():
-    # read raw data
-    raw_data = {}
-    raw_data['accel'] = get_accel()       # read x,y,z acceleration
-
-    # calculation (step detection)
-    global global_distance
-    global global_steps
-    global step_timer_start
-    if step_detected(raw_data) == True and utime.time() - step_timer_start >= STEP_MIN_INTERVAL:
-        global_steps += 1
-        step_timer_start = utime.time()  # reset step timer
-
+    # read raw data. With the INT1 handler enabled it has already been stored
+    if not irq_enabled:
+        if fifo_enabled:
+            n = fifo_level()
+            if n < FIFO_WATERMARK:
+                return global_steps         # wait for a full batch
+            samples.put_batch(read_fifo(n), n, utime.ticks_ms(), _period_us)
+        else:
+            get_accel()
+
+    if _rec_stream is not None:
+        record()
+    count_steps()
+    _track_still()
+    if adaptive:
+        adapt_rate()
     return global_steps
 
-def step_detected(data):     # return number of steps
-    return data['accel']['mag'] >= STEP_THRESHOLD
\ No newline at end of file
+def poll_interval_ms():     # longest get_steps() period that loses no samples
+    if irq_enabled:
+        return None                 # the INT1 handler reads the sensor
+    if fifo_enabled:                # from the watermark until the FIFO is full
+        return max(1, (LIS3DH_FIFO_SIZE - FIFO_WATERMARK) * 1000 // data_rate_hz)
+    return max(1, 1000 // data_rate_hz)
+
+def set_adaptive(on):
+    global adaptive, _still_tick
+    adaptive = on
+    _still_tick = None
+    if not on and data_rate != ODR_ACTIVE:
+        _switch_rate(ODR_ACTIVE)
+
+def _track_still():         # time since detector.activity fell below the idle
+    global _still_tick      #   level, with hysteresis once at ODR_IDLE
+    wake = ODR_WAKE_ACTIVITY if data_rate == ODR_IDLE else ODR_IDLE_ACTIVITY
+    if detector.activity >= wake:
+        _still_tick = None
+    elif _still_tick is None:
+        _still_tick = utime.ticks_ms()
+
+def still_ms():             # how long the sensor has been still, unit: ms
+    if _still_tick is None:
+        return 0
+    return utime.ticks_diff(utime.ticks_ms(), _still_tick)
+
+def adapt_rate():           # choose the data rate from the detector's activity
+    if _rec_stream is not None:
+        return                      # a trace has a single data rate
+    if data_rate == ODR_IDLE:
+        if _still_tick is None:
+            _switch_rate(ODR_ACTIVE)
+    elif still_ms() >= ODR_IDLE_MS:
+        _switch_rate(ODR_IDLE)
+
+def _switch_rate(rate):     # change the data rate without a step count glitch
+    # every sample taken at the old rate is read, timed and filtered at the
+    #   old rate first. The FIFO is then restarted so that it holds no sample
+    #   from before the change, and the detector windows are resized keeping
+    #   their levels. At most the sample arriving during the change is lost
+    global _switching, rate_switches
+    _switching = True               # keeps the INT1 handler off the bus
+    if fifo_enabled:
+        n = fifo_level()
+        samples.put_batch(read_fifo(n), n, utime.ticks_ms(), _period_us)
+    count_steps()
+    set_data_rate(rate)
+    if fifo_enabled:
+        write_mem_8(_LIS3DH_REG_FIFOCTRL, LIS3DH_FIFO_BYPASS << 6)
+        write_mem_8(_LIS3DH_REG_FIFOCTRL, _fifo_ctrl)
+    detector.configure(data_rate_hz)
+    rate_switches += 1
+    _switching = False
+    check_irq()
+
+def arm_wake():             # stop sampling until the sensor is moved
+    # the samples so far are processed, then INT1 is switched from the FIFO
+    #   watermark to the inertial interrupt: high-pass filtered (gravity and
+    #   posture removed) and latched, so a motion during a light sleep keeps
+    #   INT1 high until woken() sees it. The FIFO keeps running in stream mode
+    #   and holds the last LIS3DH_FIFO_SIZE samples for disarm_wake()
+    global waiting, _wake_rate, _int1
+    if waiting:
+        return
+    _wake_rate = data_rate
+    if data_rate != ODR_IDLE:
+        _switch_rate(ODR_IDLE)
+    if _int1 is None:
+        _int1 = Pin(INT1_PIN, Pin.IN)   # polled: level only, no handler
+    waiting = True
+    write_mem_8(_LIS3DH_REG_INT1CFG, 0)
+    lsb = _LIS3DH_THS_MG[get_range()]
+    ths = (WAKE_THRESHOLD_MG + lsb - 1) // lsb
+    write_mem_8(_LIS3DH_REG_INT1THS, max(1, min(ths, 0x7F)))
+    write_mem_8(_LIS3DH_REG_INT1DUR, WAKE_DURATION)
+    r = read_mem_8(_LIS3DH_REG_CTRL2)
+    write_mem_8(_LIS3DH_REG_CTRL2, r | _LIS3DH_CTRL2_HP_IA1)
+    r = read_mem_8(_LIS3DH_REG_CTRL5)
+    write_mem_8(_LIS3DH_REG_CTRL5, r | _LIS3DH_CTRL5_LIR_INT1)
+    read_mem_8(_LIS3DH_REG_REFERENCE)   # reset the filter to the current pose
+    read_mem_8(_LIS3DH_REG_INT1SRC)     # clear an old event
+    r = read_mem_8(_LIS3DH_REG_CTRL3)
+    write_mem_8(_LIS3DH_REG_CTRL3, (r & ~(_LIS3DH_CTRL3_I1_ZYXDA |
+        _LIS3DH_CTRL3_I1_WTM)) | _LIS3DH_CTRL3_I1_IA1)
+    write_mem_8(_LIS3DH_REG_INT1CFG, _LIS3DH_INT1CFG_HIGH)
+
+def woken():                # the sensor has moved since arm_wake()
+    return _int1.value() == 1       # no I2C: safe to call after every sleep
+
+def disarm_wake():          # back to sampling after woken()
+    # the FIFO samples leading up to the wake-up, including the motion that
+    #   triggered it, are stored first so that the detector sees the start of
+    #   the walk; only samples older than the FIFO depth (still) are skipped
+    global waiting, _still_tick
+    if not waiting:
+        return
+    write_mem_8(_LIS3DH_REG_INT1CFG, 0)
+    read_mem_8(_LIS3DH_REG_INT1SRC)     # release the latch
+    r = read_mem_8(_LIS3DH_REG_CTRL2)
+    write_mem_8(_LIS3DH_REG_CTRL2, r & ~_LIS3DH_CTRL2_HP_IA1)
+    r = read_mem_8(_LIS3DH_REG_CTRL3) & ~_LIS3DH_CTRL3_I1_IA1
+    if irq_enabled:
+        r |= _LIS3DH_CTRL3_I1_WTM if fifo_enabled else _LIS3DH_CTRL3_I1_ZYXDA
+    if fifo_enabled:                # full after the sleep: not an overrun
+        src = read_mem_8(_LIS3DH_REG_FIFOSRC)
+        n = LIS3DH_FIFO_SIZE if src & _LIS3DH_FIFOSRC_OVRN else \
+            src & _LIS3DH_FIFOSRC_FSS
+        samples.put_batch(read_fifo(n), n, utime.ticks_ms(), _period_us)
+    write_mem_8(_LIS3DH_REG_CTRL3, r)
+    waiting = False
+    _still_tick = None
+    rate = ODR_ACTIVE if adaptive else _wake_rate
+    if rate != data_rate:
+        _switch_rate(rate)
+    else:
+        check_irq()
+
+def count_steps():          # step detection over samples not yet processed
+    global global_steps
+    global _step_cursor
+    seq = samples.oldest(_step_cursor)
+    n = samples.pending(seq)
+    xyz = samples.xyz
+    ticks = samples.ticks
+    i = samples.index(seq)
+    for _ in range(n):
+        j = 3 * i
+        global_steps += detector.update(xyz[j], xyz[j + 1], xyz[j + 2], ticks[i])
+        i += 1
+        if i == samples.capacity:
+            i = 0
+    _step_cursor = samples.advance(seq, n)
+
+def start_recording(dest):  # dest: file name on flash, or a stream (socket...)
+    # records every sample step detection has not processed yet, so a replay
+    #   of the trace sees exactly what the on-device detector sees
+    global _rec_stream, _rec_close, _rec_buf, _rec_fill, _rec_cursor, recorded
+    if _rec_stream is not None:
+        stop_recording()
+    if isinstance(dest, str):
+        _rec_stream = open(dest, 'wb')
+        _rec_close = True
+    else:
+        _rec_stream = dest
+        _rec_close = False
+    if _rec_buf is None:
+        _rec_buf = bytearray(TRACE_RECORD_SIZE * TRACE_BLOCK)
+    _rec_fill = 0
+    _rec_cursor = _step_cursor
+    recorded = 0
+    _rec_stream.write(ustruct.pack(TRACE_HEADER, TRACE_MAGIC, TRACE_VERSION,
+        TRACE_RECORD_SIZE, data_rate_hz, divider, range_g, utime.ticks_ms()))
+
+def record():               # append the samples stored since the last call
+    global _rec_fill, _rec_cursor, recorded
+    seq = samples.oldest(_rec_cursor)
+    n = samples.pending(seq)
+    xyz = samples.xyz
+    i = samples.index(seq)
+    for _ in range(n):
+        j = 3 * i
+        ustruct.pack_into(TRACE_RECORD, _rec_buf, _rec_fill, samples.ticks[i],
+            xyz[j], xyz[j + 1], xyz[j + 2])
+        _rec_fill += TRACE_RECORD_SIZE
+        if _rec_fill == len(_rec_buf):
+            _rec_stream.write(_rec_buf)
+            _rec_fill = 0
+        i += 1
+        if i == samples.capacity:
+            i = 0
+    recorded += n
+    _rec_cursor = samples.advance(seq, n)
+
+def stop_recording():
+    global _rec_stream, _rec_fill
+    if _rec_stream is None:
+        return
+    record()
+    if _rec_fill:
+        _rec_stream.write(memoryview(_rec_buf)[:_rec_fill])
+        _rec_fill = 0
+    if _rec_close:
+        _rec_stream.close()
+    _rec_stream = None
@@ -3,13 +3,15 @@
 
 
 #//////////////////// imports /////////////////////////////////////////////////
-import machine
-import math
-import ujson
 import utime
+_boot_tick = utime.ticks_ms()           # before the other imports
+import gc
+import machine
+import uasyncio as asyncio
 import lis3dh
 import tmp007
 import mqttpublisher as mp
+import_ms = utime.ticks_diff(utime.ticks_ms(), _boot_tick)  # unit: ms
 
 
 
@@ -39,23 +41,45 @@ class User:                     # user data for calories estimation
 
 #//////////////////// variables ///////////////////////////////////////////////
 rtc = machine.RTC()                     # RTC clock
-rtc.datetime((2018,2,15,5,09,23,0,0))   # initialise
+rtc.datetime((2018,2,15,5,9,23,0,0))   # initialise
 
 u = User(20, 70, 1.80, 3.5)
 
+last_sent = {}                          # field -> value last published
+temp = None                             # unit: C. Latest object temperature,
+                                        #   None before the first conversion
+heap_free = 0                           # unit: bytes. Free after the imports
+ready_ms = 0                            # unit: ms. From main.py start to sampling
+sleeps = 0                              # motion-wake sleeps
+slept_ms = 0                            # unit: ms. Time spent in them
+
 
 
 #//////////////////// parameters //////////////////////////////////////////////
-SEND_INTERVAL = 4       # unit: second. Time interval for publishing to MQTT
+# task rates: each task only does its own work at its own rate
+STEP_INTERVAL_MS = 50   # unit: ms. Step detection when polling the sensor;
+                        #   interrupt driven, it runs when data has been read
+TEMP_INTERVAL_MS = 1000 # unit: ms. TMP007 check; it is only read once per
+                        #   conversion (~4 s with 16 sample averaging)
+NET_INTERVAL_MS = 250   # unit: ms. Connection manager and batch sending
+SEND_INTERVAL = 4       # unit: second. Time interval for checking for changes
+HEARTBEAT_INTERVAL = 60 # unit: second. Longest time without publishing
+
+# a field is published once it has moved this far from the value last sent
+DEADBANDS = {'steps': 10,               # unit: steps
+             'temp': 0.5,               # unit: C
+             'cal': 1.0}                # unit: cal
+TRACE_FILE = None       # e.g. 'trace.bin': record raw samples to flash
+DIAG_INTERVAL = 0       # unit: second. Diagnostics report on mp.DIAG_TOPIC,
+                        #   0: off (nothing is timed)
+SLEEP_AFTER = 120       # unit: second. Still for this long: stop sampling and
+                        #   publishing, radio off, light sleep until the
+                        #   LIS3DH wake-up interrupt. 0: never
+WAKE_CHECK_MS = 500     # unit: ms. Light sleep between checks of INT1
 
 
 
 #//////////////////// functions ///////////////////////////////////////////////
-def accel_mag(accel_data):
-    mag = math.sqrt(math.pow(accel_data['x'], 2) + math.pow(accel_data['y'], 2)
-        + math.pow(accel_data['z'], 2))
-    return mag
-
 def formatted_datetime(datetime):
     return '{:d}-{:d}-{:d} {:02d}:{:02d}:{:02d}'.format(datetime[0],
         datetime[1], datetime[2], datetime[4], datetime[5], datetime[6])
@@ -63,32 +87,148 @@ def formatted_datetime(datetime):
 def calories(user, steps):
     return steps * user.cal_factor
 
-def compile_data():
-    steps = lis3dh.get_steps()
+def compile_data():             # latest values from the other tasks
+    steps = lis3dh.global_steps
     data = {}
-    data['temp'] = tmp007.read_obj_temp_c()             # add temperature
+    if temp is not None:
+        data['temp'] = temp                             # add temperature
     data['time'] = formatted_datetime(rtc.datetime())   # add time stamp
+    data['ts'] = utime.time()                           # s since 2000
+    data['tick'] = utime.ticks_ms()                     # for latency
     data['steps'] = steps                               # add step
     data['cal'] = calories(u, steps)                    # add expended calories
     return data
 
+def changed_fields(data):       # fields outside their deadband, with time stamps
+    delta = {}
+    for field, band in DEADBANDS.items():
+        if field not in data:
+            continue
+        if field not in last_sent or abs(data[field] - last_sent[field]) >= band:
+            delta[field] = data[field]
+    if delta:
+        delta['ts'] = data['ts']
+        delta['tick'] = data['tick']
+    return delta
+
+def sleep_until_moved():        # stationary: pause everything until moved
+    # blocks on purpose: no task needs to run while nothing changes. The last
+    #   values are published first, so the receivers are up to date
+    global sleeps, slept_ms
+    data = compile_data()
+    mp.publish(data)
+    last_sent.update(data)
+    mp.suspend()
+    lis3dh.arm_wake()
+    t0 = utime.ticks_ms()
+    while not lis3dh.woken():
+        machine.lightsleep(WAKE_CHECK_MS)   # CPU mostly halted, radio off
+    lis3dh.disarm_wake()
+    sleeps += 1
+    slept_ms += utime.ticks_diff(utime.ticks_ms(), t0)
+    mp.resume()
+
+# tasks
+async def accel_task():         # fast path: step detection only
+    while True:
+        lis3dh.get_steps()      # reads the sensor too when not interrupt driven
+        if SLEEP_AFTER and TRACE_FILE is None and \
+                lis3dh.still_ms() >= SLEEP_AFTER * 1000:
+            sleep_until_moved()
+        if lis3dh.irq_enabled:  # wakes when the INT1 handler has read data
+            await lis3dh.data_flag.wait()
+            continue
+        interval = lis3dh.poll_interval_ms()    # when polling the sensor; it
+        if interval > STEP_INTERVAL_MS:         #   follows the rate
+            interval = STEP_INTERVAL_MS
+        await asyncio.sleep_ms(interval)
+
+async def temp_task():
+    global temp
+    while True:
+        lis3dh.check_irq()      # re-arm a missed INT1 edge, or accel_task
+                                #   would wait for data forever
+        temp = tmp007.read_obj_temp_c()
+        await asyncio.sleep_ms(TEMP_INTERVAL_MS)
+
+async def net_task():
+    while True:
+        mp.poll()               # connection state, batches, outbox
+        await asyncio.sleep_ms(NET_INTERVAL_MS)
+
+async def publish_task():
+    # only publish the fields that have changed by more than their deadband,
+    #   plus the full record when nothing has been sent for HEARTBEAT_INTERVAL
+    beat_timer = -HEARTBEAT_INTERVAL
+    while True:
+        data = compile_data()
+        now = utime.time()
+        if now - beat_timer >= HEARTBEAT_INTERVAL:
+            delta = data                # heartbeat: everything
+        else:
+            delta = changed_fields(data)
+        if delta:
+            # print(delta)
+            mp.publish(delta)           # queued, sent in batches
+            last_sent.update(delta)
+            beat_timer = now
+        await asyncio.sleep(SEND_INTERVAL)
+
+async def diag_task():
+    import diag
+    while True:
+        await asyncio.sleep(DIAG_INTERVAL)
+        msg = diag.report({'net': [mp.connects, mp.failures, mp.dropped,
+            mp.outbox.pending(), mp.outbox.dropped], 'seq': mp.seq,
+            'odr': [lis3dh.data_rate_hz, lis3dh.rate_switches],
+            'sleep': [sleeps, slept_ms // 1000]})
+        if not mp.send(mp.DIAG_TOPIC, msg):
+            diag.count(diag.C_REPORTS_LOST)
+
+def start_diag():               # time the hot path functions
+    import diag                 # only loaded when enabled
+    diag.instrument(lis3dh, 'get_steps', diag.T_STEPS, diag.C_I2C_ERRORS)
+    diag.instrument(tmp007, 'read_obj_temp_c', diag.T_TEMP, diag.C_I2C_ERRORS)
+    diag.instrument(mp, 'publish', diag.T_PUBLISH, diag.C_NET_ERRORS, nargs = 1)
+    diag.instrument(mp, 'poll', diag.T_POLL, diag.C_NET_ERRORS)
+
+async def run_tasks():
+    tasks = [accel_task(), temp_task(), net_task(), publish_task()]
+    if DIAG_INTERVAL:
+        tasks.append(diag_task())
+    await asyncio.gather(*tasks)
+
 
 
 #//////////////////// main program definition /////////////////////////////////
 def main():
+    global heap_free, ready_ms
+    gc.collect()
+    heap_free = gc.mem_free()
+    print('Imports: {0} ms, free heap: {1} bytes'.format(import_ms, heap_free))
+
     # initialise sensors and MQTT publisher
-    if not tmp007.init():
+    if not tmp007.init(alert = True):
         print('TMP007 initialisation unsuccessful - is the sensor connected?')
         return
 
-    if not lis3dh.init(2, 20):
+    if not lis3dh.init(2, 20, fifo = True, irq = True, adaptive = True):
         print('LIS3DH initialisation unsuccessful - is the sensor connected?')
         return
 
+    ready_ms = utime.ticks_diff(utime.ticks_ms(), _boot_tick)
+    print('Sampling {0} ms after main.py started'.format(ready_ms))
+
+    if TRACE_FILE is not None:
+        lis3dh.start_recording(TRACE_FILE)
+
     if not mp.init():
         print('Error connecting to MQTT: connection timed out.')
         return
 
+    if DIAG_INTERVAL:
+        start_diag()
+
     # display info about pedometer
     print(
     '''LIS3DH pedometer
@@ -101,16 +241,9 @@ TMP007
     unit: C (Celsius)
     range: +/- 256C'''.format(lis3dh.range_g))
 
-    # keep reading data to keep everything updated, but transmission to MQTT is
-    #   less frequent in order to reduce network traffic, as much of the data
-    #   values are repeated
-    send_timer = -SEND_INTERVAL
-    while True:
-        data = compile_data()
-        if utime.time() - send_timer >= SEND_INTERVAL:
-            # print(ujson.dumps(data))
-            mp.publish(data)
-            send_timer = utime.time()
+    # sampling runs from the LIS3DH interrupt; the tasks below share the CPU
+    #   cooperatively, each at its own rate
+    asyncio.run(run_tasks())
 
 
 
@@ -5,10 +5,11 @@
 #//////////////////// imports ////////////////////
 from umqtt.simple import MQTTClient
 import machine
-import ujson
 import utime
 import network
-import usocket
+import urandom
+import payload
+from outbox import Outbox
 
 
 
@@ -16,23 +17,104 @@ import usocket
 CLIENT_ID = machine.unique_id() # b'K\x9b\xc6\x00'
 BROKER_ADDRESS = '192.168.0.10'
 TOPIC = '/esys/LLLJ/pedometer'
+DIAG_TOPIC = '/esys/LLLJ/diag'     # diagnostics reports (main.DIAG_INTERVAL)
 ESSID = 'EEERover'
 PASSWORD = 'exhibition'
-RECONNECT_INTERVAL = 1  # unit: second. Time interval attempting reconnect to Wi-Fi
-WLAN_TIMEOUT = 10       # unit: second. Timeout for connecting to WLAN
+WLAN_TIMEOUT = 10       # unit: second. Time allowed for joining the WLAN
+BACKOFF_MIN_MS = 1000   # unit: ms. Wait after the first failed attempt
+BACKOFF_MAX_MS = 60000  # unit: ms. Wait doubles after each failure up to this
+KEEPALIVE = 60          # unit: second. MQTT keepalive agreed with the broker;
+                        #   a ping unanswered for this long ends the session
+PING_INTERVAL_MS = 20000    # unit: ms. Ping once the broker has been silent
+                            #   for this long
+SOCKET_TIMEOUT = 1      # unit: second. Longest a socket call may block the
+                        #   sampling loop (connect, CONNACK, writes)
+
+# readings passed to publish() are sent together as one message
+BATCH_SIZE = 5          # unit: readings. Send once this many are queued
+BATCH_INTERVAL_MS = 20000   # unit: ms. Or once the oldest is this old
+BATCH_MAX = 32          # unit: readings. Queue bound
+ECHO = False            # print every message sent to the serial port
+
+# message format per topic (payload.JSON or payload.BINARY). Subscribers
+#   detect the format of each message, JSON-only consumers need payload.JSON
+FORMATS = {TOPIC: payload.BINARY}
+DEFAULT_FORMAT = payload.JSON
+
+# readings that cannot be sent are kept on flash and sent after reconnecting
+OUTBOX_FILE = 'outbox.bin'
+OUTBOX_CAPACITY = 256   # unit: readings
+DRAIN_BATCH = 16        # unit: readings. Per message when catching up
+DRAIN_INTERVAL_MS = 500 # unit: ms. Least time between catch-up messages
+
+
+
+#//////////////////// constants ////////////////////
+# connection states
+OFFLINE = 0             # waiting for the backoff time before trying again
+JOINING = 1             # associating with the access point
+CONNECTED = 2           # MQTT session up
 
 
 
 #//////////////////// variables ////////////////////
-sta_if = network.WLAN(network.STA_IF)
-sta_if.active(True)
-client = MQTTClient(CLIENT_ID, BROKER_ADDRESS)
+sta_if = None           # network.WLAN, MQTTClient and message buffer are
+client = None           #   created by init(), not at import
+
+_batch = []             # readings not sent yet, oldest first
+_batch_tick = 0         # ticks_ms() when the oldest queued reading arrived
+dropped = 0             # readings discarded because the queue was full
+seq = 0                 # number of the next reading, for loss detection
+_out = None             # bytearray for binary messages
+
+outbox = None           # Outbox, opened by init()
+_drain_tick = 0         # ticks_ms() of the last catch-up message
+
+state = OFFLINE
+connected = False       # state == CONNECTED
+_state_tick = 0         # ticks_ms() when the current state was entered
+_wait_ms = 0            # unit: ms. Time to stay OFFLINE
+_backoff_ms = BACKOFF_MIN_MS
+connects = 0            # sessions established
+failures = 0            # failed attempts and lost sessions
+
+
+
+#//////////////////// class ////////////////////
+class _Client(MQTTClient):
+    ''' umqtt.simple with bounded socket calls that notes the broker's
+        PINGRESP. The device never subscribes, so PINGRESP is the only packet
+        the broker sends it
+    '''
+    alive_tick = 0      # ticks_ms() the broker was last heard from
+    ping_tick = None    # ticks_ms() of the unanswered ping, if any
+
+    def connect(self):
+        self.ping_tick = None
+        super().connect(timeout = SOCKET_TIMEOUT)
+        self.alive_tick = utime.ticks_ms()
+
+    def ping(self):
+        super().ping()
+        if self.ping_tick is None:
+            self.ping_tick = utime.ticks_ms()
+
+    def wait_msg(self):     # called by check_msg() with a non-blocking socket
+        res = self.sock.read(1)
+        self.sock.settimeout(SOCKET_TIMEOUT)
+        if res is None:
+            return None
+        if res != b'\xd0' or self.sock.read(1) != b'\x00':
+            raise OSError(-1)           # closed, or not a PINGRESP
+        self.alive_tick = utime.ticks_ms()
+        self.ping_tick = None
+        return None
 
 
 
 #//////////////////// functions ////////////////////
-def init():
-    global client
+def init():             # start connecting; readings are kept until connected
+    global outbox, sta_if, client, _out
 
     print('MQTT client ID: {0}'.format(CLIENT_ID))
 
@@ -40,32 +122,165 @@ def init():
     #if all_wlan.find(ESSID) == -1:
     #    print('{0} not found!'.format(ESSID))
 
-    print('Connecting to Wi-Fi', end='')
-    start_time = utime.time()
-    time_elapsed = 0
-    is_timed_out = False
-    while (not sta_if.isconnected()) and (not is_timed_out):
-        sta_if.connect(ESSID, PASSWORD)
-        print('.', end='')
-        utime.sleep(RECONNECT_INTERVAL)      # wait before attempting to reconnect
-        time_elapsed = utime.time() - start_time
-        if time_elapsed >= WLAN_TIMEOUT:
-            is_timed_out = True
-    print(' ')
-    if is_timed_out:
+    sta_if = network.WLAN(network.STA_IF)
+    sta_if.active(True)
+    client = _Client(CLIENT_ID, BROKER_ADDRESS, keepalive = KEEPALIVE)
+    _out = bytearray(payload.size(max(BATCH_MAX, DRAIN_BATCH)))
+
+    outbox = Outbox(OUTBOX_FILE, OUTBOX_CAPACITY)
+    if outbox.pending():
+        print('{0} readings waiting in the outbox'.format(outbox.pending()))
+
+    print('Connecting to Wi-Fi and MQTT broker in the background')
+    _join()
+    return True
+
+def publish(data):      # queue a reading, send the batch when it is due
+    global _batch_tick, dropped, seq
+    data['seq'] = seq   # numbered even if dropped, so receivers see the gap
+    seq = (seq + 1) % payload.SEQ_MOD
+    if not _batch:
+        _batch_tick = utime.ticks_ms()
+    elif len(_batch) >= BATCH_MAX:
+        _batch.pop(0)                   # keep the most recent readings
+        dropped += 1
+    _batch.append(data)
+    poll()
+
+def poll():             # send what is due; reconnect and catch up
+    _service()
+    if _batch and (len(_batch) >= BATCH_SIZE or
+            utime.ticks_diff(utime.ticks_ms(), _batch_tick) >= BATCH_INTERVAL_MS):
+        flush()
+    if connected and outbox.pending():
+        _drain()
+
+def flush():            # send all queued readings as one message
+    if not _batch:
+        return
+    if connected and not outbox.pending():  # older readings go first
+        try:
+            _send(_batch)
+            del _batch[:]
+            return
+        except OSError:
+            _lost()
+    for r in _batch:
+        outbox.put(r)
+    del _batch[:]
+
+def suspend():          # before a long sleep: send what is queued, radio off
+    global _wait_ms
+    flush()                         # to the outbox if it cannot be sent
+    if connected:
+        try:
+            client.disconnect()
+        except OSError:
+            pass
+    sta_if.active(False)
+    _wait_ms = 0
+    _enter(OFFLINE)
+
+def resume():           # radio on, reconnect in the background
+    global _backoff_ms
+    sta_if.active(True)
+    _backoff_ms = BACKOFF_MIN_MS
+    _join()
+
+# private
+def send(topic, msg):   # one message now, not queued; False if it is not sent
+    if not connected:
         return False
+    try:
+        client.publish(topic, msg)
+    except OSError:
+        _lost()
+        return False
+    return True
+
+def _send(readings):    # one message; raises OSError if the send fails
+    if FORMATS.get(TOPIC, DEFAULT_FORMAT) == payload.BINARY:
+        n = payload.encode_into(_out, readings)
+        msg = memoryview(_out)[:n]
     else:
-        print('Connected!')
+        msg = payload.encode_json(readings) # a reading or an array of them
+    client.publish(TOPIC, msg)
+    if ECHO:
+        print('Data published: {0}'.format(payload.decode(msg)))
 
-        print('Connecting to MQTT broker...')
-        client.connect()
-        print('Connected!')
-        
-        return True
+def _enter(new_state):
+    global state, connected, _state_tick
+    state = new_state
+    connected = new_state == CONNECTED
+    _state_tick = utime.ticks_ms()
+
+def _join():            # (re)start associating with the access point
+    if not sta_if.isconnected():
+        sta_if.connect(ESSID, PASSWORD)
+    _enter(JOINING)
 
-def publish(data):
-    global client
+def _lost():            # the attempt or session failed: back off, then retry
+    global _wait_ms, _backoff_ms, failures
+    failures += 1
+    try:
+        client.disconnect()
+    except Exception:
+        pass
+    # wait between half and all of the backoff time, so that devices that
+    #   lost the broker together do not come back together
+    half = _backoff_ms // 2
+    _wait_ms = half + urandom.getrandbits(16) % (half + 1)
+    _backoff_ms = min(2 * _backoff_ms, BACKOFF_MAX_MS)
+    _enter(OFFLINE)
+
+def _connect():         # open the MQTT session over a working WLAN
+    global _backoff_ms, connects
+    try:
+        client.connect()                # at most SOCKET_TIMEOUT per step
+    except OSError:
+        _lost()
+        return
+    connects += 1
+    _backoff_ms = BACKOFF_MIN_MS
+    _enter(CONNECTED)
+
+def _service():         # advance the connection state machine
+    # socket calls block for at most SOCKET_TIMEOUT. A session is lost when a
+    #   socket call fails, or when a ping gets no PINGRESP within KEEPALIVE: a
+    #   half-open connection (broker gone without a reset) accepts writes
+    elapsed = utime.ticks_diff(utime.ticks_ms(), _state_tick)
+    if state == OFFLINE:
+        if elapsed >= _wait_ms:
+            _join()
+    elif state == JOINING:
+        if sta_if.isconnected():
+            _connect()
+        elif elapsed >= WLAN_TIMEOUT * 1000:
+            sta_if.disconnect()
+            _lost()
+    elif not sta_if.isconnected():
+        _lost()
+    else:
+        now = utime.ticks_ms()
+        try:
+            client.check_msg()          # consumes PINGRESP
+            if client.ping_tick is not None:
+                if utime.ticks_diff(now, client.ping_tick) >= KEEPALIVE * 1000:
+                    raise OSError(110)  # ETIMEDOUT: no answer to the ping
+            elif utime.ticks_diff(now, client.alive_tick) >= PING_INTERVAL_MS:
+                client.ping()
+        except OSError:
+            _lost()
 
-    payload = ujson.dumps(data) # JSON data
-    client.publish(TOPIC, bytes(payload, 'utf-8'))
-    print('Data published: {0}'.format(payload))
+def _drain():           # one batch from the outbox, rate limited
+    global _drain_tick
+    now = utime.ticks_ms()
+    if utime.ticks_diff(now, _drain_tick) < DRAIN_INTERVAL_MS:
+        return
+    _drain_tick = now
+    readings = outbox.read(DRAIN_BATCH)
+    try:
+        _send(readings)
+        outbox.commit(len(readings))
+    except OSError:
+        _lost()
@@ -5,12 +5,23 @@
 #//////////////////// imports /////////////////////////////////////////////////
 import paho.mqtt.client as mqtt
 import json
+import time
+import payload
+from linkstats import LinkMonitor
 
 
 
 #//////////////////// parameters //////////////////////////////////////////////
 TOPIC = '/esys/LLLJ/pedometer'
 BROKER_ADDRESS = '192.168.0.10'
+REPORT_INTERVAL = 60    # unit: second. Loss and latency report, 0: none
+
+
+
+#//////////////////// variables ///////////////////////////////////////////////
+devices = {}        # topic -> last known reading (messages may be partial)
+links = LinkMonitor()   # topic -> loss, reordering and latency
+last_report = time.time()
 
 
 
@@ -25,17 +36,41 @@ def on_connect(client, userdata, flags, rc):
 
 # The callback for when a PUBLISH message is received from the server.
 def on_message(client, userdata, msg):
-    process_data(msg.payload)
-
-# Process received data
-def process_data(d):
-    data = json.loads(d.decode("utf-8"))
+    global last_report
+    now = time.time()
+    process_data(msg.payload, msg.topic, now)
+    if REPORT_INTERVAL and now - last_report >= REPORT_INTERVAL:
+        last_report = now
+        print_report()
+
+# Process received data: JSON or binary, one reading or a batch, all fields or
+#   only the changed ones
+def process_data(d, topic = TOPIC, t_recv = None):
+    state = devices.setdefault(topic, {})
+    t_recv = time.time() if t_recv is None else t_recv
+    for reading in payload.decode(d):
+        links.update(topic, t_recv, reading)
+        if 'time' not in reading:
+            state.pop('time', None)     # recomputed from ts
+        state.update(reading)
+        if 'steps' in state and 'temp' in state and 'cal' in state:
+            print_reading(state)
+
+def print_reading(data):
+    if 'time' not in data:      # binary messages carry the timestamp only
+        t = time.gmtime(payload.unix_time(data['ts']))
+        data['time'] = '{:d}-{:d}-{:d} {:02d}:{:02d}:{:02d}'.format(t.tm_year,
+            t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)
     print('''Time: {0}
 Steps: {1}
 Calories Expended: {2} cal
 Temperature: {3} Celsius
 '''.format(data['time'], data['steps'], data['cal'], data['temp']))
 
+def print_report():
+    for topic, summary in links.report().items():
+        print('{0}: {1}'.format(topic, json.dumps(summary)))
+
 
 
 #//////////////////// main program ////////////////////////////////////////////
@@ -0,0 +1,142 @@
+''' Store-and-forward outbox on flash for readings that could not be published
+    readings are appended as fixed-size records to a preallocated file used as
+    a ring, so the file never grows and writes move round the whole file
+    instead of rewriting one spot. Each record carries a sequence number; the
+    newest record is found again after a reset by scanning them. The sequence
+    number of the oldest unsent record is kept in a small index file, also
+    written round-robin, and is only updated once per drained batch
+
+    record (28 bytes, little-endian):
+        seq (uint32, 0 = empty), presence mask (uint8, as payload v2, 0x80 when
+        the reading has its own seq and tick), reading seq (uint16), tick
+        (uint32), ts, steps (uint32), centi-degrees (int16), milli-calories
+        (uint32), pad
+    a file of another size (older record layout) is started again empty
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import ustruct
+
+import payload
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+RECORD = '<IBHIIIhIxxx'
+RECORD_SIZE = 28
+SEQ_TICK = 0x80         # mask bit: reading seq and tick are present
+INDEX = '<I'
+INDEX_SIZE = 4
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Outbox:
+    def __init__(self, path = 'outbox.bin', capacity = 256, index_slots = 16):
+        self.path = path
+        self.capacity = capacity    # unit: records
+        self.index_slots = index_slots
+        self.head = 1               # sequence number of the next record
+        self.tail = 1               # sequence number of the oldest unsent one
+        self.dropped = 0            # records overwritten before being sent
+        self.writes = 0             # records written since start
+
+        self._rec = bytearray(RECORD_SIZE)
+        self._idx = bytearray(INDEX_SIZE)
+        self._index_slot = 0
+        self._file = self._open(path, capacity * RECORD_SIZE)
+        self._index = self._open(path + '.idx', index_slots * INDEX_SIZE)
+        self._recover()
+
+    def _open(self, path, nbytes):  # open for update, preallocating if needed
+        try:
+            f = open(path, 'r+b')
+            f.seek(0, 2)
+            if f.tell() == nbytes:
+                return f
+            f.close()
+        except OSError:
+            pass
+        f = open(path, 'w+b')
+        zeros = bytes(RECORD_SIZE)
+        for _ in range(nbytes // RECORD_SIZE):
+            f.write(zeros)
+        f.write(bytes(nbytes % RECORD_SIZE))
+        f.flush()
+        return f
+
+    def _recover(self):             # find head and tail after a reset
+        newest = 0
+        self._file.seek(0)
+        for _ in range(self.capacity):
+            self._file.readinto(self._rec)
+            seq = ustruct.unpack_from('<I', self._rec, 0)[0]
+            if seq > newest:
+                newest = seq
+        self.head = newest + 1
+
+        sent = 0
+        self._index.seek(0)
+        for i in range(self.index_slots):
+            self._index.readinto(self._idx)
+            seq = ustruct.unpack_from(INDEX, self._idx, 0)[0]
+            if seq > sent:
+                sent = seq
+                self._index_slot = (i + 1) % self.index_slots
+        self.tail = min(self.head, max(sent, 1, self.head - self.capacity))
+
+    def pending(self):              # records not sent yet
+        return self.head - self.tail
+
+    def put(self, reading):
+        m = payload.mask(reading)
+        if 'seq' in reading:
+            m |= SEQ_TICK
+        ustruct.pack_into(RECORD, self._rec, 0, self.head, m,
+            reading.get('seq', 0) % payload.SEQ_MOD, reading.get('tick', 0),
+            reading['ts'], reading.get('steps', 0), int(round(reading.get('temp', 0) * 100)),
+            int(round(reading.get('cal', 0) * 1000)))
+        self._file.seek((self.head % self.capacity) * RECORD_SIZE)
+        self._file.write(self._rec)
+        self._file.flush()
+        self.head += 1
+        self.writes += 1
+        if self.head - self.tail > self.capacity:   # full: lose the oldest
+            self.tail = self.head - self.capacity
+            self.dropped += 1
+
+    def read(self, n):              # up to n oldest unsent readings
+        readings = []
+        seq = self.tail
+        while seq < self.head and len(readings) < n:
+            self._file.seek((seq % self.capacity) * RECORD_SIZE)
+            self._file.readinto(self._rec)
+            _, m, rseq, tick, ts, steps, centi, milli = ustruct.unpack_from(
+                RECORD, self._rec, 0)
+            r = {'ts': ts}
+            if m & SEQ_TICK:
+                r['seq'] = rseq
+                r['tick'] = tick
+            if m & 1:
+                r['steps'] = steps
+            if m & 2:
+                r['temp'] = centi / 100
+            if m & 4:
+                r['cal'] = milli / 1000
+            readings.append(r)
+            seq += 1
+        return readings
+
+    def commit(self, n):            # the n oldest readings have been sent
+        self.tail = min(self.head, self.tail + n)
+        ustruct.pack_into(INDEX, self._idx, 0, self.tail)
+        self._index.seek(self._index_slot * INDEX_SIZE)
+        self._index.write(self._idx)
+        self._index.flush()
+        self._index_slot = (self._index_slot + 1) % self.index_slots
+
+    def close(self):
+        self._file.close()
+        self._index.close()
@@ -0,0 +1,209 @@
+''' Pedometer message codec, shared by the device and the subscribers
+    a message carries one or more readings, each a dict with
+        ts      seconds since 2000-01-01 (the MicroPython epoch)
+        seq     per-device reading number (16 bit, wraps), optional
+        tick    utime.ticks_ms() when the reading was taken (30 bit, wraps),
+                with seq
+        steps   step count
+        temp    object temperature, Celsius
+        cal     calories expended
+    a reading may hold only some of steps/temp/cal (the fields that changed),
+    subscribers merge it into the last known state of the device. Messages are
+    either JSON (a reading, or an array of readings) or binary:
+        header  version byte (0x80 | version), reading count
+        v1      per reading: ts, steps (uint32), centi-degrees (int16),
+                milli-calories (uint32), little-endian, 14 bytes
+        v2      per reading: presence mask (uint8, bit i = FIELDS[i]), ts
+                (uint32), then the present fields as in v1, 5 to 15 bytes
+        v3      as v2 with seq (uint16) and tick (uint32) after the mask,
+                11 to 21 bytes
+    encode_into() writes v3 when every reading carries seq and tick, otherwise
+    v1 when every reading is complete and v2 if not.
+    JSON always starts with '{' or '[', so decode() tells the two apart by the
+    first byte and old JSON publishers keep working
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+try:
+    import ujson as json
+    import ustruct as struct
+except ImportError:             # CPython, on the subscriber side
+    import json
+    import struct
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+JSON = 'json'
+BINARY = 'binary'
+
+EPOCH_OFFSET = 946684800    # unit: s. 2000-01-01 in Unix time
+
+BIN_FLAG = 0x80             # set in the first byte of binary messages
+BIN_HEADER = '<BB'          # version | BIN_FLAG, reading count
+BIN_HEADER_SIZE = 2
+BIN_RECORD_V1 = '<IIhI'     # ts, steps, centi-degrees, milli-calories
+BIN_RECORD_V1_SIZE = 14
+BIN_RECORD_V2 = '<BI'       # presence mask, ts; then the present fields
+BIN_RECORD_V2_SIZE = 5      # without fields
+BIN_RECORD_V3 = '<BHII'     # presence mask, seq, tick, ts; then the fields
+BIN_RECORD_V3_SIZE = 11     # without fields
+SEQ_MOD = 0x10000           # seq wraps
+TICKS_MOD = 0x40000000      # ticks_ms() wraps
+BIN_MAX_READINGS = 255
+
+# optional fields: name, struct format, size, integer units per unit
+FIELDS = (('steps', '<I', 4, 1),
+          ('temp', '<h', 2, 100),
+          ('cal', '<I', 4, 1000))
+FIELDS_SIZE = 10            # all of them
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def is_binary(msg):
+    return not isinstance(msg, str) and len(msg) > 0 and msg[0] & BIN_FLAG != 0
+
+def size(n):                # most bytes a binary message of n readings needs
+    return BIN_HEADER_SIZE + n * (BIN_RECORD_V3_SIZE + FIELDS_SIZE)
+
+def unix_time(ts):          # device timestamp -> Unix time
+    return ts + EPOCH_OFFSET
+
+def mask(reading):          # presence mask of a reading's optional fields
+    m = 0
+    for i in range(len(FIELDS)):
+        if FIELDS[i][0] in reading:
+            m |= 1 << i
+    return m
+
+# encoding
+def encode_json(readings):
+    if len(readings) == 1:
+        return json.dumps(readings[0])      # a single reading, as before
+    return json.dumps(readings)
+
+def encode_into(buf, readings):     # binary, into buf; returns bytes used
+    n = len(readings)
+    if n > BIN_MAX_READINGS or size(n) > len(buf):
+        raise ValueError('too many readings')
+    complete = True
+    numbered = n > 0                # every reading has seq and tick
+    for r in readings:
+        if mask(r) != ALL_FIELDS:
+            complete = False
+        if 'seq' not in r or 'tick' not in r:
+            numbered = False
+    offset = BIN_HEADER_SIZE
+    if numbered:                    # v3: mask, seq, tick, ts, present fields
+        struct.pack_into(BIN_HEADER, buf, 0, BIN_FLAG | 3, n)
+        for r in readings:
+            m = mask(r)
+            struct.pack_into(BIN_RECORD_V3, buf, offset, m, r['seq'] % SEQ_MOD,
+                r['tick'], r['ts'])
+            offset = _pack_fields(buf, offset + BIN_RECORD_V3_SIZE, r, m)
+        return offset
+    if complete:                    # v1: fixed records
+        struct.pack_into(BIN_HEADER, buf, 0, BIN_FLAG | 1, n)
+        for r in readings:
+            struct.pack_into(BIN_RECORD_V1, buf, offset, r['ts'], r['steps'],
+                int(round(r['temp'] * 100)), int(round(r['cal'] * 1000)))
+            offset += BIN_RECORD_V1_SIZE
+        return offset
+    struct.pack_into(BIN_HEADER, buf, 0, BIN_FLAG | 2, n)
+    for r in readings:              # v2: mask, ts, present fields
+        m = mask(r)
+        struct.pack_into(BIN_RECORD_V2, buf, offset, m, r['ts'])
+        offset = _pack_fields(buf, offset + BIN_RECORD_V2_SIZE, r, m)
+    return offset
+
+def _pack_fields(buf, offset, r, m):
+    for i in range(len(FIELDS)):
+        if m & (1 << i):
+            name, fmt, nbytes, scale = FIELDS[i]
+            struct.pack_into(fmt, buf, offset, int(round(r[name] * scale)))
+            offset += nbytes
+    return offset
+
+def encode(readings, fmt = BINARY):
+    if fmt == JSON:
+        return encode_json(readings)
+    buf = bytearray(size(len(readings)))
+    return buf[:encode_into(buf, readings)]
+
+# decoding: always returns a list of readings
+def decode(msg):
+    if is_binary(msg):
+        return decode_binary(msg)
+    if isinstance(msg, (bytes, bytearray, memoryview)):
+        msg = bytes(msg).decode('utf-8')
+    data = json.loads(msg)
+    return data if isinstance(data, list) else [data]
+
+def decode_binary(msg):
+    if len(msg) < BIN_HEADER_SIZE:
+        raise ValueError('truncated message')
+    version, n = struct.unpack_from(BIN_HEADER, msg, 0)
+    version &= ~BIN_FLAG
+    if version == 1:
+        return _decode_v1(msg, n)
+    if version == 2:
+        return _decode_v2(msg, n)
+    if version == 3:
+        return _decode_v3(msg, n)
+    raise ValueError('unsupported payload version {0}'.format(version))
+
+def _decode_v1(msg, n):
+    end = BIN_HEADER_SIZE + n * BIN_RECORD_V1_SIZE
+    if len(msg) < end:
+        raise ValueError('truncated message')
+    if hasattr(struct, 'iter_unpack'):     # CPython: unpack in one pass
+        view = memoryview(msg)[BIN_HEADER_SIZE:end]
+        return [{'ts': ts, 'steps': steps, 'temp': centi / 100,
+                 'cal': milli / 1000} for ts, steps, centi, milli in
+                struct.iter_unpack(BIN_RECORD_V1, view)]
+    readings = []
+    for i in range(n):
+        ts, steps, centi, milli = struct.unpack_from(BIN_RECORD_V1, msg,
+            BIN_HEADER_SIZE + i * BIN_RECORD_V1_SIZE)
+        readings.append({'ts': ts, 'steps': steps, 'temp': centi / 100,
+            'cal': milli / 1000})
+    return readings
+
+def _decode_v2(msg, n):
+    readings = []
+    offset = BIN_HEADER_SIZE
+    for _ in range(n):
+        if len(msg) < offset + BIN_RECORD_V2_SIZE:
+            raise ValueError('truncated message')
+        m, ts = struct.unpack_from(BIN_RECORD_V2, msg, offset)
+        r = {'ts': ts}
+        offset = _unpack_fields(msg, offset + BIN_RECORD_V2_SIZE, r, m)
+        readings.append(r)
+    return readings
+
+def _decode_v3(msg, n):
+    readings = []
+    offset = BIN_HEADER_SIZE
+    for _ in range(n):
+        if len(msg) < offset + BIN_RECORD_V3_SIZE:
+            raise ValueError('truncated message')
+        m, seq, tick, ts = struct.unpack_from(BIN_RECORD_V3, msg, offset)
+        r = {'seq': seq, 'tick': tick, 'ts': ts}
+        offset = _unpack_fields(msg, offset + BIN_RECORD_V3_SIZE, r, m)
+        readings.append(r)
+    return readings
+
+def _unpack_fields(msg, offset, r, m):
+    for i in range(len(FIELDS)):
+        if m & (1 << i):
+            name, fmt, nbytes, scale = FIELDS[i]
+            if len(msg) < offset + nbytes:
+                raise ValueError('truncated message')
+            value = struct.unpack_from(fmt, msg, offset)[0]
+            r[name] = value if scale == 1 else value / scale
+            offset += nbytes
+    return offset
@@ -0,0 +1,79 @@
+''' Fixed-capacity store for raw accelerometer samples
+    raw x, y, z are kept interleaved in one array('h') and the tick (ms) of each
+    sample in a parallel array. Writing overwrites the oldest sample once the
+    store is full. Samples are addressed by a sequence number, so any number of
+    readers (step detection, logging, publishing) can each keep their own cursor
+    and read in place by index without allocating
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from array import array
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class SampleBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.xyz = array('h', [0] * (3 * capacity))    # raw x, y, z per slot
+        self.ticks = array('l', [0] * capacity)         # unit: ms (ticks_ms)
+
+        # sequence numbers wrap at a multiple of capacity so that they stay
+        #   small ints and seq % capacity is always the slot of a sample
+        self.wrap = (0x20000000 // capacity) * capacity
+        self.head = 0           # sequence number of the next sample written
+        self.overwritten = 0    # samples a reader lost because it fell behind
+
+        self._slot = 0          # slot of the next sample written
+        self._views = [memoryview(self.xyz)[3 * i:3 * i + 3]
+            for i in range(capacity)]
+
+    # writing
+    def next_slot(self):        # view to burst read the next sample into
+        return self._views[self._slot]
+
+    def commit(self, tick):     # publish the sample read into next_slot()
+        self.ticks[self._slot] = tick
+        self._slot += 1
+        if self._slot == self.capacity:
+            self._slot = 0
+        self.head += 1
+        if self.head == self.wrap:
+            self.head = 0
+
+    def put(self, x, y, z, tick):
+        j = 3 * self._slot
+        self.xyz[j] = x
+        self.xyz[j + 1] = y
+        self.xyz[j + 2] = z
+        self.commit(tick)
+
+    def put_batch(self, raw, n, tick, period_us):
+        # raw: n interleaved x, y, z samples, the last one taken at tick.
+        #   Earlier samples are timestamped back from it at the sample period
+        for i in range(n):
+            j = 3 * i
+            self.put(raw[j], raw[j + 1], raw[j + 2],
+                tick - ((n - 1 - i) * period_us) // 1000)
+
+    # reading
+    def pending(self, seq):     # samples written since sequence number seq
+        return (self.head - seq) % self.wrap
+
+    def oldest(self, seq):      # seq, moved past samples already overwritten
+        n = (self.head - seq) % self.wrap
+        if n > self.capacity:
+            self.overwritten += n - self.capacity
+            return (self.head - self.capacity) % self.wrap
+        return seq
+
+    def advance(self, seq, n):
+        return (seq + n) % self.wrap
+
+    def index(self, seq):       # slot of sample seq: x, y, z at xyz[3 * index]
+        return seq % self.capacity
+
+    def latest(self):           # sequence number of the newest sample
+        return (self.head - 1) % self.wrap
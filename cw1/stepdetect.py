@@ -0,0 +1,160 @@
+''' Streaming step detection for raw LIS3DH samples
+    per sample, in fixed memory and integer arithmetic only:
+    1. squared magnitude of the raw x, y, z, in units of 1/1024 g^2
+    2. band-pass: short moving average (low-pass) minus a long moving average
+       (gravity / posture baseline)
+    3. adaptive threshold: a fraction of the moving mean of |band-pass|, never
+       below STEP_THR_MIN so that small vibrations are ignored
+    4. peak/valley detection with hysteresis: a step is a peak above +threshold
+       followed by a valley below -threshold, at least STEP_MIN_INTERVAL_MS
+       after the previous step (sample ticks in ms)
+    stepdetect_np.py is a NumPy twin of this engine for offline replay on
+    CPython; both must give identical counts for the same samples
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+from array import array
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+STEP_LP_MS = 100            # unit: ms. Low-pass moving average window
+STEP_BASE_MS = 750          # unit: ms. Baseline moving average window
+STEP_ENV_MS = 1000          # unit: ms. Window of the amplitude envelope
+STEP_THR_NUM = 1            # threshold = envelope * NUM / DEN
+STEP_THR_DEN = 2
+STEP_THR_MIN = 64           # unit: 1/1024 g^2. Rejects vibration when still
+STEP_MAX_RPM = 240          # max assumed cadence
+STEP_MIN_INTERVAL_MS = 60000 // STEP_MAX_RPM
+
+TICKS_MASK = 0x3FFFFFFF     # ticks_ms() wraps at 2^30 on the ESP8266
+TICKS_HALF = 0x20000000
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def ticks_diff(a, b):       # same as utime.ticks_diff, usable on CPython too
+    return ((a - b + TICKS_HALF) & TICKS_MASK) - TICKS_HALF
+
+def window(rate_hz, ms):    # window length in samples, at least 1
+    n = rate_hz * ms // 1000
+    if n < 1:
+        return 1
+    return n
+
+def mag_scale(g_counts):    # divisor taking (raw >> 4)^2 to 1/1024 g^2 units
+    s = ((g_counts >> 4) * (g_counts >> 4)) >> 10
+    if s < 1:
+        return 1
+    return s
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class StepDetector:
+    def __init__(self, rate_hz, g_counts):
+        self.scale = mag_scale(g_counts)    # g_counts: raw counts per 1g
+        self.steps = 0
+        self.activity = 0   # amplitude envelope, unit: 1/1024 g^2
+        self.configure(rate_hz)
+        self.reset()
+
+    def configure(self, rate_hz):   # size the filter windows for rate_hz
+        # on a rate change the new windows start at the levels the old ones
+        #   had, so the band-pass, envelope and peak state carry on without a
+        #   step being lost or added
+        primed = getattr(self, '_primed', False)
+        if primed:
+            lp = self._lp_sum // self._n_lp
+            base = self._base_sum // self._n_base
+            env = self._env_sum // self._n_env
+        self.rate_hz = rate_hz
+        self._n_lp = window(rate_hz, STEP_LP_MS)
+        self._n_base = window(rate_hz, STEP_BASE_MS)
+        self._n_env = window(rate_hz, STEP_ENV_MS)
+        self._lp = array('l', [0] * self._n_lp)
+        self._base = array('l', [0] * self._n_base)
+        self._env = array('l', [0] * self._n_env)
+        if primed:
+            self._fill(lp, base, env)
+        else:
+            self._primed = False
+
+    def reset(self):                # forget filter history and step timing
+        self._primed = False
+        self._peak = False          # True once a peak was seen, until valley
+        self._last_step = 0
+        self._have_step = False
+
+    def _prime(self, m):            # fill the windows as if m had always been
+        self._fill(m, m, 0)
+
+    def _fill(self, lp, base, env): # constant windows at these means
+        for i in range(self._n_lp):
+            self._lp[i] = lp
+        for i in range(self._n_base):
+            self._base[i] = base
+        for i in range(self._n_env):
+            self._env[i] = env
+        self._lp_sum = lp * self._n_lp
+        self._base_sum = base * self._n_base
+        self._env_sum = env * self._n_env
+        self._i_lp = 0
+        self._i_base = 0
+        self._i_env = 0
+        self._primed = True
+
+    def update(self, x, y, z, tick):    # returns 1 if this sample ends a step
+        x >>= 4                         # 12 bit high resolution data
+        y >>= 4
+        z >>= 4
+        m = (x * x + y * y + z * z) // self.scale
+        if not self._primed:
+            self._prime(m)
+
+        # band-pass
+        i = self._i_lp
+        self._lp_sum += m - self._lp[i]
+        self._lp[i] = m
+        i += 1
+        self._i_lp = 0 if i == self._n_lp else i
+
+        i = self._i_base
+        self._base_sum += m - self._base[i]
+        self._base[i] = m
+        i += 1
+        self._i_base = 0 if i == self._n_base else i
+
+        bp = self._lp_sum // self._n_lp - self._base_sum // self._n_base
+
+        # adaptive threshold
+        a = bp if bp >= 0 else -bp
+        i = self._i_env
+        self._env_sum += a - self._env[i]
+        self._env[i] = a
+        i += 1
+        self._i_env = 0 if i == self._n_env else i
+
+        env = self._env_sum // self._n_env
+        self.activity = env
+        thr = env * STEP_THR_NUM // STEP_THR_DEN
+        if thr < STEP_THR_MIN:
+            thr = STEP_THR_MIN
+
+        # peak / valley
+        if not self._peak:
+            if bp > thr:
+                self._peak = True
+            return 0
+        if bp >= -thr:
+            return 0
+        self._peak = False
+        if self._have_step and \
+                ticks_diff(tick, self._last_step) < STEP_MIN_INTERVAL_MS:
+            return 0
+        self._have_step = True
+        self._last_step = tick
+        self.steps += 1
+        return 1
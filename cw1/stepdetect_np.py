@@ -0,0 +1,113 @@
+''' NumPy twin of stepdetect.StepDetector for offline replay on CPython
+    the filters (moving sums, envelope, threshold) are computed for a whole
+    chunk of samples at once with cumulative sums in int64, which is exact, so
+    counts are bit-identical to the on-device engine. Only the sparse threshold
+    crossings go through the sequential peak/valley logic. Filter history is
+    carried between calls, so a long trace can be processed in chunks
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import numpy as np
+
+import stepdetect as sd
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def moving_sum(hist, v, n):     # sums over n samples of hist + v, for each v
+    ext = np.concatenate((hist, v))
+    cs = np.concatenate(([0], np.cumsum(ext)))
+    end = np.arange(len(hist) + 1, len(ext) + 1)
+    return cs[end] - cs[end - n], ext
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class StepDetectorNP:
+    def __init__(self, rate_hz, g_counts):
+        self.scale = sd.mag_scale(g_counts)
+        self.steps = 0
+        self.activity = 0
+        self.configure(rate_hz)
+        self.reset()
+
+    def configure(self, rate_hz):   # keeps the filter levels, as stepdetect
+        primed = getattr(self, '_primed', False)
+        if primed:
+            lp = int(self._hist_lp.sum()) // self._n_lp
+            base = int(self._hist_base.sum()) // self._n_base
+            env = int(self._hist_a.sum()) // self._n_env
+        self.rate_hz = rate_hz
+        self._n_lp = sd.window(rate_hz, sd.STEP_LP_MS)
+        self._n_base = sd.window(rate_hz, sd.STEP_BASE_MS)
+        self._n_env = sd.window(rate_hz, sd.STEP_ENV_MS)
+        if primed:
+            self._fill(lp, base, env)
+        else:
+            self._primed = False
+
+    def _fill(self, lp, base, env):
+        self._hist_lp = np.full(self._n_lp, lp, dtype = np.int64)
+        self._hist_base = np.full(self._n_base, base, dtype = np.int64)
+        self._hist_a = np.full(self._n_env, env, dtype = np.int64)
+        self._primed = True
+
+    def reset(self):
+        self._primed = False
+        self._peak = False
+        self._last_step = 0
+        self._have_step = False
+
+    def process(self, ticks, x, y, z):  # returns the number of steps found
+        x = np.asarray(x, dtype = np.int64) >> 4
+        y = np.asarray(y, dtype = np.int64) >> 4
+        z = np.asarray(z, dtype = np.int64) >> 4
+        m = (x * x + y * y + z * z) // self.scale
+        if len(m) == 0:
+            return 0
+        if not self._primed:
+            self._fill(m[0], m[0], 0)
+
+        # band-pass
+        lp, ext = moving_sum(self._hist_lp, m, self._n_lp)
+        self._hist_lp = ext[-self._n_lp:]
+        base, ext = moving_sum(self._hist_base, m, self._n_base)
+        self._hist_base = ext[-self._n_base:]
+        bp = lp // self._n_lp - base // self._n_base
+
+        # adaptive threshold
+        env, ext = moving_sum(self._hist_a, np.abs(bp), self._n_env)
+        self._hist_a = ext[-self._n_env:]
+        env //= self._n_env
+        self.activity = int(env[-1])
+        thr = np.maximum(env * sd.STEP_THR_NUM // sd.STEP_THR_DEN,
+            sd.STEP_THR_MIN)
+
+        # peak / valley: only the first sample of each run of crossings of
+        #   the same sign can change the detector state
+        ev = np.flatnonzero((bp > thr) | (bp < -thr))
+        if len(ev) == 0:
+            return 0
+        valley = bp[ev] < 0
+        first = np.ones(len(ev), dtype = bool)
+        first[1:] = valley[1:] != valley[:-1]
+        run_idx = ev[first]
+        run_valley = valley[first]
+        candidates = run_idx[run_valley]
+        if run_valley[0] and not self._peak:
+            candidates = candidates[1:]     # valley without a peak before it
+        self._peak = not run_valley[-1]
+
+        found = 0
+        for k in candidates:
+            tick = int(ticks[k])
+            if self._have_step and \
+                    sd.ticks_diff(tick, self._last_step) < sd.STEP_MIN_INTERVAL_MS:
+                continue
+            self._have_step = True
+            self._last_step = tick
+            found += 1
+        self.steps += found
+        return found
@@ -0,0 +1,54 @@
+# link statistics test, runs on the host: python3 test/linkstats_test/main.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', '..'))
+import linkstats
+
+# functions
+def feed(stats, readings):      # (seq, tick) pairs, 1 s apart
+    for i, (seq, tick) in enumerate(readings):
+        stats.update(1000.0 + i, {'seq': seq, 'tick': tick})
+    return stats.summary()
+
+def test_in_order():
+    s = feed(linkstats.LinkStats(), [(n, 1000 * n) for n in range(100)])
+    assert (s['received'], s['lost'], s['duplicates'], s['restarts']) == \
+        (100, 0, 0, 0), s
+
+def test_loss_and_reorder():
+    s = feed(linkstats.LinkStats(), [(0, 0), (1, 1000), (4, 4000), (2, 2000),
+        (5, 5000)])
+    assert (s['received'], s['lost'], s['reordered']) == (5, 1, 1), s
+
+def test_duplicate():
+    s = feed(linkstats.LinkStats(), [(0, 0), (1, 1000), (2, 2000), (1, 1000),
+        (3, 3000)])
+    assert (s['received'], s['duplicates'], s['restarts']) == (4, 1, 0), s
+
+def test_early_restart():       # restarted after fewer than WINDOW readings
+    first = [(n, 5000 + 1000 * n) for n in range(10)]
+    second = [(n, 300 + 1000 * n) for n in range(20)]
+    s = feed(linkstats.LinkStats(), first + second)
+    assert (s['received'], s['lost'], s['duplicates'], s['restarts']) == \
+        (30, 0, 0, 1), s
+
+def test_late_restart():
+    first = [(n, 1000 * n) for n in range(200)]
+    second = [(n, 300 + 1000 * n) for n in range(5)]
+    s = feed(linkstats.LinkStats(), first + second)
+    assert (s['received'], s['duplicates'], s['restarts']) == (205, 0, 1), s
+
+def test_wrap():
+    mod = linkstats.payload.SEQ_MOD
+    s = feed(linkstats.LinkStats(), [((mod - 3 + n) % mod, 1000 * n)
+        for n in range(6)])
+    assert (s['received'], s['lost'], s['restarts']) == (6, 0, 0), s
+
+# main
+for test in (test_in_order, test_loss_and_reorder, test_duplicate,
+        test_early_restart, test_late_restart, test_wrap):
+    test()
+    print('{0}: ok'.format(test.__name__))
@@ -0,0 +1,51 @@
+# message codec test, runs on the host: python3 test/payload_test/main.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', '..'))
+import payload
+
+# functions
+def version(msg):
+    return msg[0] & ~payload.BIN_FLAG
+
+def round_trip(readings):
+    msg = payload.encode(readings)
+    assert payload.decode(bytes(msg)) == readings, payload.decode(bytes(msg))
+    return msg
+
+def test_complete():            # v1
+    msg = round_trip([{'ts': 100, 'steps': 12, 'temp': 33.25, 'cal': 0.5},
+        {'ts': 108, 'steps': 25, 'temp': 33.5, 'cal': 1.0}])
+    assert version(msg) == 1
+
+def test_partial():             # v2
+    msg = round_trip([{'ts': 100, 'steps': 12}, {'ts': 108, 'temp': 33.5}])
+    assert version(msg) == 2
+
+def test_numbered():            # v3
+    msg = round_trip([{'seq': 7, 'tick': 1200, 'ts': 100, 'steps': 12},
+        {'seq': 8, 'tick': 9200, 'ts': 108, 'cal': 1.0}])
+    assert version(msg) == 3
+
+def test_mixed():               # some readings without seq: v2, seq dropped
+    readings = [{'ts': 100, 'steps': 12},
+        {'seq': 8, 'tick': 9200, 'ts': 108, 'steps': 25}]
+    msg = payload.encode(readings)
+    assert version(msg) == 2
+    assert payload.decode(bytes(msg)) == [{'ts': 100, 'steps': 12},
+        {'ts': 108, 'steps': 25}]
+    msg = payload.encode(readings[::-1])    # seq first
+    assert version(msg) == 2
+
+def test_json():
+    readings = [{'seq': 1, 'tick': 5, 'ts': 100, 'steps': 3}]
+    assert payload.decode(payload.encode(readings, payload.JSON)) == readings
+
+# main
+for test in (test_complete, test_partial, test_numbered, test_mixed,
+        test_json):
+    test()
+    print('{0}: ok'.format(test.__name__))
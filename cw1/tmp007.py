@@ -7,43 +7,66 @@
 
 
 #//////////////////// imports ////////////////////
-from machine import Pin, I2C
+from machine import Pin
+from micropython import const
+import utime
+import i2cbus
 
 
 
 #//////////////////// constants ////////////////////
-TMP007_VOBJ         = 0x00
-TMP007_TDIE         = 0x01
-TMP007_CONFIG       = 0x02
-TMP007_TOBJ         = 0x03
-TMP007_STATUS       = 0x04
-TMP007_STATMASK     = 0x05
+_TMP007_VOBJ         = const(0x00)
+_TMP007_TDIE         = const(0x01)
+_TMP007_CONFIG       = const(0x02)
+_TMP007_TOBJ         = const(0x03)
+_TMP007_STATUS       = const(0x04)
+_TMP007_STATMASK     = const(0x05)
 
-TMP007_CFG_RESET    = 0x8000
-TMP007_CFG_MODEON   = 0x1000
-TMP007_CFG_1SAMPLE  = 0x0000
-TMP007_CFG_2SAMPLE  = 0x0200
-TMP007_CFG_4SAMPLE  = 0x0400
-TMP007_CFG_8SAMPLE  = 0x0600
-TMP007_CFG_16SAMPLE = 0x0800
-TMP007_CFG_ALERTEN  = 0x0100
-TMP007_CFG_ALERTF   = 0x0080
-TMP007_CFG_TRANSC   = 0x0040
+_TMP007_CFG_RESET    = const(0x8000)
+_TMP007_CFG_MODEON   = const(0x1000)
+TMP007_CFG_1SAMPLE   = const(0x0000)
+TMP007_CFG_2SAMPLE   = const(0x0200)
+TMP007_CFG_4SAMPLE   = const(0x0400)
+TMP007_CFG_8SAMPLE   = const(0x0600)
+TMP007_CFG_16SAMPLE  = const(0x0800)
+_TMP007_CFG_ALERTEN  = const(0x0100)
+_TMP007_CFG_ALERTF   = const(0x0080)
+_TMP007_CFG_TRANSC   = const(0x0040)
 
-TMP007_STAT_ALERTEN = 0x8000
-TMP007_STAT_CRTEN   = 0x4000
+_TMP007_STAT_ALERTEN = const(0x8000)
+_TMP007_STAT_CRTEN   = const(0x4000)
+_TMP007_STAT_CRTF    = const(0x4000)  # conversion ready, cleared on read
 
-TMP007_I2CADDR              = 0x40  # default I2C address
-TMP007_REG_DEVICE_ID        = 0x1F  # register storing the device ID
-TMP007_DEVICE_ID            = 0x78
+_TMP007_CONV_MS      = const(260)     # unit: ms. Conversion time per sample
+                                      #   averaged
+
+_TMP007_I2CADDR       = const(0x40)   # default I2C address
+_TMP007_REG_DEVICE_ID = const(0x1F)   # register storing the device ID
+_TMP007_DEVICE_ID     = const(0x78)
 
 
 
 #//////////////////// variables ////////////////////
-_i2c_addr = TMP007_I2CADDR
-_i2c_port = I2C(scl = Pin(5), sda = Pin(4), freq = 400000)
+_i2c_addr = _TMP007_I2CADDR
 
 samplerate = TMP007_CFG_16SAMPLE # high resolution
+_conv_ms = _TMP007_CONV_MS * 16  # unit: ms. Time between conversions
+
+_alert = None           # machine.Pin wired to ALERT, if used
+_conv_tick = 0          # ticks_ms() when the last conversion was seen
+_conversions = 0        # conversions seen (STATUS CRTF)
+_obj_conv = 0           # conversion the cached object temperature is from
+_die_conv = 0
+_obj_c = 0.0            # unit: C. Cached temperatures
+_die_c = 0.0
+
+bus_reads = 0           # register reads for temperatures (STATUS, TOBJ, TDIE)
+reads_saved = 0         # temperature reads served from the cache
+
+
+
+#//////////////////// parameters ////////////////////
+ALERT_PIN = 14          # ESP8266 GPIO wired to TMP007 ALERT (open drain)
 
 
 #//////////////////// functions ////////////////////
@@ -52,68 +75,101 @@ samplerate = TMP007_CFG_16SAMPLE # high resolution
 def begin_i2c():
     print("Begin I2C communication...")
 
-    device_id = read_mem_16(TMP007_REG_DEVICE_ID)
+    device_id = read_mem_16(_TMP007_REG_DEVICE_ID)
     #print('TMP007 device_id: {0}'.format(hex(device_id)))
 
-    if device_id != TMP007_DEVICE_ID:
+    if device_id != _TMP007_DEVICE_ID:
         print("FAILURE: TMP007 not detected at address {0}".format(hex(_i2c_addr)))
         return False    # sensor not found
     else:
         print("SUCCESS: TMP007 detected at {0}".format(hex(_i2c_addr)))
 
-        config = TMP007_CFG_MODEON | TMP007_CFG_ALERTEN | TMP007_CFG_TRANSC | samplerate
-        stat_mask = TMP007_STAT_ALERTEN | TMP007_STAT_CRTEN
+        config = _TMP007_CFG_MODEON | _TMP007_CFG_ALERTEN | _TMP007_CFG_TRANSC | \
+            samplerate
+        stat_mask = _TMP007_STAT_ALERTEN | _TMP007_STAT_CRTEN
 
-        write_mem_16(TMP007_CONFIG, config)
-        write_mem_16(TMP007_STATMASK, stat_mask)
+        write_mem_16(_TMP007_CONFIG, config)
+        write_mem_16(_TMP007_STATMASK, stat_mask)
+        _set_conversion_time()
 
         return True     # sensor found and initialised
 
-def uint16_to_int16(uint16):
-    result = uint16
-    if result > 32767:
-        result -= 65536
-    return result
-
 def write_mem_16(reg_addr, data):    # write 16 bits to register
-    _i2c_port.writeto_mem(_i2c_addr, reg_addr, bytearray([data >> 8, data]))
-
-def read_mem(reg_addr, nbytes):
-    str = _i2c_port.readfrom_mem(_i2c_addr, reg_addr, nbytes)
-    result = 0
-    counter = 0
-    for char in str:
-        result = result << counter | char
-        counter += 8
-    return result
-
-def read_mem_16(reg_addr):    # write 16 bits to register
-    return read_mem(reg_addr, 2)
+    i2cbus.write_u16_be(_i2c_addr, reg_addr, data)
+
+def read_mem_16(reg_addr):          # read 16 bits from register
+    return i2cbus.read_u16_be(_i2c_addr, reg_addr)
+
+def raw_to_c(raw):                  # 14 bit two's complement, 1/32 C per LSB
+    return (i2cbus.int16(raw) >> 2) * 0.03125
+
+def _set_conversion_time():         # from the averaging bits (CR) in CONFIG
+    global _conv_ms, _conv_tick
+    _conv_ms = _TMP007_CONV_MS * (1 << ((samplerate >> 9) & 0x07))
+    _conv_tick = utime.ticks_ms()   # first conversion due one period from now
+
+def _read_temp_reg(reg):
+    global bus_reads
+    bus_reads += 1
+    return raw_to_c(read_mem_16(reg))
+
+def _poll_conversion():             # read STATUS only if a conversion may be ready
+    global bus_reads, _conversions, _conv_tick
+    elapsed = utime.ticks_diff(utime.ticks_ms(), _conv_tick)
+    if _alert is not None:
+        # ALERT is pulled low while a STATUS flag is set. Poll anyway when it
+        #   has been quiet for two conversions, in case it is not wired
+        if _alert.value() and elapsed < 2 * _conv_ms:
+            return
+    elif elapsed < _conv_ms:
+        return
+    bus_reads += 1
+    if read_mem_16(_TMP007_STATUS) & _TMP007_STAT_CRTF:
+        _conversions += 1
+        _conv_tick = utime.ticks_ms()
 
 def addr_detected():
-    if _i2c_addr in _i2c_port.scan():
+    if _i2c_addr in i2cbus.scan():
         return True
     else:
         return False
 
 ## "public" functions
-def init():
+def init(alert = False):            # alert: watch ALERT_PIN for new conversions
+    global _alert
     if not addr_detected():
         return False
     else:
         begin_i2c()
+        if alert:
+            _alert = Pin(ALERT_PIN, Pin.IN, Pin.PULL_UP)
         return True
 
+# temperatures are read from the sensor only once per conversion, otherwise
+#   the value from the last read is returned. None until the first conversion
+#   after init() is done: the registers hold no temperature before it
 def read_die_temp_c():
-    raw = read_mem_16(TMP007_TDIE)
+    global _die_c, _die_conv, reads_saved
+    _poll_conversion()
+    if not _conversions:
+        return None
+    if _die_conv == _conversions:
+        reads_saved += 1
+        return _die_c
+    _die_c = _read_temp_reg(_TMP007_TDIE)
+    _die_conv = _conversions
     #if (raw & 0x1): # invalid temperature
         #return NAN
-    raw >>= 2
-    t_die = raw * 0.03125 # convert to Celsius
-    return uint16_to_int16(t_die)
-    
+    return _die_c
+
 def read_obj_temp_c():
-    raw = read_mem_16(TMP007_TOBJ)
-    raw >>= 2
-    t_obj = raw * 0.03125 # convert to Celsius
-    return uint16_to_int16(t_obj)
\ No newline at end of file
+    global _obj_c, _obj_conv, reads_saved
+    _poll_conversion()
+    if not _conversions:
+        return None
+    if _obj_conv == _conversions:
+        reads_saved += 1
+        return _obj_c
+    _obj_c = _read_temp_reg(_TMP007_TOBJ)
+    _obj_conv = _conversions
+    return _obj_c
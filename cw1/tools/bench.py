@@ -0,0 +1,206 @@
+''' Benchmark the cw1 pedometer pipeline on the emulated board
+    runs main.py unmodified through emu (stepped virtual clock, so bus counts
+    are deterministic) once per acquisition mode and reports, per mode:
+        samples_per_s           samples processed per second of host time
+        get_steps_us_per_sample host time in lis3dh.get_steps() per sample
+        i2c_transactions_per_sample, i2c_bytes_per_sample
+        alloc_blocks_per_iter   heap blocks retained per main loop iteration
+                                over the whole run (gc disabled, so leaks and
+                                cyclic garbage show up)
+        alloc_peak_bytes_per_iter  mean tracemalloc high-water mark above the
+                                start of an iteration (transient allocation,
+                                includes the emulator's own bus buffers)
+        publish_ms_mean, publish_ms_max  host time per mp.publish()
+    timing and allocation are measured in separate runs so that tracemalloc
+    does not distort the timings. Each run is a fresh process
+
+    usage: python3 tools/bench.py [--duration S] [--out results.json]
+                                  [--baseline old.json [--tolerance 0.1]]
+    with --baseline, exits with status 1 if a deterministic metric (bus or
+    allocation counts) regressed by more than the tolerance
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CW1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+MODES = {'polled': (False, False),  # lis3dh.init(fifo, irq)
+         'fifo':   (True, False),
+         'irq':    (False, True),
+         'fifo+irq': (True, True)}
+
+# metrics compared against a baseline: deterministic on the stepped clock
+GATED = ('i2c_transactions_per_sample', 'i2c_bytes_per_sample',
+         'alloc_blocks_per_iter')
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class Probe:                # wraps a firmware function, times every call
+    def __init__(self, module, name, trace_alloc = False):
+        self.calls = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.first_blocks = None    # allocated blocks at the first call
+        self.alloc_peak = 0
+        self._func = getattr(module, name)
+        self._trace_alloc = trace_alloc
+        setattr(module, name, self)
+
+    def __call__(self, *args, **kwargs):
+        if self._trace_alloc:
+            import tracemalloc
+            tracemalloc.reset_peak()
+            start_mem = tracemalloc.get_traced_memory()[0]
+            if self.first_blocks is None:
+                self.first_blocks = sys.getallocatedblocks()
+        t0 = time.perf_counter()
+        result = self._func(*args, **kwargs)
+        dt = time.perf_counter() - t0
+        if self._trace_alloc:
+            self.alloc_peak += tracemalloc.get_traced_memory()[1] - start_mem
+        self.calls += 1
+        self.total_s += dt
+        self.max_s = max(self.max_s, dt)
+        return result
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def run_child(mode, duration, trace_alloc):     # one run, in this process
+    sys.path.insert(0, CW1_DIR)
+    import emu
+    sim = emu.install(speed = 0, stop_after_s = duration)
+    import lis3dh
+    import tmp007
+    import mqttpublisher as mp
+
+    fifo, irq = MODES[mode]
+    init = lis3dh.init
+    lis3dh.init = lambda range, ct, **kw: init(range, ct, fifo = fifo, irq = irq)
+    steps = Probe(lis3dh, 'get_steps', trace_alloc)
+    temp = Probe(tmp007, 'read_obj_temp_c', trace_alloc)
+    publish = Probe(mp, 'publish', trace_alloc)
+
+    if trace_alloc:
+        import gc
+        import tracemalloc
+        gc.disable()
+        tracemalloc.start()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    t0 = time.perf_counter()
+    try:
+        import runpy
+        runpy.run_path(os.path.join(CW1_DIR, 'main.py'), run_name = '__main__')
+    except emu.SimulationEnd:
+        pass
+    finally:
+        sys.stdout = stdout
+    real_s = time.perf_counter() - t0
+    end_blocks = sys.getallocatedblocks()
+
+    samples = lis3dh.samples.head     # samples taken (wraps after ~2^29)
+    iters = max(1, steps.calls)
+    result = {'mode': mode,
+              'virtual_s': sim.clock.now_us() / 1000000,
+              'samples': samples,
+              'iterations': steps.calls,
+              'steps': lis3dh.global_steps,
+              'true_steps': int(sim.lis3dh.motion.steps),
+              'publishes': publish.calls,
+              'i2c_transactions_per_sample':
+                  sim.bus.transactions / max(1, samples),
+              'i2c_bytes_per_sample':
+                  (sim.bus.bytes_read + sim.bus.bytes_written) / max(1, samples)}
+    if trace_alloc:
+        result['alloc_blocks_per_iter'] = \
+            (end_blocks - steps.first_blocks) / iters
+        result['alloc_peak_bytes_per_iter'] = (steps.alloc_peak +
+            temp.alloc_peak) / iters
+    else:
+        result['samples_per_s'] = samples / real_s
+        result['get_steps_us_per_sample'] = \
+            steps.total_s * 1000000 / max(1, samples)
+        result['publish_ms_mean'] = \
+            publish.total_s * 1000 / max(1, publish.calls)
+        result['publish_ms_max'] = publish.max_s * 1000
+    return result
+
+def run_mode(mode, duration):   # timing run + allocation run, fresh processes
+    result = {}
+    for trace in (False, True):
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', mode,
+            '--duration', str(duration)]
+        if trace:
+            cmd.append('--trace-alloc')
+        out = subprocess.run(cmd, check = True, stdout = subprocess.PIPE,
+            universal_newlines = True).stdout
+        result.update(json.loads(out))
+    return result
+
+def regressions(results, baseline, tolerance):
+    old = {r['mode']: r for r in baseline['results']}
+    found = []
+    for r in results:
+        for key in GATED:
+            if r['mode'] in old and key in old[r['mode']]:
+                before = old[r['mode']][key]
+                if r[key] > before * (1 + tolerance) + 1e-9:
+                    found.append('{0} {1}: {2:.3f} -> {3:.3f}'.format(
+                        r['mode'], key, before, r[key]))
+    return found
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'benchmark the cw1 '
+        'pipeline on the emulated board')
+    parser.add_argument('--duration', type = float, default = 30,
+        help = 'virtual seconds per run (default: 30)')
+    parser.add_argument('--modes', default = ','.join(MODES),
+        help = 'comma separated subset of: ' + ', '.join(MODES))
+    parser.add_argument('--out', help = 'write results JSON to this file')
+    parser.add_argument('--baseline', help = 'results JSON to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.1)
+    parser.add_argument('--child', help = argparse.SUPPRESS)
+    parser.add_argument('--trace-alloc', action = 'store_true',
+        help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.duration, args.trace_alloc)))
+        return 0
+
+    results = [run_mode(m, args.duration) for m in args.modes.split(',')]
+    report = {'benchmark': 'cw1-pipeline', 'version': 1,
+              'duration_s': args.duration, 'python': sys.version.split()[0],
+              'results': results}
+    text = json.dumps(report, indent = 2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print('REGRESSION ' + line, file = sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+''' Build and deploy the cw1 firmware as precompiled bytecode
+    by default the board compiles every .py file it imports on each boot,
+    which is slow and leaves the heap fragmented. This tool:
+
+        build   cross-compiles the firmware modules to .mpy with mpy-cross
+                (into build/). main.py becomes app.mpy plus a one-line main.py
+                that imports it, since the board only runs main.py as source
+        freeze  writes a manifest.py for building MicroPython with the modules
+                frozen into the firmware image (no file system copy at all)
+        deploy  uploads source, bytecode or the frozen-build stub with ampy,
+                removing the copies of the other kind from the board (a .py on
+                the board takes precedence over the .mpy of the same name)
+        boot    soft-resets the board a few times and reads the boot lines
+                main.py prints (import time, free heap, ms until sampling), for
+                each variant given, and prints one JSON report to compare them.
+                main.py can only time itself from its first line, after the
+                board has loaded or compiled it, so variants are compared on
+                the host's time from the reset to the sampling line
+
+    usage: python3 tools/build.py build [--mpy-cross mpy-cross] [-O 2]
+           python3 tools/build.py freeze [--out build/manifest.py]
+           python3 tools/build.py deploy --port /dev/ttyUSB0 [--mode mpy]
+           python3 tools/build.py boot --port /dev/ttyUSB0 [--variants py,mpy]
+    deploy and boot need ampy (adafruit-ampy) and pyserial; --dry-run prints
+    the commands instead of running them. The mpy-cross version must match
+    the firmware (mpy-cross --version)
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+CW1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+# firmware modules, dependencies first. main.py is built as APP_MODULE
+MODULES = ('i2cbus', 'samplebuf', 'stepdetect', 'lis3dh', 'tmp007',
+           'payload', 'outbox', 'diag', 'mqttpublisher')
+APP_MODULE = 'app'
+BUILD_DIR = os.path.join(CW1_DIR, 'build')
+MPY_CROSS = 'mpy-cross'
+AMPY = 'ampy'
+BAUD = 115200
+BOOT_RUNS = 3           # soft resets per variant
+BOOT_TIMEOUT = 30       # unit: s. Wait for the sampling line after a reset
+
+# lines printed by main.py at start
+IMPORTS_LINE = re.compile(r'Imports: (\d+) ms, free heap: (\d+) bytes')
+SAMPLING_LINE = re.compile(r'Sampling (\d+) ms after main.py started')
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def stub_main():            # main.py when the application is precompiled
+    return "import {0}    # {0}.mpy or frozen: runs main()\n".format(APP_MODULE)
+
+def run(cmd, dry_run = False, check = True):
+    print(' '.join(cmd))
+    if dry_run:
+        return 0
+    return subprocess.run(cmd, check = check).returncode
+
+def build(args):
+    if not args.dry_run and shutil.which(args.mpy_cross) is None:
+        print('{0} not found: pip install mpy-cross, or build it from the '
+            'MicroPython source'.format(args.mpy_cross), file = sys.stderr)
+        return 1
+    os.makedirs(args.build_dir, exist_ok = True)
+    sources = [(m + '.py', m + '.mpy') for m in MODULES] + \
+        [('main.py', APP_MODULE + '.mpy')]
+    sizes = {}
+    for src, mpy in sources:
+        out = os.path.join(args.build_dir, mpy)
+        cmd = [args.mpy_cross, '-O{0}'.format(args.opt), '-o', out,
+            os.path.join(CW1_DIR, src)]
+        if args.march:
+            cmd.insert(1, '-march=' + args.march)
+        run(cmd, args.dry_run)
+        if not args.dry_run:
+            sizes[mpy] = [os.path.getsize(os.path.join(CW1_DIR, src)),
+                os.path.getsize(out)]
+    with open(os.path.join(args.build_dir, 'main.py'), 'w') as f:
+        f.write(stub_main())
+    if sizes:
+        print(json.dumps({'bytes': sizes}, indent = 2))  # [source, .mpy]
+    return 0
+
+def freeze(args):           # manifest for the port build (FROZEN_MANIFEST)
+    os.makedirs(args.build_dir, exist_ok = True)
+    app = os.path.join(args.build_dir, APP_MODULE + '.py')
+    shutil.copyfile(os.path.join(CW1_DIR, 'main.py'), app)
+    lines = ['# generated by tools/build.py freeze',
+             'include("$(PORT_DIR)/boards/manifest.py")']
+    for m in MODULES:
+        lines.append('module("{0}.py", base_path="{1}")'.format(m, CW1_DIR))
+    lines.append('module("{0}.py", base_path="{1}")'.format(APP_MODULE,
+        os.path.abspath(args.build_dir)))
+    with open(args.out, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    with open(os.path.join(args.build_dir, 'main.py'), 'w') as f:
+        f.write(stub_main())
+    print('wrote {0}. Build the firmware with\n'
+        '  make -C ports/esp8266 BOARD=ESP8266_GENERIC FROZEN_MANIFEST={0}\n'
+        'then flash it and run: tools/build.py deploy --mode frozen'.format(
+        os.path.abspath(args.out)))
+    return 0
+
+def deploy(args):
+    ampy = [args.ampy, '--port', args.port, '--baud', str(args.baud)]
+    stub = os.path.join(args.build_dir, 'main.py')
+    if args.mode == 'py':       # sources, compiled on the board at every boot
+        stale = [m + '.mpy' for m in MODULES] + [APP_MODULE + '.mpy']
+        files = [(os.path.join(CW1_DIR, m + '.py'), m + '.py')
+            for m in MODULES + ('main',)]
+    elif not os.path.exists(stub):
+        print('run build (or freeze) first', file = sys.stderr)
+        return 1
+    elif args.mode == 'mpy':
+        stale = [m + '.py' for m in MODULES]
+        files = [(os.path.join(args.build_dir, m + '.mpy'), m + '.mpy')
+            for m in MODULES + (APP_MODULE,)] + [(stub, 'main.py')]
+    else:                       # frozen: only main.py on the file system
+        stale = [m + ext for m in MODULES + (APP_MODULE,)
+            for ext in ('.py', '.mpy')]
+        files = [(stub, 'main.py')]
+    for name in stale:          # may not be there
+        run(ampy + ['rm', name], args.dry_run, check = False)
+    for src, dest in files:
+        run(ampy + ['put', src, dest], args.dry_run)
+    return 0
+
+def read_boot(port, baud, timeout):     # soft reset, parse the boot lines
+    import serial               # pyserial, installed with ampy
+    result = {}
+    with serial.Serial(port, baud, timeout = 0.1) as s:
+        s.write(b'\r\x03\x03')          # stop the running program
+        time.sleep(0.2)
+        s.reset_input_buffer()
+        t0 = time.monotonic()
+        s.write(b'\x04')                # soft reset: boot.py, main.py
+        line = b''
+        while time.monotonic() - t0 < timeout:
+            line += s.readline()
+            if not line.endswith(b'\n'):
+                continue
+            text = line.decode('utf-8', 'replace')
+            line = b''
+            m = IMPORTS_LINE.search(text)
+            if m:
+                result['import_ms'] = int(m.group(1))
+                result['heap_free'] = int(m.group(2))
+            m = SAMPLING_LINE.search(text)
+            if m:
+                result['sampling_ms'] = int(m.group(1))
+                result['host_reset_to_sampling_ms'] = \
+                    round((time.monotonic() - t0) * 1000)
+                break
+        s.write(b'\x03')                # leave the board at the REPL
+    return result
+
+def boot(args):
+    report = {'port': args.port, 'runs': args.runs, 'variants': {}}
+    for variant in args.variants.split(','):
+        if args.deploy:
+            deploy(argparse.Namespace(**dict(vars(args), mode = variant)))
+        if args.dry_run:
+            continue
+        runs = [read_boot(args.port, args.baud, args.timeout)
+            for _ in range(args.runs)]
+        summary = {'runs': runs}
+        for key in ('import_ms', 'heap_free', 'sampling_ms',
+                'host_reset_to_sampling_ms'):
+            values = [r[key] for r in runs if key in r]
+            if values:
+                summary[key] = round(sum(values) / len(values))
+        report['variants'][variant] = summary
+    # sampling_ms starts at main.py's first line and misses loading it, which
+    #   is what the variants differ in; the host's clock starts at the reset
+    base = report['variants'].get('py', {}).get('host_reset_to_sampling_ms')
+    for name, summary in report['variants'].items():
+        if base and summary.get('host_reset_to_sampling_ms') is not None:
+            summary['sampling_vs_py'] = round(
+                summary['host_reset_to_sampling_ms'] / base, 3)
+    print(json.dumps(report, indent = 2))
+    return 0
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'build, deploy and time '
+        'the cw1 firmware')
+    parser.add_argument('--build-dir', default = BUILD_DIR)
+    parser.add_argument('--dry-run', action = 'store_true',
+        help = 'print the commands only')
+    sub = parser.add_subparsers(dest = 'command')
+    sub.required = True
+
+    p = sub.add_parser('build', help = 'cross-compile to .mpy')
+    p.add_argument('--mpy-cross', default = MPY_CROSS)
+    p.add_argument('-O', dest = 'opt', type = int, default = 2,
+        help = 'optimisation level: 1+ drops asserts, 3 line numbers')
+    p.add_argument('--march', help = 'e.g. xtensa, only for native code')
+
+    p = sub.add_parser('freeze', help = 'write a manifest for frozen modules')
+    p.add_argument('--out', default = os.path.join(BUILD_DIR, 'manifest.py'))
+
+    for name, text in (('deploy', 'upload to the board'),
+                       ('boot', 'compare boot times on the board')):
+        p = sub.add_parser(name, help = text)
+        p.add_argument('--port', required = True)
+        p.add_argument('--baud', type = int, default = BAUD)
+        p.add_argument('--ampy', default = AMPY)
+        if name == 'deploy':
+            p.add_argument('--mode', choices = ('py', 'mpy', 'frozen'),
+                default = 'mpy')
+        else:
+            p.add_argument('--variants', default = 'py,mpy',
+                help = 'comma separated: py, mpy, frozen (needs the frozen '
+                'firmware flashed)')
+            p.add_argument('--runs', type = int, default = BOOT_RUNS)
+            p.add_argument('--timeout', type = float, default = BOOT_TIMEOUT)
+            p.add_argument('--no-deploy', dest = 'deploy',
+                action = 'store_false',
+                help = 'time what is on the board (one variant)')
+    args = parser.parse_args(argv)
+    return {'build': build, 'freeze': freeze, 'deploy': deploy,
+            'boot': boot}[args.command](args)
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+''' Load generator: a fleet of virtual pedometers publishing to the ingest side
+    every virtual device walks at its own cadence and publishes the messages
+    the firmware sends: readings as built by compile_data() (temp, time, ts,
+    tick, steps, cal), numbered and batched like mqttpublisher and encoded with
+    payload.py. A subscriber receives everything on /esys/+/pedometer, measures
+    the lag from publish to receipt and (with --ingest) hands the messages to
+    ingest.Ingest, with linkstats.LinkMonitor as a sink.
+    All devices run as asyncio tasks in one process
+
+    targets:
+        --inproc            in-process broker (emu.broker), no network
+        --broker HOST:PORT  a local MQTT broker, over TCP (MQTT 3.1.1, QoS 0)
+        --serve PORT        also start a minimal MQTT broker on this port
+
+    usage: python3 tools/loadgen.py --devices 1000 --rate 0.05 --duration 60
+              [--burst 5] [--storm-every 20 --storm-fraction 0.5]
+              [--format binary|json] [--batch 5] [--ingest]
+    prints one JSON report: publish rate achieved, messages received and lost,
+    subscriber lag percentiles, reconnects, and with --ingest the loss and
+    latency seen by linkstats
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+CW1_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CW1_DIR)
+import payload
+from emu.broker import Broker, topic_matches
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+TOPIC = '/esys/{0}/pedometer'
+TOPIC_FILTER = '/esys/+/pedometer'
+CAL_FACTOR = 0.037      # unit: cal/step. main.User(20, 70, 1.80, 3.5)
+SEND_INTERVAL = 4       # unit: s. Between readings, as main.SEND_INTERVAL
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+# MQTT 3.1.1 packets, QoS 0 only
+def _length(n):             # remaining length, variable byte integer
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+def _string(s):
+    b = s.encode() if isinstance(s, str) else s
+    return struct.pack('>H', len(b)) + b
+
+def packet(kind, body = b''):
+    return bytes([kind]) + _length(len(body)) + body
+
+def connect_packet(client_id, keepalive = 60):
+    return packet(CONNECT, _string('MQTT') + bytes([4, 0x02]) +
+        struct.pack('>H', keepalive) + _string(client_id))
+
+def publish_packet(topic, msg):
+    return packet(PUBLISH, _string(topic) + bytes(msg))
+
+def subscribe_packet(topic_filter, packet_id = 1):
+    return packet(SUBSCRIBE, struct.pack('>H', packet_id) +
+        _string(topic_filter) + b'\x00')
+
+async def read_packet(reader):  # -> (first byte, body)
+    head = await reader.readexactly(1)
+    n = shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        n |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return head[0], await reader.readexactly(n) if n else b''
+
+def parse_publish(body):
+    n = struct.unpack_from('>H', body, 0)[0]
+    return body[2:2 + n].decode(), body[2 + n:]
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class MiniBroker:           # just enough of a broker for load tests
+    def __init__(self):
+        self.subscribers = []       # (filter, writer)
+        self.forwarded = 0
+
+    async def serve(self, port):
+        return await asyncio.start_server(self._client, '127.0.0.1', port)
+
+    async def _client(self, reader, writer):
+        subs = []
+        try:
+            while True:
+                kind, body = await read_packet(reader)
+                t = kind & 0xF0
+                if t == CONNECT:
+                    writer.write(b'\x20\x02\x00\x00')
+                elif t == PUBLISH:
+                    topic = parse_publish(body)[0]
+                    data = bytes([kind]) + _length(len(body)) + body
+                    for topic_filter, w in self.subscribers:
+                        if topic_matches(topic_filter, topic):
+                            w.write(data)
+                            self.forwarded += 1
+                elif t == (SUBSCRIBE & 0xF0):
+                    packet_id = body[:2]
+                    n = struct.unpack_from('>H', body, 2)[0]
+                    topic_filter = body[4:4 + n].decode()
+                    subs.append((topic_filter, writer))
+                    self.subscribers.append(subs[-1])
+                    writer.write(packet(SUBACK, packet_id + b'\x00'))
+                elif t == PINGREQ:
+                    writer.write(b'\xd0\x00')
+                elif t == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            for s in subs:
+                self.subscribers.remove(s)
+            writer.close()
+
+
+class TcpLink:              # one device's MQTT connection
+    def __init__(self, host, port, client_id):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.writer = None
+        self.connecting = None      # Fleet._connect() task in progress
+
+    async def connect(self):
+        if self.writer is not None:     # never leak the previous socket
+            self.writer.close()
+            self.writer = None
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(connect_packet(self.client_id))
+        kind, body = await read_packet(reader)
+        if kind != CONNACK or body[1] != 0:
+            writer.close()
+            raise ConnectionError('connection refused')
+        self._reader = reader
+        self.writer = writer
+
+    async def publish(self, topic, msg):
+        if self.writer is None:
+            raise ConnectionError('not connected')
+        self.writer.write(publish_packet(topic, msg))
+        if self.writer.transport.get_write_buffer_size() > 65536:
+            await self.writer.drain()
+
+    async def disconnect(self):
+        if self.writer is not None:
+            self.writer.write(packet(DISCONNECT))
+            self.writer.close()
+            self.writer = None
+
+
+class InprocLink:           # one device's session with the in-process broker
+    def __init__(self, broker, client_id):
+        self.broker = broker
+        self.client_id = client_id
+        self.connecting = None      # Fleet._connect() task in progress
+
+    async def connect(self):
+        self.broker.connect(self)
+
+    async def publish(self, topic, msg):
+        if not self.broker.is_connected(self):
+            raise ConnectionError('not connected')
+        self.broker.publish(0, topic, msg, self.client_id)
+
+    async def disconnect(self):
+        self.broker.disconnect(self)
+
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        self.sent = {}              # (topic, payload) -> publish time
+        self.published = 0
+        self.received = 0
+        self.unexpected = 0
+        self.connects = 0
+        self.lags = []              # unit: s
+        self.ingest = None
+        self.link_stats = None      # linkstats.LinkMonitor, with ingest
+        self.broker = None
+        self.links = []
+
+    def receive(self, topic, msg):  # subscriber side
+        now = time.perf_counter()
+        t0 = self.sent.pop((topic, bytes(msg)), None)
+        if t0 is None:
+            self.unexpected += 1
+        else:
+            self.lags.append(now - t0)
+        self.received += 1
+        if self.ingest is not None:
+            self.ingest.feed(topic, msg)
+
+    def readings(self, rng, name):  # endless compile_data() records
+        cadence = rng.uniform(80, 130) / 60         # unit: steps/s
+        steps = 0
+        seq = 0
+        ts = 572000000 + rng.randrange(1000)        # s since 2000
+        while True:
+            ts += SEND_INTERVAL
+            steps += int(cadence * SEND_INTERVAL + rng.random())
+            t = time.gmtime(payload.unix_time(ts))
+            yield {'temp': round(rng.gauss(33.0, 0.3), 2),
+                   'time': '{:d}-{:d}-{:d} {:02d}:{:02d}:{:02d}'.format(
+                       t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min,
+                       t.tm_sec),
+                   'ts': ts,
+                   'tick': int(time.perf_counter() * 1000) % payload.TICKS_MOD,
+                   'steps': steps, 'cal': steps * CAL_FACTOR, 'seq': seq}
+            seq = (seq + 1) % payload.SEQ_MOD
+
+    def encode(self, readings):
+        if self.args.format == payload.JSON:
+            return payload.encode_json(readings).encode()
+        return bytes(payload.encode(readings))
+
+    async def device(self, i, end):
+        args = self.args
+        rng = random.Random(args.seed * 100003 + i)
+        name = 'dev{0:05d}'.format(i)
+        topic = TOPIC.format(name)
+        link = self.links[i]
+        await self._connect(link)
+        source = self.readings(rng, name)
+        period = args.burst / args.rate     # unit: s. One burst per period
+        await asyncio.sleep(rng.uniform(0, period))     # spread the starts
+        while time.perf_counter() < end:
+            for _ in range(args.burst):
+                msg = self.encode([next(source) for _ in range(args.batch)])
+                self.sent[(topic, msg)] = time.perf_counter()
+                try:
+                    await link.publish(topic, msg)
+                    self.published += 1
+                except (ConnectionError, OSError):
+                    del self.sent[(topic, msg)]
+                    await self._connect(link)
+            gap = rng.expovariate(1 / period) if args.poisson else period
+            await asyncio.sleep(max(0, min(gap, end - time.perf_counter())))
+        await link.disconnect()
+
+    async def _connect(self, link):
+        # a storm and the device itself may both want to reconnect a link:
+        #   they share one attempt, so each drop is one session and one count
+        if link.connecting is None or link.connecting.done():
+            link.connecting = asyncio.ensure_future(self._reconnect(link))
+        await asyncio.shield(link.connecting)
+
+    async def _reconnect(self, link):
+        while True:
+            try:
+                await link.connect()
+                self.connects += 1
+                return
+            except (ConnectionError, OSError, EOFError):
+                await asyncio.sleep(0.1)
+
+    async def storms(self, end):    # drop and reconnect many devices at once
+        args = self.args
+        rng = random.Random(args.seed)
+        while time.perf_counter() + args.storm_every < end:
+            await asyncio.sleep(args.storm_every)
+            victims = rng.sample(self.links, int(len(self.links) *
+                args.storm_fraction))
+            for link in victims:
+                await link.disconnect()
+            await asyncio.gather(*(self._connect(link) for link in victims))
+
+    async def subscribe_tcp(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(connect_packet('loadgen-sub'))
+        await read_packet(reader)
+        writer.write(subscribe_packet(TOPIC_FILTER))
+        await read_packet(reader)
+        try:
+            while True:
+                kind, body = await read_packet(reader)
+                if kind & 0xF0 == PUBLISH:
+                    self.receive(*parse_publish(body))
+        except (asyncio.IncompleteReadError, ConnectionError,
+                asyncio.CancelledError):
+            writer.close()
+
+    async def run(self):
+        args = self.args
+        server = sub = None
+        if args.serve:
+            server = await MiniBroker().serve(args.serve)
+        if args.inproc:
+            self.broker = Broker(keep = 1)
+            self.broker.subscribe(TOPIC_FILTER,
+                lambda m: self.receive(m.topic, m.payload))
+            self.links = [InprocLink(self.broker, 'dev{0}'.format(i))
+                for i in range(args.devices)]
+        else:
+            host, port = args.broker.split(':')
+            sub = asyncio.ensure_future(self.subscribe_tcp(host, int(port)))
+            await asyncio.sleep(0.2)
+            self.links = [TcpLink(host, int(port), 'dev{0}'.format(i))
+                for i in range(args.devices)]
+
+        t0 = time.perf_counter()
+        end = t0 + args.duration
+        tasks = [self.device(i, end) for i in range(args.devices)]
+        if args.storm_every:
+            tasks.append(self.storms(end))
+        await asyncio.gather(*tasks)
+        publish_s = time.perf_counter() - t0
+        await asyncio.sleep(args.drain)     # let the subscriber catch up
+        if sub is not None:
+            sub.cancel()
+        if server is not None:
+            server.close()
+        if self.ingest is not None:     # process what is queued, for report()
+            self.ingest.stop()
+        return publish_s
+
+    def report(self, publish_s):
+        lags = sorted(self.lags)
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000,
+                3) if lags else None
+        r = {'devices': self.args.devices,
+             'target': 'inproc' if self.args.inproc else self.args.broker,
+             'format': self.args.format,
+             'duration_s': round(publish_s, 2),
+             'published': self.published,
+             'publish_rate': round(self.published / publish_s, 1),
+             'target_rate': self.args.devices * self.args.rate,
+             'received': self.received,
+             'lost': len(self.sent),
+             'unexpected': self.unexpected,
+             'connects': self.connects,
+             'lag_ms_p50': pct(0.5), 'lag_ms_p95': pct(0.95),
+             'lag_ms_p99': pct(0.99), 'lag_ms_max': pct(1.0)}
+        if self.ingest is not None:
+            r['ingest_processed'] = self.ingest.processed
+            r['ingest_dropped'] = self.ingest.dropped
+            r['ingest_devices'] = len(self.ingest.devices)
+        if self.link_stats is not None:
+            stats = self.link_stats.devices.values()
+            from linkstats import Histogram
+            latency = Histogram()
+            for s in stats:
+                latency.merge(s.latency)
+            r['link_lost'] = sum(s.lost for s in stats)
+            r['link_duplicates'] = sum(s.duplicates for s in stats)
+            r['link_reordered'] = sum(s.reordered for s in stats)
+            r['link_latency_ms'] = latency.summary()
+        return r
+
+
+
+#//////////////////// main program ////////////////////////////////////////////
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'publish pedometer '
+        'messages from many virtual devices')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--inproc', action = 'store_true',
+        help = 'use an in-process broker (default unless --broker)')
+    target.add_argument('--broker', help = 'HOST:PORT of an MQTT broker')
+    parser.add_argument('--serve', type = int, metavar = 'PORT',
+        help = 'start a minimal local broker on PORT (use with --broker)')
+    parser.add_argument('--devices', type = int, default = 100)
+    parser.add_argument('--rate', type = float, default = 0.05,
+        help = 'messages/s per device (default: one batch every 20 s)')
+    parser.add_argument('--batch', type = int, default = 5,
+        help = 'readings per message')
+    parser.add_argument('--burst', type = int, default = 1,
+        help = 'messages sent back to back, same average rate')
+    parser.add_argument('--poisson', action = 'store_true',
+        help = 'random (exponential) gaps between bursts')
+    parser.add_argument('--storm-every', type = float, default = 0,
+        help = 'seconds between reconnect storms (0: none)')
+    parser.add_argument('--storm-fraction', type = float, default = 0.5,
+        help = 'share of devices dropped in each storm')
+    parser.add_argument('--format', choices = (payload.BINARY, payload.JSON),
+        default = payload.BINARY)
+    parser.add_argument('--duration', type = float, default = 30)
+    parser.add_argument('--drain', type = float, default = 1,
+        help = 'seconds to wait for the subscriber after publishing')
+    parser.add_argument('--ingest', action = 'store_true',
+        help = 'pass received messages to ingest.Ingest')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args(argv)
+    if not args.broker:
+        args.inproc = True
+
+    fleet = Fleet(args)
+    if args.ingest:
+        from ingest import Ingest
+        from linkstats import LinkMonitor
+        fleet.ingest = Ingest()
+        fleet.link_stats = LinkMonitor()
+        fleet.ingest.add_sink(fleet.link_stats.sink)
+        fleet.ingest.start()
+    publish_s = asyncio.run(fleet.run())
+    print(json.dumps(fleet.report(publish_s), indent = 2))
+    return 0
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+''' Replay recorded LIS3DH traces through the step detector on a PC
+    traces are written on the device by lis3dh.start_recording(). The file is
+    memory-mapped and fed to stepdetect_np.StepDetectorNP in chunks, so
+    multi-hour traces replay in seconds without being loaded into RAM. The
+    result is identical to what stepdetect.StepDetector counts on the device
+
+    usage: python3 tools/replay.py trace.bin [more.bin ...]
+                [--set STEP_THR_MIN=80 ...] [--engine numpy|python]
+                [--chunk N] [--rate HZ]
+    --set overrides stepdetect parameters, for tuning thresholds offline
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stepdetect
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+# must match TRACE_* in lis3dh.py
+TRACE_MAGIC = b'LTRC'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sBBHHHI')
+TRACE_RECORD = struct.Struct('<Ihhh')
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def read_header(path):
+    with open(path, 'rb') as f:
+        raw = f.read(TRACE_HEADER.size)
+    if len(raw) < TRACE_HEADER.size:
+        raise ValueError('{0}: not a trace file (too short)'.format(path))
+    magic, version, record_size, rate_hz, counts_per_g, range_g, start_tick = \
+        TRACE_HEADER.unpack(raw)
+    if magic != TRACE_MAGIC:
+        raise ValueError('{0}: not a trace file (bad magic)'.format(path))
+    if version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+        raise ValueError('{0}: unsupported trace version {1}'.format(path,
+            version))
+    n = (os.path.getsize(path) - TRACE_HEADER.size) // record_size
+    return {'rate_hz': rate_hz, 'counts_per_g': counts_per_g,
+            'range_g': range_g, 'start_tick': start_tick, 'records': n}
+
+def open_records(path, header):     # numpy memmap of the records, not loaded
+    import numpy as np
+    dtype = np.dtype([('tick', '<u4'), ('x', '<i2'), ('y', '<i2'),
+        ('z', '<i2')])
+    if header['records'] == 0:
+        return np.zeros(0, dtype = dtype)
+    return np.memmap(path, dtype = dtype, mode = 'r',
+        offset = TRACE_HEADER.size, shape = (header['records'],))
+
+def replay_numpy(path, header, rate_hz, chunk):
+    from stepdetect_np import StepDetectorNP
+    det = StepDetectorNP(rate_hz, header['counts_per_g'])
+    rec = open_records(path, header)
+    for start in range(0, len(rec), chunk):
+        part = rec[start:start + chunk]
+        det.process(part['tick'], part['x'], part['y'], part['z'])
+    return det.steps
+
+def replay_python(path, header, rate_hz, chunk):    # the on-device engine
+    det = stepdetect.StepDetector(rate_hz, header['counts_per_g'])
+    end = TRACE_HEADER.size + header['records'] * TRACE_RECORD.size
+    with open(path, 'rb') as f:
+        if header['records'] == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)[TRACE_HEADER.size:end]
+            for tick, x, y, z in TRACE_RECORD.iter_unpack(view):
+                det.update(x, y, z, tick)
+            view.release()
+    return det.steps
+
+def replay(path, engine = 'numpy', chunk = 1 << 20, rate_hz = None):
+    header = read_header(path)
+    rate = rate_hz or header['rate_hz']
+    t0 = time.perf_counter()
+    if engine == 'numpy':
+        steps = replay_numpy(path, header, rate, chunk)
+    else:
+        steps = replay_python(path, header, rate, chunk)
+    real_s = time.perf_counter() - t0
+    return {'file': path, 'engine': engine, 'rate_hz': rate,
+            'records': header['records'],
+            'trace_s': header['records'] / rate if rate else 0,
+            'steps': steps, 'replay_s': real_s,
+            'samples_per_s': header['records'] / real_s if real_s else 0}
+
+def set_param(text):        # 'NAME=value' -> override stepdetect.NAME
+    name, value = text.split('=', 1)
+    if not hasattr(stepdetect, name):
+        raise argparse.ArgumentTypeError('unknown parameter ' + name)
+    setattr(stepdetect, name, int(value))
+    if name == 'STEP_MAX_RPM':
+        stepdetect.STEP_MIN_INTERVAL_MS = 60000 // int(value)
+    return text
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'replay LIS3DH traces '
+        'through the step detector')
+    parser.add_argument('traces', nargs = '+')
+    parser.add_argument('--engine', choices = ('numpy', 'python'),
+        default = 'numpy')
+    parser.add_argument('--chunk', type = int, default = 1 << 20,
+        help = 'records per chunk (numpy engine)')
+    parser.add_argument('--rate', type = int,
+        help = 'override the data rate in the trace header')
+    parser.add_argument('--set', type = set_param, action = 'append',
+        default = [], metavar = 'NAME=VALUE',
+        help = 'override a stepdetect parameter')
+    args = parser.parse_args(argv)
+
+    for path in args.traces:
+        result = replay(path, args.engine, args.chunk, args.rate)
+        result['params'] = args.set
+        print(json.dumps(result))
+    return 0
+
+
+
+#//////////////////// call main() /////////////////////////////////////////////
+if __name__ == '__main__':
+    sys.exit(main())
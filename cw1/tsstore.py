@@ -0,0 +1,199 @@
+''' Time-series store for pedometer readings (SQLite)
+    one row per device and timestamp with steps, calories and temperature.
+    Rows are clustered by (device, time) so the history of one device is a
+    range scan, and there is an index on time for queries across devices.
+    Writers only append to an in-memory list; a background thread inserts the
+    rows with executemany() in one transaction every FLUSH_INTERVAL or every
+    BATCH_ROWS rows, so a message costs no commit of its own. The database is
+    in WAL mode, so queries do not block the writer
+
+        store = TimeSeriesStore('pedometer.db')
+        store.add('LLLJ', 1518686600, steps = 120, temp = 33.1, cal = 4.5)
+        store.history('LLLJ', start = 1518686000)
+        store.close()
+'''
+
+
+
+#//////////////////// imports /////////////////////////////////////////////////
+import sqlite3
+import threading
+import time
+
+import payload
+
+
+
+#//////////////////// parameters //////////////////////////////////////////////
+FLUSH_INTERVAL = 0.5    # unit: second. Longest time a row waits to be written
+BATCH_ROWS = 5000       # unit: rows. Write as soon as this many are waiting
+
+
+
+#//////////////////// constants ///////////////////////////////////////////////
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (
+    id      INTEGER PRIMARY KEY,
+    name    TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS readings (
+    device  INTEGER NOT NULL REFERENCES devices(id),
+    t       INTEGER NOT NULL,       -- Unix time, s
+    steps   INTEGER,
+    temp    REAL,                   -- C
+    cal     REAL,
+    PRIMARY KEY (device, t)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS readings_t ON readings (t);
+'''
+
+
+
+#//////////////////// class ///////////////////////////////////////////////////
+class TimeSeriesStore:
+    def __init__(self, path = 'pedometer.db', flush_interval = FLUSH_INTERVAL,
+            batch_rows = BATCH_ROWS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        self.rows_written = 0
+        self.commits = 0
+
+        self._pending = []          # (device name, t, steps, temp, cal)
+        self._lock = threading.Lock()           # _pending
+        self._write_lock = threading.Lock()     # held while writing a batch
+        self._wake = threading.Event()
+        self._local = threading.local()     # query connection per thread
+        self._device_ids = {}
+
+        self._db = self._connect()  # the writer's connection
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        for device_id, name in self._db.execute('SELECT id, name FROM devices'):
+            self._device_ids[name] = device_id
+
+        self._running = True
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread = False)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')   # durable at checkpoints
+        return db
+
+    # writing
+    def add(self, device, t, steps = None, temp = None, cal = None):
+        with self._lock:
+            self._pending.append((device, int(t), steps, temp, cal))
+            n = len(self._pending)
+        if n >= self.batch_rows:
+            self._wake.set()
+
+    def sink(self, device, reading):    # ingest.Ingest sink: device state
+        state = device.state
+        t = payload.unix_time(reading['ts']) if 'ts' in reading \
+            else int(device.last_seen or time.time())
+        self.add(device.id, t, state.get('steps'), state.get('temp'),
+            state.get('cal'))
+
+    def flush(self):                # write what is waiting, from any thread
+        self._wake.set()
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+            time.sleep(0.001)
+        with self._write_lock:      # the last batch taken has been committed
+            pass
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write()
+        self._write()
+
+    def _write(self):
+        with self._write_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if rows:
+                self._insert(rows)
+
+    def _insert(self, rows):
+        with self._db:                          # one transaction
+            for name in set(r[0] for r in rows):
+                if name not in self._device_ids:
+                    self._db.execute(
+                        'INSERT OR IGNORE INTO devices (name) VALUES (?)',
+                        (name,))
+                    self._device_ids[name] = self._db.execute(
+                        'SELECT id FROM devices WHERE name = ?',
+                        (name,)).fetchone()[0]
+            ids = self._device_ids
+            self._db.executemany('INSERT OR REPLACE INTO readings '
+                '(device, t, steps, temp, cal) VALUES (?, ?, ?, ?, ?)',
+                [(ids[r[0]],) + r[1:] for r in rows])
+        self.rows_written += len(rows)
+        self.commits += 1
+
+    def close(self):
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._db.close()
+
+    # queries: rows as dicts, oldest first. start and end are Unix times, end
+    #   excluded
+    def _query_db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+            db.row_factory = sqlite3.Row
+        return db
+
+    def devices(self):
+        return [r[0] for r in self._query_db().execute(
+            'SELECT name FROM devices ORDER BY name')]
+
+    def history(self, device, start = None, end = None, limit = None):
+        sql = 'SELECT r.t, r.steps, r.temp, r.cal FROM readings r ' \
+            'JOIN devices d ON d.id = r.device WHERE d.name = ?'
+        args = [device]
+        sql, args = _time_range(sql, args, start, end)
+        sql += ' ORDER BY r.t'
+        if limit is not None:       # the most recent rows
+            sql = 'SELECT * FROM (' + sql + ' DESC LIMIT ?) ORDER BY t'
+            args.append(limit)
+        return [dict(r) for r in self._query_db().execute(sql, args)]
+
+    def range(self, start, end):    # every device
+        sql = 'SELECT d.name AS device, r.t, r.steps, r.temp, r.cal ' \
+            'FROM readings r JOIN devices d ON d.id = r.device WHERE 1'
+        sql, args = _time_range(sql, [], start, end)
+        sql += ' ORDER BY r.t'
+        return [dict(r) for r in self._query_db().execute(sql, args)]
+
+    def latest(self, device):
+        rows = self.history(device, limit = 1)
+        return rows[0] if rows else None
+
+    def steps_between(self, device, start, end):    # steps taken in [start, end)
+        rows = self._query_db().execute('SELECT MIN(r.steps), MAX(r.steps) '
+            'FROM readings r JOIN devices d ON d.id = r.device '
+            'WHERE d.name = ? AND r.t >= ? AND r.t < ?',
+            (device, start, end)).fetchone()
+        return 0 if rows[0] is None else rows[1] - rows[0]
+
+
+
+#//////////////////// functions ///////////////////////////////////////////////
+def _time_range(sql, args, start, end):
+    if start is not None:
+        sql += ' AND r.t >= ?'
+        args.append(int(start))
+    if end is not None:
+        sql += ' AND r.t < ?'
+        args.append(int(end))
+    return sql, args